@@ -1,10 +1,10 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
-from django.db.models.expressions import RawSQL
+from django.db import transaction
 from django.urls import reverse
 from django.utils.safestring import mark_safe
 from sorl.thumbnail import get_thumbnail
-from . import models, blockchain
+from . import models, minting, outbox
 
 
 @admin.register(models.User)
@@ -64,7 +64,7 @@ class ShareInline(admin.TabularInline):
 
 @admin.register(models.Project)
 class ProjectAdmin(admin.ModelAdmin):
-    list_display = ('title', 'artist', 'created_on', 'status')
+    list_display = ('title', 'artist', 'created_on', 'status', 'shares_num', 'patrons_count')
     list_filter = ('status', )
     search_fields = ('title', 'artist__username')
     inlines = [ProjectUpdate, ShareInline]
@@ -90,27 +90,57 @@ class ProjectAdmin(admin.ModelAdmin):
         return fields
 
     def save_model(self, request, obj, form, change):
-        from django.db.models.expressions import RawSQL
-        from .models import Project, Share
-        from django.utils import timezone
-        projects = Project.objects.filter(pk__in=RawSQL(f'''
-            SELECT id FROM {Project.objects.model._meta.db_table} 
-            WHERE status=%s AND (deadline < %s OR max_shares > 0
-                AND (SELECT sum(quantity) FROM artcrowd_share
-                WHERE project_id=artcrowd_project.id) >= max_shares)
-        ''', (Project.OPEN, timezone.now()))).all()
-        obj.save()
-        #return blockchain.buy_shares(obj, 3)
-        if form.initial.get('status') != form.cleaned_data['status']:
-            if form.cleaned_data['status'] == models.Project.REFUNDED:
-                blockchain.refund(obj)
-                obj.project_shares.all().delete()
-            elif form.cleaned_data['status'] == models.Project.COMPLETED:
-                blockchain.update_project_status(obj)
-                meta_url = reverse('project_metadata', args=(obj.id,))
-                meta_url = request.build_absolute_uri(meta_url)
-                blockchain.generate_tokens(obj, meta_url)
-            elif form.cleaned_data['status'] == models.Project.OPEN:
-                blockchain.create_project(obj)
-            elif form.cleaned_data['status'] == models.Project.SALE_CLOSED:
-                blockchain.update_project_status(obj)
+        with transaction.atomic():
+            obj.save()
+            #return blockchain.buy_shares(obj, 3)
+            if form.initial.get('status') != form.cleaned_data['status']:
+                if form.cleaned_data['status'] == models.Project.REFUNDED:
+                    wallets = list(set(obj.project_shares.values_list('patron__tzwallet', flat=True)))
+                    outbox.enqueue(models.OutboxOperation.REFUND_ALL, obj, status=obj.status, wallets=wallets)
+                    obj.project_shares.all().delete()
+                elif form.cleaned_data['status'] == models.Project.COMPLETED:
+                    meta_url = reverse('project_metadata', args=(obj.id,))
+                    meta_url = request.build_absolute_uri(meta_url)
+                    minting.create_job(obj, meta_url)
+                elif form.cleaned_data['status'] == models.Project.OPEN:
+                    outbox.enqueue(models.OutboxOperation.CREATE_PROJECT, obj, status=obj.status)
+                elif form.cleaned_data['status'] == models.Project.SALE_CLOSED:
+                    outbox.enqueue(models.OutboxOperation.UPDATE_PROJECT_STATUS, obj, status=obj.status)
+
+
+@admin.register(models.OutboxOperation)
+class OutboxOperationAdmin(admin.ModelAdmin):
+    list_display = ('id', 'kind', 'project', 'status', 'attempts', 'next_attempt_on', 'ophash')
+    list_filter = ('status', 'kind')
+    search_fields = ('ophash', )
+    readonly_fields = ('kind', 'project', 'payload', 'attempts', 'ophash', 'error', 'created_on', 'sent_on')
+    list_per_page = 50
+
+
+class MintingChunkInline(admin.TabularInline):
+    extra = 0
+    model = models.MintingChunk
+    readonly_fields = ['index', 'holdings', 'status', 'ophash', 'level', 'error', 'updated_on']
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(models.MintingJob)
+class MintingJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'project', 'status', 'token_id', 'created_on', 'updated_on')
+    list_filter = ('status', )
+    readonly_fields = ('project', 'meta_url', 'token_id', 'status', 'error', 'created_on', 'updated_on')
+    inlines = [MintingChunkInline]
+    actions = ['pause', 'resume']
+
+    @admin.action(description='Pause selected jobs')
+    def pause(self, request, queryset):
+        minting.pause(queryset)
+
+    @admin.action(description='Resume or retry selected jobs')
+    def resume(self, request, queryset):
+        minting.resume(queryset)
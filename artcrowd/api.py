@@ -2,12 +2,15 @@ from django.shortcuts import get_object_or_404
 from django.urls import path, reverse
 from django.contrib.auth.models import Group
 from django.core.exceptions import PermissionDenied, BadRequest
-from django.db.models import Count, Sum, Subquery, OuterRef
-from django.db.models.functions import Coalesce
+from django.db import transaction
+from django.db.models import Count, Max, Q, Subquery, OuterRef, Prefetch
 from django.utils import timezone
+from django.utils.crypto import constant_time_compare
 from django.http import HttpResponse
 from django.conf import settings
 from rest_framework import generics, permissions, serializers as drf_serializers
+from rest_framework.exceptions import ParseError
+from rest_framework.pagination import CursorPagination
 from rest_framework.parsers import MultiPartParser
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
@@ -16,7 +19,7 @@ from rest_framework.authtoken import views as auth_views
 from rest_framework.throttling import ScopedRateThrottle
 from rest_framework.filters import OrderingFilter, BaseFilterBackend
 from drf_spectacular.views import SpectacularAPIView, SpectacularSwaggerView
-from . import models, serializers, blockchain, wallet_auth
+from . import models, serializers, blockchain, metrics, outbox, response_cache, search, tracker, wallet_auth
 
 
 class LoginByWalletView(auth_views.ObtainAuthToken):
@@ -48,11 +51,16 @@ class CheckinView(generics.views.APIView):
         return Response()
 
 
-class ProfileView(generics.RetrieveAPIView):
-    queryset = models.User.objects.all()
+class ProfileView(response_cache.ConditionalGetMixin, generics.RetrieveAPIView):
+    queryset = models.User.objects.select_related('stats')
     serializer_class = serializers.UserSerializer
     lookup_field = 'username'
 
+    def get_validators(self, request):
+        row = models.User.objects.filter(username=self.kwargs['username']).values_list(
+            'updated_on', 'stats__updated_on', *[f'stats__{field}' for field in models.UserStats.COUNTS]).first()
+        return None if row is None else (row, max(time for time in row[:2] if time))
+
     """def get1(self, request):
         data = {
             'projects': models.Project.objects.filter(artist=request.user).all(),
@@ -64,8 +72,35 @@ class ProfileView(generics.RetrieveAPIView):
         return Response(serializer.data)"""
 
 
-class ProjectsList(generics.ListAPIView):
-    """All projects"""
+class ProjectsCursorPagination(CursorPagination):
+    """Cursor pages of the projects feed, ordered by creation or by deadline. DRF positions the cursor on the first
+    ordering field only and skips the projects sharing its value with an offset kept in the cursor, the id only
+    makes the order stable. A deep page costs about the same as the first one, unless many projects share
+    a deadline. The total number of projects is counted only with `count=true`."""
+    page_size = 10
+    page_size_query_param = 'limit'
+    max_page_size = 100
+    orderings = {
+        '-created_on': ('-created_on', '-id'), 'created_on': ('created_on', 'id'),
+        '-deadline': ('-deadline', '-id'), 'deadline': ('deadline', 'id'),
+    }
+
+    def get_ordering(self, request, queryset, view):
+        return self.orderings.get(request.query_params.get('ordering'), self.orderings['-created_on'])
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.count = queryset.count() if request.query_params.get('count') in ('true', '1') else None
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        response = super().get_paginated_response(data)
+        if self.count is not None:
+            response.data['count'] = self.count
+        return response
+
+
+class ProjectsList(response_cache.CachedGetMixin, generics.ListAPIView):
+    """All projects, the best matches first with `q`"""
 
     class OpenFilterBackend(BaseFilterBackend):
         def filter_queryset(self, request, queryset, view):
@@ -88,20 +123,99 @@ class ProjectsList(generics.ListAPIView):
             return queryset
 
     def get_queryset(self):
-        subquery = models.Share.objects.filter(project=OuterRef('pk')).values('project').annotate(
-            shares_num=Sum('quantity')).values('shares_num')
-        queryset = models.Project.objects.annotate(shares_num=Coalesce(Subquery(subquery), 0)).distinct()
-        return queryset
+        latest_update = models.ProjectUpdate.objects.filter(project=OuterRef('project')).order_by(
+            '-created_on', '-id').values('id')[:1]
+        queryset = models.Project.objects.distinct()
+        # a constant number of queries whatever the page size: users are joined, latest updates are prefetched at once
+        return queryset.select_related('artist', 'presenter').prefetch_related(Prefetch(
+            'project_updates', queryset=models.ProjectUpdate.objects.filter(id=Subquery(latest_update)),
+            to_attr='latest_updates'))
 
     serializer_class = serializers.ProjectBriefSerializer
-    filter_backends = [OpenFilterBackend, OrderingFilter]
+    filter_backends = [OpenFilterBackend, search.SearchFilterBackend, OrderingFilter]
 
+    @property
+    def paginator(self):
+        """Keyset pages with `pagination=cursor`, limit and offset otherwise"""
+        if self.request.query_params.get('pagination') == 'cursor':
+            self.pagination_class = ProjectsCursorPagination
+        return super().paginator
 
-class ProjectDetail(generics.RetrieveAPIView):
-    """Project details"""
-    queryset = models.Project.objects.all()
+
+class ProjectDetail(response_cache.CachedGetMixin, response_cache.ConditionalGetMixin, generics.RetrieveAPIView):
+    """Project details with the latest shares and updates, the others are paginated by their own endpoints"""
+    queryset = models.Project.objects.select_related('artist', 'presenter')
     serializer_class = serializers.ProjectSerializer
 
+    def get_validators(self, request):
+        def per_project(queryset, aggregate):
+            return Subquery(queryset.filter(project=OuterRef('pk')).values('project').annotate(
+                value=aggregate).values('value'))
+        updates = models.ProjectUpdate.objects.all()
+        shares = models.Share.objects.exclude(status=models.Share.FAILED)
+        row = models.Project.objects.filter(pk=self.kwargs['pk']).values_list(
+            'created_on', 'updated_on', 'artist__updated_on', 'presenter__updated_on', 'last_share_at',
+            per_project(updates, Max('updated_on')), per_project(shares, Max('patron__updated_on')),
+            per_project(updates, Max('created_on')), per_project(updates, Count('id')),
+            per_project(shares, Count('id')), 'shares_num').first()
+        if row is None:
+            return None
+        created_on, *times, last_update, updates_count, shares_count, shares_num = row
+        last_update_time = last_update or created_on  # as Project.last_update_time
+        parts = [*times, updates_count, shares_count, shares_num]
+        if request.user.is_authenticated:  # can_post_update depends on the user and on the time
+            parts += [request.user.id,
+                      (timezone.now() - last_update_time).total_seconds() > settings.UPDATE_POST_INTERVAL]
+        return parts, max(time for time in [created_on, *times] if time)
+
+    def get_cache_version(self, request):
+        if request.user.is_authenticated:  # can_post_update depends on the user
+            return None
+        return response_cache.get_version(response_cache.project_version_key(self.kwargs['pk']))
+
+
+class SharesCursorPagination(CursorPagination):
+    ordering = ('-purchased_on', '-id')
+    page_size = 20
+    page_size_query_param = 'limit'
+    max_page_size = 100
+
+
+class UpdatesCursorPagination(CursorPagination):
+    ordering = ('-created_on', '-id')
+    page_size = 20
+    page_size_query_param = 'limit'
+    max_page_size = 100
+
+
+class ProjectSharesList(generics.ListAPIView):
+    """Shares bought in a project, newest first"""
+    serializer_class = serializers.ShareAsNestedObj
+    pagination_class = SharesCursorPagination
+
+    def get_queryset(self):
+        project = get_object_or_404(models.Project, pk=self.kwargs['pk'])
+        return project.project_shares.exclude(status=models.Share.FAILED).select_related('patron')
+
+
+class ProjectUpdatesList(generics.ListAPIView):
+    """Updates posted in a project, newest first"""
+    serializer_class = serializers.ProjectUpdateSerializer
+    pagination_class = UpdatesCursorPagination
+
+    def get_queryset(self):
+        project = get_object_or_404(models.Project, pk=self.kwargs['pk'])
+        return project.project_updates.all()
+
+
+class ProjectUpdateDetail(generics.RetrieveAPIView):
+    """One update posted in a project"""
+    serializer_class = serializers.ProjectUpdateSerializer
+    lookup_url_kwarg = 'update_pk'
+
+    def get_queryset(self):
+        return models.ProjectUpdate.objects.filter(project_id=self.kwargs['pk'])
+
 
 class ProjectUpdate(generics.CreateAPIView):
     """Post an update to the project"""
@@ -143,46 +257,100 @@ class ProjectCreateView(generics.CreateAPIView):
             serializer.save(artist=self.request.user)
 
 
-class ProjectMetadataView(generics.RetrieveAPIView):
+class ProjectMetadataView(response_cache.ConditionalGetMixin, generics.RetrieveAPIView):
     queryset = models.Project.objects.all()
     serializer_class = serializers.ProjectMetadataSerializer
 
+    def get_validators(self, request):
+        row = models.Project.objects.filter(pk=self.kwargs['pk']).values_list(
+            'updated_on', 'artist__updated_on').first()
+        return None if row is None else (row, max(time for time in row if time))
+
 
 class BuySharesView(generics.CreateAPIView):
     """Buy shares in the project"""
     serializer_class = serializers.BuySharesSerializer
     queryset = models.Share.objects.all()
 
+    @staticmethod
+    def unsent_spending(wallet):
+        """(money of the purchases of the wallet not sent yet, of those sent but not seen included by the tracker),
+        the ledger read from the chain does not show them"""
+        included = models.PendingOperation.objects.exclude(status=models.PendingOperation.PENDING).values('ophash')
+        unsent = in_flight = 0
+        for operation in models.OutboxOperation.objects.filter(
+                Q(status__in=[models.OutboxOperation.PENDING, models.OutboxOperation.SENDING]) |
+                Q(status=models.OutboxOperation.SENT) & ~Q(ophash__in=included),
+                kind=models.OutboxOperation.BUY_SHARES, payload__wallet=wallet).select_related('project'):
+            amount = operation.project.share_price * operation.payload['num_shares']
+            if operation.status == models.OutboxOperation.SENT:
+                in_flight += amount
+            else:
+                unsent += amount
+        return unsent, in_flight
+
     def perform_create(self, serializer):
-        project = get_object_or_404(models.Project, id=self.kwargs['pk'])
         ophash = serializer.validated_data['ophash']
         wallet = serializer.validated_data['wallet']
         num_shares = serializer.validated_data['quantity']
-        wallet_money = blockchain.get_wallet_money(wallet)
-        total_bought_shares = blockchain.get_bought_shares(project)
+        get_object_or_404(models.Project, id=self.kwargs['pk'])
+        snapshot = blockchain.get_purchase_snapshot(wallet)
+        patron = models.User.get_or_create_from_wallet(tzwallet=wallet)
+        error = None
+        with transaction.atomic():
+            # purchases of the project take turns, the supply is checked against the shares recorded so far,
+            # on chain or not
+            project = get_object_or_404(models.Project.objects.select_for_update(), id=self.kwargs['pk'])
+            if not (share := models.Share.objects.filter(ophash=ophash).first()):
+                unsent, in_flight = self.unsent_spending(wallet)
+                price = project.share_price * num_shares
+                if snapshot.wallet_money - unsent < price:
+                    error = 'Not enough money'
+                elif snapshot.wallet_money - unsent - in_flight < price:  # may be on chain already, no refund
+                    raise ParseError('A previous purchase of the wallet is not confirmed yet, try again later')
+                elif project.max_shares and project.shares_num + num_shares > project.max_shares:
+                    error = f'There are only {project.max_shares - project.shares_num} shares left to buy'
+                if error:
+                    outbox.enqueue(models.OutboxOperation.REFUND, project, wallet=wallet)
+                else:
+                    share = models.Share.objects.create(project=project, patron=patron, quantity=num_shares,
+                                                        ophash=ophash)
+                    outbox.enqueue(models.OutboxOperation.BUY_SHARES, project, wallet=wallet, num_shares=num_shares,
+                                   share_id=share.id)
+                    tracker.register(ophash, models.PendingOperation.SHARE)
+                    project.refresh_from_db(fields=models.Project.TOTALS)
+                    if project.max_shares and project.shares_num >= project.max_shares:
+                        project.status = project.SALE_CLOSED
+                        project.save()
+                        outbox.enqueue(models.OutboxOperation.UPDATE_PROJECT_STATUS, project, status=project.status)
+            if not error and models.Share.objects.filter(patron=patron).exclude(
+                    status=models.Share.FAILED).count() == 1:  # first purchase
+                meta_url = reverse('project_metadata', args=(project.id,))
+                meta_url = self.request.build_absolute_uri(meta_url)
+                outbox.enqueue(models.OutboxOperation.GENERATE_TOKEN, project, meta_url=meta_url,
+                               patron_id=patron.id)
+        if error:  # raised once the refund is committed
+            raise ParseError(error)
+        serializer._validated_data = share
 
-        if wallet_money < project.share_price * serializer.validated_data['quantity']:
-            blockchain.refund(wallet)
-            raise BadRequest('Not enough money')
-        if total_bought_shares + num_shares > project.max_shares:
-            blockchain.refund(wallet)
-            raise BadRequest(f'There are only {project.max_shares - project.shares_num} shares left to buy')
 
-        blockchain.buy_shares(project, wallet, num_shares)
+class OperationStatusView(generics.RetrieveAPIView):
+    """Inclusion status of an operation group, as recorded by the confirmation tracker"""
+    queryset = models.PendingOperation.objects.all()
+    serializer_class = serializers.PendingOperationSerializer
+    lookup_field = 'ophash'
 
-        patron = models.User.get_or_create_from_wallet(tzwallet=wallet)
-        if not (share := models.Share.objects.filter(ophash=ophash).first()):
-            share = models.Share.objects.create(project=project, patron=patron, quantity=num_shares,
-                                                ophash=serializer.validated_data['ophash'])
-            if project.max_shares and project.shares_num >= project.max_shares:
-                project.status = project.SALE_CLOSED
-                project.save()
-                blockchain.update_project_status(project)
-        if models.Share.objects.filter(patron=patron).count() == 1:  # first purchase
-            meta_url = reverse('project_metadata', args=(project.id,))
-            meta_url = self.request.build_absolute_uri(meta_url)
-            blockchain.generate_token(project, meta_url, wallet)
-        serializer._validated_data = share
+
+class HoldingsView(generics.GenericAPIView):
+    """Ledger money, shares and token balances of many wallets at once, for reconciliation by the staff"""
+    serializer_class = serializers.HoldingsRequestSerializer
+    permission_classes = [permissions.IsAdminUser]
+
+    def post(self, request):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        block_hash, holdings = blockchain.get_holdings(**serializer.validated_data)
+        return Response({'block_hash': block_hash, 'holdings': holdings})
 
 
 def collection_meta(*args, **kwargs):
@@ -190,6 +358,15 @@ def collection_meta(*args, **kwargs):
         return HttpResponse(fp.read(), headers={'Content-type': 'application/json'})
 
 
+def blockchain_metrics(request):
+    """Calls, errors and latency of the blockchain functions of all the processes, in the Prometheus text format"""
+    token = settings.METRICS_TOKEN
+    if not request.user.is_staff and not (token and constant_time_compare(request.headers.get('Authorization', ''),
+                                                                          f'Bearer {token}')):
+        raise PermissionDenied
+    return HttpResponse(metrics.render(metrics.collect()), headers={'Content-type': 'text/plain; version=0.0.4'})
+
+
 url_patterns = [
     path("login", auth_views.obtain_auth_token, name='login'),
     path("login-by-wallet", LoginByWalletView.as_view(), name='login_by_wallet'),
@@ -198,9 +375,14 @@ url_patterns = [
     path("profile/<str:username>", ProfileView.as_view(), name='profile'),
     path("projects", ProjectsList.as_view(), name='projects'),
     path("projects/<int:pk>", ProjectDetail.as_view(), name='project'),
+    path("projects/<int:pk>/shares", ProjectSharesList.as_view(), name='project_shares'),
+    path("projects/<int:pk>/updates", ProjectUpdatesList.as_view(), name='project_updates'),
+    path("projects/<int:pk>/updates/<int:update_pk>", ProjectUpdateDetail.as_view(), name='project_update_detail'),
     path("projects/<int:pk>/update", ProjectUpdate.as_view(), name='project_update'),
     path("projects/<int:pk>/buy", BuySharesView.as_view(), name='buy_shares'),
     path("projects/<int:pk>/metadata", ProjectMetadataView.as_view(), name='project_metadata'),
+    path("holdings", HoldingsView.as_view(), name='holdings'),
+    path("operations/<str:ophash>", OperationStatusView.as_view(), name='operation_status'),
     path("projects/create", ProjectCreateView.as_view(), name='create_project_artist'),
     path("projects/create/for/<int:artist_id>", ProjectCreateView.as_view(), name='create_project_gallery'),
 
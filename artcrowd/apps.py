@@ -0,0 +1,10 @@
+from django.apps import AppConfig
+
+
+class ArtcrowdConfig(AppConfig):
+    name = 'artcrowd'
+
+    def ready(self):
+        from . import outbox  # noqa: F401, takes back purchases which failed on chain
+        from . import response_cache  # noqa: F401, connects the cache invalidation signals
+        from . import search  # noqa: F401, keeps the search index in sync
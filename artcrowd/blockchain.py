@@ -1,109 +1,599 @@
+import os
 import json
+import hashlib
+import math
 import logging
+import threading
 import time
-from datetime import datetime
-from collections import defaultdict
+from datetime import datetime, timedelta
+from collections import defaultdict, namedtuple, OrderedDict
+from functools import lru_cache
+from concurrent.futures import Future, ThreadPoolExecutor
 import requests
 from pytezos import pytezos
+from pytezos.contract.interface import ContractInterface
+from pytezos.contract.view import ContractViewCall
 from pytezos.crypto.key import Key
+from pytezos.michelson.forge import forge_micheline
+from pytezos.michelson.types.big_map import BigMapType
+from pytezos.operation.fees import calculate_fee
+from pytezos.operation.result import OperationResult
+from pytezos.rpc.node import RpcNotFoundError
 from django.conf import settings
-from django.db import models
+from django.db import models, transaction
+from django.utils import timezone
+from . import indexer, metrics, rpc, simulator
+from .models import AccountCounter, GasProfile, Share, WalletPublicKey
 
-with open(settings.TEZOS_WALLET_KEYFILE, 'rt') as fp:
-    keyfile = json.load(fp)
-tezos = pytezos.using(shell=settings.TEZOS_NETWORK, key=keyfile['edsk'])
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """pytezos client with the admin key, built on first use so that importing the module needs no wallet file"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                if settings.TEZOS_BACKEND == 'simulator':
+                    keyfile = simulator.get_admin_key()
+                else:
+                    with open(settings.TEZOS_WALLET_KEYFILE, 'rt') as fp:
+                        keyfile = json.load(fp)
+                _client = pytezos.using(shell=rpc.get_shell(), key=keyfile['edsk'])
+    return _client
+
+
+def warm_up():
+    """Build the client and load the contracts ahead of the first request. Call it in every worker after fork,
+    e.g. from gunicorn's post_fork hook, so that connections are not shared with the parent process."""
+    get_client()
+    for address in (settings.PROJECTS_CONTRACT, settings.GALLERY_CONTRACT):
+        get_contract(address)
+
+_contracts = {}
+_contracts_lock = threading.Lock()
+
+
+def _code_hash(code):
+    return hashlib.sha256(json.dumps(code, sort_keys=True).encode()).hexdigest()
+
+
+def _fetch_code(address):
+    return get_client().shell.contracts[address].script()['code']
+
+
+def _load_code(address):
+    """Code of a deployed contract never changes, so it is safe to keep it on disk between restarts.
+    The cached file carries the hash of the code and is ignored if it does not match.
+    Scripts of the simulator are not cached, they live at the addresses of the deployed contracts."""
+    cache_dir = settings.TEZOS_SCRIPT_CACHE_DIR if settings.TEZOS_BACKEND == 'node' else None
+    path = os.path.join(cache_dir, f'{address}.json') if cache_dir else None
+    if path and os.path.exists(path):
+        try:
+            with open(path, 'rt') as fp:
+                cached = json.load(fp)
+            if cached['address'] == address and _code_hash(cached['code']) == cached['code_hash']:
+                return cached['code']
+        except (ValueError, KeyError) as ex:
+            logging.warning(ex)
+        logging.warning(f'ignoring stale script cache {path}')
+    code = _fetch_code(address)
+    if path:
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wt') as fp:
+            json.dump({'address': address, 'code_hash': _code_hash(code), 'code': code}, fp)
+        os.replace(tmp_path, path)
+    return code
+
+
+def get_contract(address) -> ContractInterface:
+    """Return a process-wide contract handle, the script is fetched and its Michelson types are parsed only once.
+    Storage is not cached: every `.storage` access still reads the current state from the node."""
+    contract = _contracts.get(address)
+    if contract is None:
+        with _contracts_lock:
+            contract = _contracts.get(address)
+            if contract is None:
+                context = get_client()._spawn_context(address=address, script={'code': _load_code(address)})
+                contract = ContractInterface.from_context(context)
+                _contracts[address] = contract
+    return contract
+
+
+class BlockCache:
+    """Bounded LRU cache for chain reads. Storage cannot change within a block, so values are kept by
+    (block hash, key), for the `max_blocks` blocks read last: head reads and reads pinned to the indexed block
+    do not evict each other. Concurrent misses of the same key wait for the single read already in flight."""
+
+    def __init__(self, maxsize, max_blocks):
+        self.maxsize = maxsize
+        self.max_blocks = max_blocks
+        self._blocks = OrderedDict()  # block hash -> entries read at the block, least recently read first
+        self._values = OrderedDict()  # (block hash, key) -> future, least recently used first
+        self._lock = threading.Lock()
+
+    def get_or_read(self, block_hash, key, read):
+        entry = (block_hash, key)
+        with self._lock:
+            entries = self._blocks.get(block_hash)
+            if entries is None:
+                entries = self._blocks[block_hash] = set()
+                while len(self._blocks) > self.max_blocks:
+                    for old_entry in self._blocks.popitem(last=False)[1]:
+                        del self._values[old_entry]
+            else:
+                self._blocks.move_to_end(block_hash)
+            future = self._values.get(entry)
+            if future is None:
+                owner = True
+                future = self._values[entry] = Future()
+                entries.add(entry)
+                while len(self._values) > self.maxsize:
+                    old_entry = self._values.popitem(last=False)[0]
+                    self._blocks[old_entry[0]].discard(old_entry)
+            else:
+                owner = False
+                self._values.move_to_end(entry)
+        if owner:
+            try:
+                future.set_result(read())
+            except Exception as ex:
+                future.set_exception(ex)
+                with self._lock:
+                    if self._values.get(entry) is future:
+                        del self._values[entry]
+                        self._blocks[block_hash].discard(entry)
+        return future.result()
+
+    def clear(self):
+        with self._lock:
+            self._blocks.clear()
+            self._values.clear()
+
+
+_read_cache = BlockCache(settings.TEZOS_READ_CACHE_SIZE, settings.TEZOS_READ_CACHE_BLOCKS)
+_head = (None, 0.0)
+_big_maps = {}
+
+
+def get_head_hash():
+    """Hash of the current head block, refreshed at most once per TEZOS_HEAD_TTL seconds"""
+    global _head
+    block_hash, fetched_at = _head
+    if block_hash is None or time.monotonic() - fetched_at > settings.TEZOS_HEAD_TTL:
+        block_hash = get_client().shell.head.hash()
+        _head = (block_hash, time.monotonic())
+    return block_hash
+
+
+def _read_storage(address, block_id):
+    expr = get_client().shell.blocks[block_id].context.contracts[address].storage()
+    return get_contract(address).program.storage.from_micheline_value(expr).item
+
+
+def big_map_schema(storage):
+    """Map names of the big maps found in parsed contract storage to their (id, type)"""
+    schema = {}
+    for name in storage.to_python_object():
+        value = storage[name]
+        if isinstance(value, BigMapType):
+            schema[name] = (value.ptr, type(value))
+    return schema
+
+
+def get_big_map_schema(address):
+    """Big map ids and types of a contract never change after origination, they are read once"""
+    schema = _big_maps.get(address)
+    if schema is None:
+        schema = _big_maps[address] = big_map_schema(_read_storage(address, 'head'))
+    return schema
+
+
+def _read_big_map(address, name, key, block_id):
+    ptr, big_map_type = get_big_map_schema(address)[name]
+    key_hash = big_map_type(items=[]).get_key_hash(key)
+    try:
+        value = get_client().shell.blocks[block_id].context.big_maps[ptr][key_hash]()
+    except RpcNotFoundError:
+        return None
+    return big_map_type.args[1].from_micheline_value(value).to_python_object()
+
+
+def read_big_map(address, name, key, block_hash=None):
+    """Read one value of a contract big map at the given block (head by default), None if the key is missing"""
+    block_hash = block_hash or get_head_hash()
+    return _read_cache.get_or_read(block_hash, ('big_map', address, name, key),
+                                   lambda: _read_big_map(address, name, key, block_hash))
+
+
+def read_storage(address, block_hash=None):
+    """Read contract storage at the given block (head by default), big maps are returned as their ids"""
+    block_hash = block_hash or get_head_hash()
+    return _read_cache.get_or_read(block_hash, ('storage', address),
+                                   lambda: _read_storage(address, block_hash).to_python_object())
+
+
+@lru_cache(maxsize=settings.TEZOS_PUBLIC_KEY_CACHE_SIZE)
+def get_public_key(wallet) -> Key:
+    """Revealed public key of the wallet. The key of an implicit account never changes, it is read from
+    the node once and kept in the database."""
+    stored = WalletPublicKey.objects.filter(wallet=wallet).first()
+    if stored:
+        return Key.from_encoded_key(stored.public_key)
+    public_key = get_client().shell.contracts[wallet].manager_key()
+    if not public_key:
+        raise Exception(f'unable to get public key for {wallet}')
+    key = Key.from_encoded_key(public_key)
+    if key.public_key_hash() != wallet:
+        raise Exception(f'public key {public_key} does not belong to {wallet}')
+    WalletPublicKey.objects.get_or_create(wallet=wallet, defaults={'public_key': public_key})
+    return key
 
 
 def validate_signature(wallet, signature, message):
     try:
-        public_key = tezos.shell.contracts[wallet].manager_key()
-        if not public_key:
-            raise Exception(f'unable to get public key for {wallet}')
-        return Key.from_encoded_key(public_key).verify(signature, message)
+        return get_public_key(wallet).verify(signature, message)
     except Exception as ex:
         logging.warning(ex)
     return False
 
 
-def create_project(project: models.Model):
-    contract = tezos.contract(settings.PROJECTS_CONTRACT)
-    ops = []
+def _chain_counter(source):
+    return int(get_client().shell.contracts[source]()['counter'])
+
+
+def reserve_counters(count):
+    """Reserve `count` consecutive counters of the admin account and return the first one.
+    The row lock makes workers of all processes take turns, so that no counter is handed out twice.
+    After TEZOS_COUNTER_TTL without reservations every previous group was included or dropped
+    and the counter is read again from the node."""
+    source = get_client().key.public_key_hash()
+    with transaction.atomic():
+        row, _ = AccountCounter.objects.select_for_update().get_or_create(source=source)
+        if row.counter is None or timezone.now() - row.updated_on > timedelta(seconds=settings.TEZOS_COUNTER_TTL):
+            row.counter = _chain_counter(source)
+        first = row.counter + 1
+        row.counter += count
+        row.save()
+    return first
+
+
+def resync_counter():
+    """Forget the local counter after a rejected group, its counters were not used"""
+    AccountCounter.objects.filter(source=get_client().key.public_key_hash()).update(counter=None)
+
+
+def param_size(value):
+    """Number of items of the longest list in a Micheline value, the batch size of a call"""
+    if isinstance(value, list):
+        return max([len(value)] + [param_size(item) for item in value])
+    if isinstance(value, dict):
+        return max([1] + [param_size(arg) for arg in value.get('args', [])])
+    return 1
+
+
+def simulate(call):
+    """Gas and storage used by a contract call, measured with run_operation"""
+    result = get_client().bulk(call).fill().run()
+    if not OperationResult.is_applied(result):
+        raise Exception(OperationResult.errors(result))
+    content = result['contents'][0]
+    return (OperationResult.consumed_gas(content),
+            OperationResult.paid_storage_size_diff(content) + OperationResult.burned(content))
+
+
+def profiled_limits(ops):
+    """Gas and storage limits of the calls from the calibrated profiles, None when one of them has no profile"""
+    profiles = {(p.contract, p.entrypoint): p for p in GasProfile.objects.filter(stale=False)}
+    limits = []
+    for op in ops:
+        profile = profiles.get((op.address, op.parameters['entrypoint']))
+        if profile is None:
+            return None
+        limits.append(profile.limits(param_size(op.parameters['value']), settings.TEZOS_GAS_MARGIN))
+    return limits
+
+
+def _fill_with_limits(opg, limits, counter):
+    # same fee computation as autofill, without the simulation
+    opg = opg._spawn(contents=[dict(content, gas_limit=str(gas), storage_limit=str(storage))
+                               for content, (gas, storage) in zip(opg.contents, limits)]).fill(counter=counter)
+    thresholds = opg.context.get_fee_thresholds()
+    extra_size = 1 + (32 + 64) // len(opg.contents)
+    for content in opg.contents:
+        content['fee'] = '0'
+    fee = sum(calculate_fee(content, int(content['gas_limit']), extra_size=extra_size, thresholds=thresholds)
+              for content in opg.contents)
+    opg.contents[0]['fee'] = str(fee)
+    return opg
+
+
+def sign(ops):
+    """Fill and sign an operation group without injecting it, so that its hash can be recorded first.
+    Limits come from the gas profiles, the group is simulated only when a call has no profile."""
     try:
-        contract.storage['projects'][project.id]
-    except KeyError:
+        counter = reserve_counters(len(ops))
+        limits = profiled_limits(ops)
+        if limits is None:
+            return get_client().bulk(*ops).autofill(counter=counter).sign()
+        return _fill_with_limits(get_client().bulk(*ops), limits, counter).sign()
+    except Exception:
+        resync_counter()
+        raise
+
+
+def _count_calls(opg):
+    for content in opg.contents:
+        if 'parameters' in content:
+            entrypoint = content['parameters']['entrypoint']
+            metrics.add('operations', entrypoint)
+            metrics.add('operation_bytes', entrypoint, len(forge_micheline(content['parameters']['value'])))
+            metrics.add('operation_gas_limit', entrypoint, int(content['gas_limit']))
+
+
+def inject(opg, confirmations=0):
+    try:
+        ophash = opg.inject(min_confirmations=confirmations)['hash']
+    except Exception as ex:
+        resync_counter()
+        if 'exhausted' in str(ex):  # gas_exhausted or storage_exhausted, the profiles are out of date
+            logging.warning(f'marking gas profiles as stale: {ex}')
+            GasProfile.objects.filter(
+                contract__in=[content['destination'] for content in opg.contents if 'destination' in content],
+                entrypoint__in=[content['parameters']['entrypoint'] for content in opg.contents
+                                if 'parameters' in content]).update(stale=True)
+        raise
+    _count_calls(opg)
+    return ophash
+
+
+GROUP_OVERHEAD = 32 + 64  # branch and signature
+CONTENT_OVERHEAD = 128  # transaction fields around the parameters
+_limits = None
+
+
+def protocol_limits():
+    """Gas, storage and bytes an operation group may use, they only change with the protocol"""
+    global _limits
+    if _limits is None:
+        constants = get_client().shell.head.context.constants()
+        _limits = (int(constants['hard_gas_limit_per_operation']), int(constants['hard_storage_limit_per_operation']),
+                   int(constants['max_operation_data_length']))
+    return _limits
+
+
+def call_bytes(op):
+    return CONTENT_OVERHEAD + len(op.parameters['entrypoint']) + len(forge_micheline(op.parameters['value']))
+
+
+def plan_chunks(items, build, reserved=()):
+    """Split the items of a batch call into the fewest calls that each fill an operation group, as far as
+    the gas profile, storage and size limits allow. `build(chunk, index)` makes the call for a chunk and
+    `reserved` are calls sent in the group of the first chunk. Without a profile the items are split
+    in chunks of TEZOS_CHUNK_SIZE."""
+    if not items:
+        return []
+    sample_size = min(len(items), 10)
+    sample = build(items[:sample_size], 0)
+    profile = GasProfile.objects.filter(contract=sample.address, entrypoint=sample.parameters['entrypoint'],
+                                        stale=False).first()
+    reserved_limits = profiled_limits(reserved) if reserved else []
+    if profile is None or reserved_limits is None:
+        return [items[i: i + settings.TEZOS_CHUNK_SIZE] for i in range(0, len(items), settings.TEZOS_CHUNK_SIZE)]
+    gas_limit, storage_limit, size_limit = protocol_limits()
+    margin = 1 + settings.TEZOS_GAS_MARGIN
+    item_bytes = math.ceil((call_bytes(sample) - CONTENT_OVERHEAD) / sample_size)
+    chunks = []
+    while items:
+        gas = sum(limits[0] for limits in reserved_limits)
+        storage = sum(limits[1] for limits in reserved_limits)
+        size = GROUP_OVERHEAD + CONTENT_OVERHEAD + len(sample.parameters['entrypoint']) + \
+            sum(call_bytes(op) for op in reserved)
+        capacity = [(size_limit - size) // item_bytes]
+        if profile.gas_per_item:
+            capacity.append(int(((gas_limit - gas) / margin - profile.gas_base) // profile.gas_per_item))
+        if profile.storage_per_item:
+            capacity.append(int(((storage_limit - storage) / margin - profile.storage_base) // profile.storage_per_item))
+        count = max(1, min(capacity))
+        chunks.append(items[:count])
+        items, reserved, reserved_limits = items[count:], (), []
+    return chunks
+
+
+def plan_groups(ops):
+    """Split calls into consecutive operation groups under the protocol limits, keeping their order.
+    Without gas profiles the calls stay in one group, simulated together by autofill."""
+    limits = profiled_limits(ops)
+    if limits is None:
+        return [ops]
+    gas_limit, storage_limit, size_limit = protocol_limits()
+    groups, used = [], None
+    for op, (gas, storage) in zip(ops, limits):
+        size = call_bytes(op)
+        if groups and used[0] + gas <= gas_limit and used[1] + storage <= storage_limit \
+                and used[2] + size <= size_limit:
+            groups[-1].append(op)
+            used = (used[0] + gas, used[1] + storage, used[2] + size)
+        else:
+            groups.append([op])
+            used = (gas, storage, GROUP_OVERHEAD + size)
+    return groups
+
+
+def create_project_ops(project: models.Model):
+    contract = get_contract(settings.PROJECTS_CONTRACT)
+    ops = []
+    if read_big_map(settings.PROJECTS_CONTRACT, 'projects', project.id) is None:
         ops = [contract.create_project(project.id, project.share_price * 1_000_000)]
     # change to "else" when updated contract is deployed
     ops.append(contract.update_project_status(project.status, project.id))
-    tezos.bulk(*ops).send(min_confirmations=0)
+    return ops
 
 
-def update_project_status(project: models.Model, confirmations=0):
-    contract = tezos.contract(settings.PROJECTS_CONTRACT)
-    ops = [contract.update_project_status(project.status, project.id)]
-    tezos.bulk(*ops).send(min_confirmations=confirmations)
+def update_project_status_ops(project: models.Model):
+    contract = get_contract(settings.PROJECTS_CONTRACT)
+    return [contract.update_project_status(project.status, project.id)]
 
 
-def refund_all(project: models.Model):
-    contract = tezos.contract(settings.PROJECTS_CONTRACT)
-    wallets = list(set([s.patron.tzwallet for s in project.shares]))
-    ops = [contract.refund(project.id, wallets[i: i+500]) for i in range(0, len(wallets), 500)]
-    ops.append(contract.update_project_status(project.status, project.id))
-    result = tezos.bulk(*ops).send(min_confirmations=0)
-    return result
+def refund_all_ops(project: models.Model, wallets=None):
+    contract = get_contract(settings.PROJECTS_CONTRACT)
+    if wallets is None:
+        wallets = list(set([s.patron.tzwallet for s in project.shares]))
+    status_op = contract.update_project_status(project.status, project.id)
+    chunks = plan_chunks(wallets, lambda chunk, index: contract.refund_all(project.id, chunk), reserved=[status_op])
+    chunks.reverse()  # the chunk planned with room for the status update goes last, next to it
+    return [contract.refund_all(project.id, chunk) for chunk in chunks] + [status_op]
 
 
-def generate_token(project: models.Model, metadata_url, patron: models.Model):
-    contract = tezos.contract(settings.PROJECTS_CONTRACT)
-    gallery_contract = tezos.contract(settings.GALLERY_CONTRACT)
+def generate_token_ops(project: models.Model, metadata_url, patron: models.Model):
+    gallery_contract = get_contract(settings.GALLERY_CONTRACT)
     # upload meta
     meta_url = metadata_url.encode()
-    shares = project.shares.filter(project=project, patron=patron).aggregate(models.Sum('quantity'))
+    shares = project.project_shares.filter(patron=patron).exclude(status=Share.FAILED).aggregate(
+        total=models.Sum('quantity'))['total']
     params = {"token": {"new": {"": meta_url}}, "amount": shares, "to_": patron.tzwallet}
-    gallery_contract.mint(params).send(min_confirmations=0)
+    return [gallery_contract.mint([params])]
 
 
-def generate_tokens(project: models.Model, metadata_url):
-    contract = tezos.contract(settings.PROJECTS_CONTRACT)
-    gallery_contract = tezos.contract(settings.GALLERY_CONTRACT)
-    token_id = gallery_contract.storage['next_token_id']()
-    # upload meta
-    meta_url = metadata_url.encode()
-    shares = defaultdict(int)
-    for share in project.shares:
-        shares[share.patron.tzwallet] += share.quantity
-    wallets = list(shares.keys())
-    ops = [
+def settle_project_ops(project: models.Model):
+    """Close the project on chain and pay the artist"""
+    contract = get_contract(settings.PROJECTS_CONTRACT)
+    return [
         contract.update_project_status(project.status, project.id),
         contract.withdraw_mutez(project.shares_sum * 1_000_000, project.artist.tzwallet)
     ]
-    token_generated = False
-    for i in range(0, len(wallets), 500):
-        params = [{"token": {"existing": token_id}, "amount": shares[wallet], "to_": wallet} for wallet in wallets[i: i+500]]
-        if not token_generated:
-            params[0]["token"] = {"new": {"": meta_url}}
-            token_generated = True
-        ops.append(gallery_contract.mint(params))
-    result = tezos.bulk(*ops).send(min_confirmations=0)
-    return result
+
+
+def project_holdings(project: models.Model):
+    """(wallet, number of shares) of every patron of the project"""
+    shares = defaultdict(int)
+    for share in project.shares:
+        shares[share.patron.tzwallet] += share.quantity
+    return list(shares.items())
+
+
+def mint_op(token_id, metadata_url, holdings, new_token):
+    """Mint the token to the (wallet, amount) holdings, the token is created first when `new_token`"""
+    gallery_contract = get_contract(settings.GALLERY_CONTRACT)
+    params = [{"token": {"existing": token_id}, "amount": amount, "to_": wallet} for wallet, amount in holdings]
+    if new_token:
+        # upload meta
+        params[0]["token"] = {"new": {"": metadata_url.encode()}}
+    return gallery_contract.mint(params)
+
+
+def get_minted_token_id(ophash, block_hash):
+    """Id of the token created by an applied mint call, from the big map diff of its receipt"""
+    ptr, big_map_type = get_big_map_schema(settings.GALLERY_CONTRACT)['token_metadata']
+    for diff_ophash, diff_ptr, key, value in indexer.iter_big_map_diffs(get_client().shell.blocks[block_hash]()):
+        if diff_ophash == ophash and diff_ptr == ptr and value is not None:
+            return big_map_type.args[0].from_micheline_value(key).to_python_object()
+    raise ValueError(f'{ophash} created no token')
+
+
+def plan_mint_chunks(project: models.Model, token_id, metadata_url):
+    mint = lambda chunk, index: mint_op(token_id, metadata_url, chunk, index == 0)
+    return plan_chunks(project_holdings(project), mint, reserved=settle_project_ops(project))
+
+
+def generate_tokens_ops(project: models.Model, metadata_url):
+    token_id = read_storage(settings.GALLERY_CONTRACT)['next_token_id']
+    chunks = plan_mint_chunks(project, token_id, metadata_url)
+    return settle_project_ops(project) + [mint_op(token_id, metadata_url, chunk, i == 0) for i, chunk in enumerate(chunks)]
 
 
 def get_wallet_money(wallet):
-    contract = tezos.contract(settings.PROJECTS_CONTRACT)
-    money = contract.storage['ledger'].get(wallet)
+    if settings.TEZOS_READ_FROM_INDEX and indexer.is_synced():
+        return indexer.get_wallet_money(wallet)
+    money = read_big_map(settings.PROJECTS_CONTRACT, 'ledger', wallet)
     return money or 0
 
 
-def refund(wallet):
-    contract = tezos.contract(settings.PROJECTS_CONTRACT)
-    op = contract.refund(wallet).send(min_confirmations=0)
+def refund_ops(wallet):
+    contract = get_contract(settings.PROJECTS_CONTRACT)
+    return [contract.refund(wallet)]
 
 
 def get_bought_shares(project: models.Model):
-    contract = tezos.contract(settings.PROJECTS_CONTRACT)
-    project_data = contract.storage['projects'].get(project.id)
-    return project_data.get('total_shares')
+    if settings.TEZOS_READ_FROM_INDEX and indexer.is_synced():
+        return indexer.get_bought_shares(project.id)
+    project_data = read_big_map(settings.PROJECTS_CONTRACT, 'projects', project.id)
+    return project_data['total_shares'] if project_data else 0
+
+
+PurchaseSnapshot = namedtuple('PurchaseSnapshot', ['block_hash', 'wallet_money'])
+
+
+def get_purchase_snapshot(wallet):
+    """Money of the wallet at the head block, the supply is checked against the shares recorded in the database.
+    The index is never used, it is INDEXER_CONFIRMATIONS blocks behind and would miss a fresh deposit,
+    which would be refunded."""
+    block_hash = get_head_hash()
+    return PurchaseSnapshot(block_hash, read_big_map(settings.PROJECTS_CONTRACT, 'ledger', wallet, block_hash) or 0)
+
+
+def _token_balances(balance_requests, block_hash):
+    """Balances from the gallery's get_balance_of on-chain view, one RPC for the whole batch"""
+    gallery_contract = get_contract(settings.GALLERY_CONTRACT)
+    call: ContractViewCall = gallery_contract.view.get_balance_of(balance_requests)
+    call.context = call._spawn_context(address=gallery_contract.address, script=gallery_contract.context.script,
+                                       block_id=block_hash)
+    return [(item['request']['owner'], item['request']['token_id'], item['balance']) for item in call.run_view()]
+
+
+def get_holdings(wallets, project_ids=(), token_ids=(), block_hash=None):
+    """Money, shares per project and token balances of many wallets read at the same block, return the block hash
+    and {wallet: {'money': mutez, 'shares': {project_id: shares}, 'tokens': {token_id: balance}}}.
+    Without a given block, money and shares come from the indexer mirrors when they are in sync and
+    the balances are read at the last indexed block.
+    Big map reads run on a bounded thread pool, token balances are asked in batches of TEZOS_BALANCE_BATCH."""
+    holdings = {wallet: {'money': 0, 'shares': {}, 'tokens': {}} for wallet in wallets}
+    if block_hash is None and settings.TEZOS_READ_FROM_INDEX and indexer.is_synced():
+        block_hash, indexed = indexer.get_holdings(wallets, project_ids)
+        for wallet, values in indexed.items():
+            holdings[wallet].update(values)
+    else:
+        block_hash, indexed = block_hash or get_head_hash(), None
+    with ThreadPoolExecutor(max_workers=settings.TEZOS_BULK_READ_THREADS) as pool:
+        balance_requests = [{'owner': wallet, 'token_id': token_id} for wallet in wallets for token_id in token_ids]
+        batches = [pool.submit(_token_balances, balance_requests[i: i + settings.TEZOS_BALANCE_BATCH], block_hash)
+                   for i in range(0, len(balance_requests), settings.TEZOS_BALANCE_BATCH)]
+        if indexed is None:
+            money = {wallet: pool.submit(read_big_map, settings.PROJECTS_CONTRACT, 'ledger', wallet, block_hash)
+                     for wallet in wallets}
+            shares = {(project_id, wallet): pool.submit(read_big_map, settings.PROJECTS_CONTRACT, 'shares',
+                                                        (project_id, wallet), block_hash)
+                      for project_id in project_ids for wallet in wallets}
+            for wallet, value in money.items():
+                holdings[wallet]['money'] = value.result() or 0
+            for (project_id, wallet), value in shares.items():
+                holdings[wallet]['shares'][project_id] = value.result() or 0
+        for batch in batches:
+            for wallet, token_id, balance in batch.result():
+                holdings[wallet]['tokens'][token_id] = balance
+    return block_hash, holdings
+
+
+def buy_shares_ops(project, wallet, num_shares):
+    contract = get_contract(settings.PROJECTS_CONTRACT)
+    return [contract.buy_shares((num_shares, wallet), project.id)]
+
+
+def reset():
+    """Drop the client and everything read from the chain. Called in a forked child,
+    whose inherited threads and connections are not usable, and when the backend changes."""
+    global _client, _read_cache, _head, _limits
+    _client = None
+    _contracts.clear()
+    _big_maps.clear()
+    _read_cache = BlockCache(settings.TEZOS_READ_CACHE_SIZE, settings.TEZOS_READ_CACHE_BLOCKS)
+    _head, _limits = (None, 0.0), None
+    get_public_key.cache_clear()
 
 
-def buy_shares(project, wallet, num_shares):
-    contract = tezos.contract(settings.PROJECTS_CONTRACT)
-    op = contract.buy_shares((num_shares, wallet), project.id).send(min_confirmations=1)
+# latency, calls and errors of every function, except the helpers called in loops
+metrics.instrument(globals(), exclude={'get_client', 'reset', '_code_hash', 'big_map_schema', 'param_size',
+                                       'call_bytes', 'mint_op', '_count_calls'})
+os.register_at_fork(after_in_child=reset)
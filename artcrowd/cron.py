@@ -1,18 +1,16 @@
-from django.db.models.expressions import RawSQL
+from django.db import transaction
+from django.db.models import F, Q
 from django.utils import timezone
-from .models import Project
-from . import blockchain
+from .models import Project, OutboxOperation
+from . import outbox
 
 
 def close_expired_projects():
-    projects = Project.objects.filter(pk__in=RawSQL(f'''
-        SELECT id FROM {Project.objects.model._meta.db_table} 
-        WHERE status=%s AND (deadline < %s OR max_shares > 0
-            AND (SELECT sum(quantity) FROM artcrowd_share
-            WHERE project_id=artcrowd_project.id) >= max_shares)
-    ''', (Project.OPEN, timezone.now()))).all()
+    projects = Project.objects.filter(
+        Q(deadline__lt=timezone.now()) | Q(max_shares__gt=0, shares_num__gte=F('max_shares')), status=Project.OPEN)
 
     for project in projects:
         project.status = Project.SALE_CLOSED
-        blockchain.update_project_status(project)
-        project.save()
+        with transaction.atomic():
+            project.save()
+            outbox.enqueue(OutboxOperation.UPDATE_PROJECT_STATUS, project, status=project.status)
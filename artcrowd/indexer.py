@@ -0,0 +1,219 @@
+import json
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from pytezos.contract.interface import ContractInterface
+from . import models, blockchain
+
+CURSOR_NAME = 'contracts'
+
+
+class NodeBlockSource:
+    """Blocks and contract schemas read from the Tezos node"""
+
+    def head_level(self):
+        return blockchain.get_client().shell.head.header()['level']
+
+    def block(self, level):
+        return blockchain.get_client().shell.blocks[level]()
+
+    def big_map_schema(self, address):
+        return blockchain.get_big_map_schema(address)
+
+
+class FixtureBlockSource:
+    """Blocks recorded to a JSON file, used to replay the indexer without network access.
+    The file holds {"contracts": {address: {"code": ..., "storage": ...}}, "blocks": [...]}"""
+
+    def __init__(self, path):
+        with open(path, 'rt') as fp:
+            data = json.load(fp)
+        self.contracts = data['contracts']
+        self.blocks = {block['header']['level']: block for block in data['blocks']}
+
+    def head_level(self):
+        return max(self.blocks)
+
+    def block(self, level):
+        return self.blocks[level]
+
+    def big_map_schema(self, address):
+        contract = ContractInterface.from_micheline(self.contracts[address]['code'])
+        storage = contract.program.storage.from_micheline_value(self.contracts[address]['storage'])
+        return blockchain.big_map_schema(storage.item)
+
+
+def iter_big_map_diffs(block):
+    """Yield (ophash, big map id, key, value) for every applied big map update of the block,
+    value is None when the key is removed"""
+    for operation in block['operations'][-1]:  # manager operations
+        for content in operation['contents']:
+            metadata = content.get('metadata', {})
+            results = [metadata.get('operation_result', {})]
+            results += [internal.get('result', {}) for internal in metadata.get('internal_operation_results', [])]
+            for result in results:
+                if result.get('status') != 'applied':
+                    continue
+                for diff in result.get('lazy_storage_diff', []):
+                    if diff['kind'] != 'big_map' or diff['diff']['action'] != 'update':
+                        continue
+                    for update in diff['diff']['updates']:
+                        yield operation['hash'], int(diff['id']), update['key'], update.get('value')
+
+
+class BlockFollower:
+    """Processes blocks one by one after a persisted cursor, each block in its own transaction"""
+    cursor_name = None
+
+    def __init__(self, source):
+        self.source = source
+
+    def get_cursor(self):
+        return models.ChainCursor.objects.filter(name=self.cursor_name).first()
+
+    def sync(self, start_level=None, confirmations=0):
+        """Process every available block after the cursor, return the number of blocks processed"""
+        cursor = self.get_cursor()
+        level = cursor.level + 1 if cursor else (start_level or self.source.head_level() - confirmations)
+        last_level = self.source.head_level() - confirmations
+        processed = 0
+        while level <= last_level:
+            block = self.source.block(level)
+            if cursor and block['header']['predecessor'] != cursor.block_hash:
+                cursor = self.rewind(cursor)
+                level = cursor.level + 1
+                continue
+            self.process_block(block, cursor)
+            cursor = self.get_cursor()
+            level += 1
+            processed += 1
+        return processed
+
+    @transaction.atomic
+    def process_block(self, block, cursor=None):
+        header = block['header']
+        if cursor and header['predecessor'] != cursor.block_hash:
+            raise Exception(f'block {header["level"]} does not follow processed block {cursor.block_hash}')
+        self.handle_block(block)
+        models.ChainCursor.objects.update_or_create(
+            name=self.cursor_name, defaults={'level': header['level'], 'block_hash': block['hash']})
+        models.ChainBlock.objects.update_or_create(
+            cursor=self.cursor_name, level=header['level'], defaults={'block_hash': block['hash']})
+        models.ChainBlock.objects.filter(
+            cursor=self.cursor_name, level__lte=header['level'] - settings.CHAIN_REORG_DEPTH).delete()
+
+    @transaction.atomic
+    def rewind(self, cursor):
+        """Move the cursor back to the last processed block still in the chain after a reorganisation,
+        return the new cursor"""
+        for processed in models.ChainBlock.objects.filter(cursor=self.cursor_name).order_by('-level'):
+            if self.source.block(processed.level)['hash'] == processed.block_hash:
+                break
+        else:
+            raise Exception(f'no processed block of {self.cursor_name} is an ancestor of the chain '
+                            f'after {cursor.block_hash}')
+        self.rollback(processed.level)
+        models.ChainBlock.objects.filter(cursor=self.cursor_name, level__gt=processed.level).delete()
+        cursor.level, cursor.block_hash = processed.level, processed.block_hash
+        cursor.save()
+        return cursor
+
+    def handle_block(self, block):
+        raise NotImplementedError
+
+    def rollback(self, level):
+        """Undo the processing of the blocks after the level"""
+        raise Exception(f'{self.cursor_name} cannot roll back blocks after level {level}')
+
+
+class Indexer(BlockFollower):
+    """Mirrors the ledger, projects and shares big maps of the projects contract and the tokens minted
+    by the gallery contract into the database. Only blocks at least INDEXER_CONFIRMATIONS deep are processed,
+    so that the mirrors never have to be rolled back after a reorganisation."""
+    cursor_name = CURSOR_NAME
+
+    def __init__(self, source):
+        super().__init__(source)
+        self.big_maps = {}  # big map id -> (contract address, name, type)
+        for address in (settings.PROJECTS_CONTRACT, settings.GALLERY_CONTRACT):
+            for name, (ptr, big_map_type) in source.big_map_schema(address).items():
+                self.big_maps[ptr] = (address, name, big_map_type)
+
+    def sync(self, start_level=None, confirmations=None):
+        confirmations = settings.INDEXER_CONFIRMATIONS if confirmations is None else confirmations
+        return super().sync(start_level, confirmations)
+
+    def handle_block(self, block):
+        for ophash, ptr, key, value in iter_big_map_diffs(block):
+            if ptr not in self.big_maps:
+                continue
+            address, name, big_map_type = self.big_maps[ptr]
+            key = big_map_type.args[0].from_micheline_value(key).to_python_object()
+            if value is not None:
+                value = big_map_type.args[1].from_micheline_value(value).to_python_object()
+            self.apply(address, name, key, value, block['header']['level'], ophash)
+
+    def apply(self, address, name, key, value, level, ophash):
+        if address == settings.PROJECTS_CONTRACT and name == 'ledger':
+            if value is None:
+                models.ChainLedger.objects.filter(wallet=key).delete()
+            else:
+                models.ChainLedger.objects.update_or_create(wallet=key, defaults={'amount': value, 'level': level})
+        elif address == settings.PROJECTS_CONTRACT and name == 'projects':
+            if value is None:
+                models.ChainProject.objects.filter(project_id=key).delete()
+            else:
+                models.ChainProject.objects.update_or_create(project_id=key, defaults={
+                    'status': value['status'], 'share_price': value['share_price'],
+                    'total_shares': value['total_shares'], 'level': level})
+        elif address == settings.PROJECTS_CONTRACT and name == 'shares':
+            project_id, wallet = key
+            if value is None:
+                models.ChainShares.objects.filter(project_id=project_id, wallet=wallet).delete()
+            else:
+                models.ChainShares.objects.update_or_create(project_id=project_id, wallet=wallet,
+                                                            defaults={'shares': value, 'level': level})
+        elif address == settings.GALLERY_CONTRACT and name == 'token_metadata' and value is not None:
+            models.ChainToken.objects.get_or_create(token_id=key, defaults={'level': level, 'ophash': ophash})
+
+
+def is_synced():
+    """Whether the mirrors were updated recently enough to be used instead of the node"""
+    cursor = models.ChainCursor.objects.filter(name=CURSOR_NAME).first()
+    return bool(cursor) and timezone.now() - cursor.updated_on < timedelta(seconds=settings.INDEXER_MAX_LAG)
+
+
+def get_wallet_money(wallet):
+    ledger = models.ChainLedger.objects.filter(wallet=wallet).first()
+    return ledger.amount if ledger else 0
+
+
+def get_bought_shares(project_id):
+    project = models.ChainProject.objects.filter(project_id=project_id).first()
+    return project.total_shares if project else 0
+
+
+def read_at_cursor(read):
+    """(indexed block hash, result of read()), read again if a block was indexed meanwhile,
+    at most INDEXER_READ_ATTEMPTS times"""
+    for attempt in range(settings.INDEXER_READ_ATTEMPTS):
+        cursor = models.ChainCursor.objects.get(name=CURSOR_NAME)
+        result = read()
+        if models.ChainCursor.objects.filter(name=CURSOR_NAME, block_hash=cursor.block_hash).exists():
+            return cursor.block_hash, result
+    raise Exception(f'index moved on during {settings.INDEXER_READ_ATTEMPTS} reads')
+
+
+def get_holdings(wallets, project_ids):
+    """(block hash, {wallet: {'money': mutez, 'shares': {project_id: shares}}}) from the mirrors"""
+    def read():
+        holdings = {wallet: {'money': 0, 'shares': {project_id: 0 for project_id in project_ids}}
+                    for wallet in wallets}
+        for wallet, amount in models.ChainLedger.objects.filter(wallet__in=wallets).values_list('wallet', 'amount'):
+            holdings[wallet]['money'] = amount
+        for project_id, wallet, shares in models.ChainShares.objects.filter(
+                wallet__in=wallets, project_id__in=project_ids).values_list('project_id', 'wallet', 'shares'):
+            holdings[wallet]['shares'][project_id] = shares
+        return holdings
+    return read_at_cursor(read)
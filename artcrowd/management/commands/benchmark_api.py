@@ -0,0 +1,118 @@
+import random
+import time
+from datetime import timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.urls import reverse
+from django.utils import timezone
+from pytezos.crypto.key import Key
+from rest_framework.test import APIClient
+from artcrowd import blockchain, indexer, minting, outbox, simulator, tracker
+from artcrowd.models import AccountCounter, ChainCursor, MintingJob, OutboxOperation, Project, User
+
+
+def percentiles(seconds):
+    seconds = sorted(seconds)
+    return [seconds[len(seconds) // 2], seconds[int(len(seconds) * 0.95)], seconds[-1]]
+
+
+class Command(BaseCommand):
+    help = ('Run the buy, refund and mint flows through the API against the chain simulator, in a transaction '
+            'rolled back at the end, and report the throughput')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--patrons', type=int, default=200, help='wallets buying shares')
+        parser.add_argument('--short', type=float, default=0.1, help='share of the patrons without enough money')
+        parser.add_argument('--keep', action='store_true', help='commit the seeded projects and purchases')
+
+    def handle(self, *args, **options):
+        if settings.TEZOS_BACKEND != 'simulator':
+            raise CommandError('set TEZOS_BACKEND=simulator, the benchmark sends operations to the chain')
+        simulator.reset()
+        blockchain.reset()
+        chain = simulator.get_chain()
+        operations_tracker = tracker.Tracker(indexer.NodeBlockSource())
+        client = APIClient(SERVER_NAME=settings.ALLOWED_HOSTS[0])
+        rng = random.Random(0)
+
+        def settle():
+            """Send the outbox and follow the chain until nothing is left to send, return (groups, seconds)"""
+            started, blocks = time.perf_counter(), len(chain.blocks)
+            while outbox.dispatch():
+                pass
+            operations_tracker.sync(start_level=1, confirmations=0)
+            return len(chain.blocks) - blocks, time.perf_counter() - started
+
+        def report(name, count, seconds, latencies=None):
+            line = f'{name:10} {count:6} {seconds:8.2f}s {count / seconds:9.1f}/s'
+            if latencies:
+                line += ' ' + ' '.join(f'{value * 1000:6.1f}ms' for value in percentiles(latencies))
+            self.stdout.write(line)
+
+        with transaction.atomic():
+            # state kept for another chain
+            ChainCursor.objects.filter(name=operations_tracker.cursor_name).delete()
+            AccountCounter.objects.all().delete()
+            artist = User.objects.create(username=f'bench-{rng.getrandbits(48):x}', password='!',
+                                         tzwallet=Key.generate(export=False).public_key_hash())
+            projects = [Project.objects.create(
+                artist=artist, title=f'Benchmark {name}', description=name, nft_description=name,
+                status=Project.OPEN, share_price=2, deadline=timezone.now() + timedelta(days=7))
+                for name in ('minted', 'refunded')]
+            for project in projects:
+                outbox.enqueue(OutboxOperation.CREATE_PROJECT, project, status=project.status)
+            settle()
+            self.stdout.write(f'{"flow":10} {"count":>6} {"time":>9} {"rate":>11} {"p50":>8} {"p95":>8} {"max":>8}')
+
+            purchases = []  # (project, quantity, wallet, ophash of the deposit)
+            for i in range(options['patrons']):
+                project, quantity = projects[i % 2], rng.randint(1, 5)
+                wallet = Key.generate(export=False).public_key_hash()
+                short = rng.random() < options['short']
+                ophash = chain.deposit(wallet, 1 if short else project.share_price * quantity * 1_000_000)
+                purchases.append((project, quantity, wallet, ophash))
+            time.sleep(settings.TEZOS_HEAD_TTL)  # the purchases see the deposits in the head
+
+            latencies, refused = [], 0
+            started = time.perf_counter()
+            for project, quantity, wallet, ophash in purchases:
+                request_started = time.perf_counter()
+                response = client.post(reverse('buy_shares', args=(project.id,)),
+                                       {'quantity': quantity, 'wallet': wallet, 'ophash': ophash}, format='json')
+                latencies.append(time.perf_counter() - request_started)
+                refused += response.status_code != 201
+            report('buy', options['patrons'], time.perf_counter() - started, latencies)
+            self.stdout.write(f'{refused} purchases refused and refunded')
+            operations = OutboxOperation.objects.count()
+            groups, seconds = settle()
+            report('outbox', operations, seconds)
+            self.stdout.write(f'{groups} operation groups, '
+                              f'{OutboxOperation.objects.exclude(status=OutboxOperation.SENT).count()} not sent')
+
+            project = projects[1]  # as the admin does when a project is refunded
+            project.refresh_from_db()
+            project.status = Project.REFUNDED
+            project.save()
+            wallets = list(set(project.project_shares.values_list('patron__tzwallet', flat=True)))
+            outbox.enqueue(OutboxOperation.REFUND_ALL, project, status=project.status, wallets=wallets)
+            project.project_shares.all().delete()
+            groups, seconds = settle()
+            report('refund_all', len(wallets), seconds)
+            self.stdout.write(f'{groups} operation groups')
+
+            project = projects[0]  # as the admin does when a project is completed
+            project.refresh_from_db()
+            project.status = Project.COMPLETED
+            project.save()
+            job = minting.create_job(project, 'https://artcrowd.test/meta')
+            holders = project.patrons_count
+            started = time.perf_counter()
+            while minting.run(job) in (MintingJob.PENDING, MintingJob.RUNNING):
+                operations_tracker.sync(start_level=1, confirmations=0)
+            report('mint', holders, time.perf_counter() - started)
+            self.stdout.write(f'{job.chunks.count()} chunks, job {job.status} {job.error}'.rstrip())
+            if not options['keep']:
+                transaction.set_rollback(True)
+        simulator.reset()
+        blockchain.reset()
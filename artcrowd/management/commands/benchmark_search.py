@@ -0,0 +1,75 @@
+import itertools
+import random
+import time
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from artcrowd import search
+from artcrowd.models import Project, User
+
+SYLLABLES = ('ka', 'ri', 'mo', 'ne', 'ta', 'su', 'lo', 'vi', 'an', 'el', 'or', 'um', 'pa', 'ze', 'gi')
+
+
+def timings(run, queries):
+    seconds = []
+    for text in queries:
+        started = time.perf_counter()
+        run(text)
+        seconds.append(time.perf_counter() - started)
+    seconds.sort()
+    return [seconds[len(seconds) // 2], seconds[int(len(seconds) * 0.95)], seconds[-1]]
+
+
+class Command(BaseCommand):
+    help = 'Seed projects in a transaction rolled back at the end and time the project search against a plain scan'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--projects', type=int, default=100_000, help='projects to seed')
+        parser.add_argument('--queries', type=int, default=200, help='searches to time')
+        parser.add_argument('--page', type=int, default=20, help='projects read by every search')
+        parser.add_argument('--keep', action='store_true', help='commit the seeded projects')
+
+    def handle(self, *args, **options):
+        rng = random.Random(0)
+        vocabulary = list({''.join(rng.choices(SYLLABLES, k=rng.randint(2, 4))) for i in range(20_000)})
+        # a few common words and many rare ones
+        cum_weights = list(itertools.accumulate(1 / (rank + 1) for rank in range(len(vocabulary))))
+
+        def text(words):
+            return ' '.join(rng.choices(vocabulary, cum_weights=cum_weights, k=words))
+
+        with transaction.atomic():
+            started = time.perf_counter()
+            artists = User.objects.bulk_create(User(username=f'bench-{rng.getrandbits(48):x}', password='!')
+                                               for i in range(options['projects'] // 100 + 1))
+            deadline = timezone.now()
+            Project.objects.bulk_create((Project(
+                artist=rng.choice(artists), title=text(3), description=text(60), nft_description=text(15),
+                status=Project.OPEN, share_price=1, deadline=deadline) for i in range(options['projects'])),
+                batch_size=1000)
+            seeded = time.perf_counter() - started
+            started = time.perf_counter()
+            search.index_projects()  # bulk_create does not send post_save
+            indexed = time.perf_counter() - started
+            self.stdout.write(f'{options["projects"]} projects seeded in {seeded:.1f}s, indexed in {indexed:.1f}s')
+
+            queries = {words: [' '.join(rng.choices(choices, k=rng.randint(1, 2))) for i in range(options['queries'])]
+                       for words, choices in (('common', vocabulary[:100]), ('rare', vocabulary[1000:]))}
+            projects = Project.objects.filter(status=Project.OPEN)
+            page = options['page']
+
+            def scan(text):
+                matches = projects
+                for word in text.split():
+                    matches = matches.filter(Q(title__icontains=word) | Q(description__icontains=word) |
+                                             Q(nft_description__icontains=word) | Q(artist__username__icontains=word))
+                list(matches.order_by('-id')[:page])
+
+            self.stdout.write(f'{"words":8} {"search":8} {"p50":>8} {"p95":>8} {"max":>8}')
+            for words, texts in queries.items():
+                for name, run in (('index', lambda text: list(search.search(projects, text)[:page])), ('scan', scan)):
+                    self.stdout.write(f'{words:8} {name:8} ' +
+                                      ' '.join(f'{seconds * 1000:6.1f}ms' for seconds in timings(run, texts)))
+            if not options['keep']:
+                transaction.set_rollback(True)
@@ -0,0 +1,57 @@
+import logging
+from django.core.management.base import BaseCommand
+from django.conf import settings
+from artcrowd import blockchain
+from artcrowd.models import GasProfile, Project
+
+
+def sample_calls(project, wallet, size):
+    """Representative calls of the entrypoints sent by the app, batch entrypoints with `size` items"""
+    contract = blockchain.get_contract(settings.PROJECTS_CONTRACT)
+    gallery_contract = blockchain.get_contract(settings.GALLERY_CONTRACT)
+    return {
+        'update_project_status': lambda: contract.update_project_status(project.status, project.id),
+        'buy_shares': lambda: contract.buy_shares((1, wallet), project.id),
+        'refund_all': lambda: contract.refund_all(project.id, [wallet] * size),
+        'withdraw_mutez': lambda: contract.withdraw_mutez(0, wallet),
+        'mint': lambda: gallery_contract.mint([{'token': {'new': {'': b'calibration'}}, 'amount': 1, 'to_': wallet}]
+                                              * size),
+    }
+
+
+def fit(measures):
+    """Base and per item cost from {size: cost}, linear between the smallest and the largest size"""
+    small, large = min(measures), max(measures)
+    per_item = max(0, (measures[large] - measures[small]) // (large - small)) if large > small else 0
+    return max(0, measures[small] - per_item * small), per_item
+
+
+class Command(BaseCommand):
+    help = 'Measure gas and storage of the contract entrypoints so that operations are sent without simulation'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--project-id', type=int, required=True, help='existing project used in the sample calls')
+        parser.add_argument('--wallet', help='wallet used in the sample calls, the admin wallet by default')
+        parser.add_argument('--size', type=int, default=10, help='number of items for batch entrypoints')
+
+    def handle(self, *args, **options):
+        project = Project.objects.get(id=options['project_id'])
+        wallet = options['wallet'] or blockchain.get_client().key.public_key_hash()
+        measures = {}  # (contract, entrypoint) -> {size: (gas, storage)}
+        for size in sorted({1, options['size']}):
+            for entrypoint, build in sample_calls(project, wallet, size).items():
+                try:
+                    call = build()
+                    key = (call.address, call.parameters['entrypoint'])
+                    measures.setdefault(key, {})[blockchain.param_size(call.parameters['value'])] = \
+                        blockchain.simulate(call)
+                except Exception as ex:
+                    logging.warning(f'cannot calibrate {entrypoint} with {size} items: {ex}')
+        for (contract, entrypoint), by_size in measures.items():
+            gas_base, gas_per_item = fit({size: gas for size, (gas, storage) in by_size.items()})
+            storage_base, storage_per_item = fit({size: storage for size, (gas, storage) in by_size.items()})
+            GasProfile.objects.update_or_create(contract=contract, entrypoint=entrypoint, defaults={
+                'gas_base': gas_base, 'gas_per_item': gas_per_item, 'storage_base': storage_base,
+                'storage_per_item': storage_per_item, 'stale': False})
+            self.stdout.write(f'{entrypoint}: gas {gas_base} + {gas_per_item}/item, '
+                              f'storage {storage_base} + {storage_per_item}/item')
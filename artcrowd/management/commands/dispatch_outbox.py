@@ -0,0 +1,27 @@
+import time
+import logging
+from django.core.management.base import BaseCommand
+from django.conf import settings
+from artcrowd import outbox
+
+
+class Command(BaseCommand):
+    help = 'Send blockchain operations recorded in the outbox'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, help='max operations per operation group')
+        parser.add_argument('--once', action='store_true', help='send the due operations and exit')
+
+    def handle(self, *args, **options):
+        while True:
+            try:
+                outbox.recover_interrupted()
+                while outbox.dispatch(options['batch_size']):
+                    pass
+            except Exception as ex:
+                if options['once']:
+                    raise
+                logging.warning(ex)
+            if options['once']:
+                break
+            time.sleep(settings.OUTBOX_POLL_INTERVAL)
@@ -0,0 +1,33 @@
+import time
+import logging
+from django.core.management.base import BaseCommand
+from django.conf import settings
+from artcrowd import indexer
+
+
+class Command(BaseCommand):
+    help = 'Follow the chain and mirror the projects and gallery contracts big maps into the database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fixture', help='replay blocks recorded to a JSON file instead of reading the node')
+        parser.add_argument('--start-level', type=int, help='first block to index when there is no cursor yet')
+        parser.add_argument('--once', action='store_true', help='process the available blocks and exit')
+
+    def handle(self, *args, **options):
+        if options['fixture']:
+            source, confirmations = indexer.FixtureBlockSource(options['fixture']), 0
+        else:
+            source, confirmations = indexer.NodeBlockSource(), settings.INDEXER_CONFIRMATIONS
+        chain_indexer = indexer.Indexer(source)
+        while True:
+            try:
+                processed = chain_indexer.sync(options['start_level'], confirmations)
+                if processed:
+                    self.stdout.write(f'indexed {processed} blocks up to {chain_indexer.get_cursor().level}')
+            except Exception as ex:
+                if options['once']:
+                    raise
+                logging.warning(ex)
+            if options['once'] or options['fixture']:
+                break
+            time.sleep(settings.INDEXER_POLL_INTERVAL)
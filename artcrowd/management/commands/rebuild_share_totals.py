@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from artcrowd.models import Project, rebuild_share_totals
+
+
+class Command(BaseCommand):
+    help = 'Recompute the shares totals stored on the projects, to fill them in or to repair them'
+
+    def add_arguments(self, parser):
+        parser.add_argument('project_ids', nargs='*', type=int, help='projects to rebuild, all by default')
+
+    def handle(self, *args, **options):
+        projects = Project.objects.filter(id__in=options['project_ids']) if options['project_ids'] else None
+        self.stdout.write(f'{rebuild_share_totals(projects)} projects rebuilt')
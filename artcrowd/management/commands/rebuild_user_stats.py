@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from artcrowd.models import User, rebuild_user_stats
+
+
+class Command(BaseCommand):
+    help = 'Recompute the profile statistics of the users, to fill them in or to repair them'
+
+    def add_arguments(self, parser):
+        parser.add_argument('usernames', nargs='*', help='users to rebuild, all by default')
+
+    def handle(self, *args, **options):
+        users = User.objects.filter(username__in=options['usernames']) if options['usernames'] else None
+        self.stdout.write(f'{rebuild_user_stats(users)} users rebuilt')
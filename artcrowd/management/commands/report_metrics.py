@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand
+from artcrowd import metrics
+
+
+def format_seconds(seconds):
+    return f'>{metrics.LATENCY_BUCKETS[-1]}s' if seconds is None else f'{seconds * 1000:.0f}ms'
+
+
+class Command(BaseCommand):
+    help = 'Report calls, errors and latency of the blockchain functions, and bytes and gas by entrypoint'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sort', choices=['total', 'calls', 'errors', 'mean'], default='total',
+                            help='order of the functions, by total time by default')
+        parser.add_argument('--prometheus', action='store_true', help='print the Prometheus text format')
+        parser.add_argument('--clear', action='store_true', help='forget the counts written so far')
+
+    def handle(self, *args, **options):
+        if options['clear']:
+            metrics.clear()
+            return
+        data = metrics.collect()
+        if options['prometheus']:
+            self.stdout.write(metrics.render(data), ending='')
+            return
+        sort_key = {
+            'total': lambda call: call['sum'],
+            'calls': lambda call: call['count'],
+            'errors': lambda call: call['errors'],
+            'mean': lambda call: call['sum'] / call['count'],
+        }[options['sort']]
+        self.stdout.write(f'{"function":32} {"calls":>8} {"errors":>7} {"mean":>8} {"p50":>8} {"p95":>8} {"total":>9}')
+        for name, call in sorted(data['calls'].items(), key=lambda item: sort_key(item[1]), reverse=True):
+            self.stdout.write(f'{name:32} {call["count"]:8} {call["errors"]:7} '
+                              f'{format_seconds(call["sum"] / call["count"]):>8} '
+                              f'{format_seconds(metrics.quantile(call, 0.5)):>8} '
+                              f'{format_seconds(metrics.quantile(call, 0.95)):>8} {call["sum"]:8.1f}s')
+        totals = data['totals']
+        entrypoints = sorted(set().union(*totals.values())) if totals else []
+        if entrypoints:
+            self.stdout.write('')
+            self.stdout.write(f'{"entrypoint":32} {"calls":>8} {"bytes":>10} {"gas limit":>12} {"gas used":>12}')
+            for entrypoint in entrypoints:
+                self.stdout.write(f'{entrypoint:32} {totals.get("operations", {}).get(entrypoint, 0):8} '
+                                  f'{totals.get("operation_bytes", {}).get(entrypoint, 0):10} '
+                                  f'{totals.get("operation_gas_limit", {}).get(entrypoint, 0):12} '
+                                  f'{totals.get("operation_gas", {}).get(entrypoint, 0):12}')
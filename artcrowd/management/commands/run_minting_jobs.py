@@ -0,0 +1,26 @@
+import time
+from django.core.management.base import BaseCommand
+from django.conf import settings
+from artcrowd import minting
+from artcrowd.models import MintingJob
+
+
+class Command(BaseCommand):
+    help = 'Mint the tokens of completed projects chunk by chunk, run a single instance next to track_operations'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--job', type=int, help='run only this job')
+        parser.add_argument('--once', action='store_true', help='advance the jobs once and exit')
+
+    def handle(self, *args, **options):
+        while True:
+            jobs = MintingJob.objects.filter(status__in=(MintingJob.PENDING, MintingJob.RUNNING)).order_by('id')
+            if options['job']:
+                jobs = jobs.filter(id=options['job'])
+            for job in jobs:
+                status = minting.run(job)
+                if status != MintingJob.RUNNING:
+                    self.stdout.write(f'minting job {job.id} {status}')
+            if options['once']:
+                break
+            time.sleep(settings.MINTING_POLL_INTERVAL)
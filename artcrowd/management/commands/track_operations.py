@@ -0,0 +1,31 @@
+import time
+import logging
+from django.core.management.base import BaseCommand
+from django.conf import settings
+from artcrowd import indexer, tracker
+
+
+class Command(BaseCommand):
+    help = 'Follow new blocks and record the inclusion of pending operations'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fixture', help='replay blocks recorded to a JSON file instead of reading the node')
+        parser.add_argument('--start-level', type=int, help='first block to check when there is no cursor yet')
+        parser.add_argument('--once', action='store_true', help='process the available blocks and exit')
+
+    def handle(self, *args, **options):
+        if options['fixture']:
+            source, confirmations = indexer.FixtureBlockSource(options['fixture']), 0
+        else:
+            source, confirmations = indexer.NodeBlockSource(), settings.TRACKER_CONFIRMATIONS
+        operations_tracker = tracker.Tracker(source)
+        while True:
+            try:
+                operations_tracker.sync(options['start_level'], confirmations)
+            except Exception as ex:
+                if options['once']:
+                    raise
+                logging.warning(ex)
+            if options['once'] or options['fixture']:
+                break
+            time.sleep(settings.TRACKER_POLL_INTERVAL)
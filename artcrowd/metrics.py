@@ -0,0 +1,234 @@
+import os
+import json
+import time
+import atexit
+import bisect
+import fcntl
+import logging
+import threading
+from functools import wraps
+from django.conf import settings
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)  # in seconds
+TOTALS_HELP = {
+    'operations': 'Contract calls injected',
+    'operation_bytes': 'Bytes of the parameters of the injected contract calls',
+    'operation_gas_limit': 'Gas limit of the injected contract calls',
+    'operation_gas': 'Gas consumed by the included contract calls',
+}
+
+COMPACTED = 'compacted.json'  # counts of the processes which exited
+
+_lock = _flush_lock = None
+_calls = {}  # function -> {'count', 'errors', 'sum', 'buckets'}
+_totals = {}  # metric -> {entrypoint: amount}
+_process_id = None
+_flushed_at = 0.0
+
+
+def _reset_process():
+    """Start from zero in a new process, counts of the parent are written by the parent"""
+    global _lock, _flush_lock, _process_id, _flushed_at
+    _lock, _flush_lock = threading.Lock(), threading.Lock()
+    _calls.clear()
+    _totals.clear()
+    _process_id = f'{os.getpid()}-{int(time.time() * 1000)}'
+    _flushed_at = time.monotonic()
+
+
+def observe(name, seconds, error=False):
+    with _lock:
+        call = _calls.get(name)
+        if call is None:
+            call = _calls[name] = {'count': 0, 'errors': 0, 'sum': 0.0, 'buckets': [0] * (len(LATENCY_BUCKETS) + 1)}
+        call['count'] += 1
+        call['errors'] += error
+        call['sum'] += seconds
+        call['buckets'][bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+    flush()
+
+
+def add(metric, label, amount=1):
+    with _lock:
+        by_label = _totals.setdefault(metric, {})
+        by_label[label] = by_label.get(label, 0) + amount
+
+
+def timed(func, name=None):
+    """Wrap a function to record its calls, errors and latency"""
+    name = name or func.__name__
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            result = func(*args, **kwargs)
+        except BaseException:
+            observe(name, time.perf_counter() - started, error=True)
+            raise
+        observe(name, time.perf_counter() - started)
+        return result
+    for attr in ('cache_info', 'cache_clear'):  # keep the interface of lru_cache functions
+        if hasattr(func, attr):
+            setattr(wrapper, attr, getattr(func, attr))
+    return wrapper
+
+
+def instrument(namespace, exclude=()):
+    """Replace every function defined in a module by its timed version, `namespace` is the globals() of the module.
+    Calls between functions of the module go through the globals, so they are recorded as well."""
+    module = namespace['__name__']
+    for name, value in list(namespace.items()):
+        if callable(value) and not isinstance(value, type) and getattr(value, '__module__', None) == module \
+                and name not in exclude and not name.startswith('__'):
+            namespace[name] = timed(value, name)
+
+
+def snapshot():
+    with _lock:
+        return {'calls': {name: dict(call, buckets=list(call['buckets'])) for name, call in _calls.items()},
+                'totals': {metric: dict(by_label) for metric, by_label in _totals.items()}}
+
+
+def flush(force=False):
+    """Write the counts of this process to METRICS_DIR, at most every METRICS_FLUSH_INTERVAL unless forced"""
+    global _flushed_at
+    if not settings.METRICS_DIR or (not force and time.monotonic() - _flushed_at < settings.METRICS_FLUSH_INTERVAL):
+        return
+    if not _calls and not _totals:  # nothing recorded, no file for processes which never reach the chain
+        return
+    if not _flush_lock.acquire(blocking=force):  # another thread is writing
+        return
+    try:
+        _flushed_at = time.monotonic()
+        os.makedirs(settings.METRICS_DIR, exist_ok=True)
+        path = os.path.join(settings.METRICS_DIR, f'{_process_id}.json')
+        with open(f'{path}.tmp', 'wt') as fp:
+            json.dump(snapshot(), fp)
+        os.replace(f'{path}.tmp', path)
+    except OSError as ex:
+        logging.warning(f'cannot write metrics: {ex}')
+    finally:
+        _flush_lock.release()
+
+
+def merge(data, other):
+    for name, call in other['calls'].items():
+        total = data['calls'].setdefault(name, {'count': 0, 'errors': 0, 'sum': 0.0,
+                                                'buckets': [0] * (len(LATENCY_BUCKETS) + 1)})
+        for field in ('count', 'errors', 'sum'):
+            total[field] += call[field]
+        total['buckets'] = [a + b for a, b in zip(total['buckets'], call['buckets'])]
+    for metric, by_label in other['totals'].items():
+        total = data['totals'].setdefault(metric, {})
+        for label, amount in by_label.items():
+            total[label] = total.get(label, 0) + amount
+    return data
+
+
+def _merge_file(data, filename):
+    try:
+        with open(os.path.join(settings.METRICS_DIR, filename), 'rt') as fp:
+            merge(data, json.load(fp))
+    except (OSError, ValueError, KeyError) as ex:
+        logging.warning(f'ignoring metrics file {filename}: {ex}')
+
+
+def _exited(filename):
+    try:
+        os.kill(int(filename.split('-')[0]), 0)
+    except ProcessLookupError:
+        return True
+    except (ValueError, OSError):  # not a process file, or a process of another user
+        return False
+    return False
+
+
+def compact():
+    """Fold the files of the processes which exited into COMPACTED, so that the directory does not grow with every
+    restart while the counters keep their totals"""
+    with open(os.path.join(settings.METRICS_DIR, '.lock'), 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)  # released when the file is closed
+        exited = [filename for filename in os.listdir(settings.METRICS_DIR)
+                  if filename.endswith('.json') and filename != COMPACTED and _exited(filename)]
+        if not exited:
+            return
+        data = {'calls': {}, 'totals': {}}
+        path = os.path.join(settings.METRICS_DIR, COMPACTED)
+        for filename in ([COMPACTED] if os.path.exists(path) else []) + exited:
+            _merge_file(data, filename)
+        with open(f'{path}.tmp', 'wt') as fp:
+            json.dump(data, fp)
+        os.replace(f'{path}.tmp', path)
+        for filename in exited:
+            os.remove(os.path.join(settings.METRICS_DIR, filename))
+
+
+def collect():
+    """Counts of all the processes which wrote to METRICS_DIR, including the current one"""
+    if not settings.METRICS_DIR:
+        return snapshot()
+    flush(force=True)
+    data = {'calls': {}, 'totals': {}}
+    if os.path.isdir(settings.METRICS_DIR):
+        try:
+            compact()
+        except OSError as ex:
+            logging.warning(f'cannot compact metrics: {ex}')
+        for filename in os.listdir(settings.METRICS_DIR):
+            if filename.endswith('.json'):
+                _merge_file(data, filename)
+    return data
+
+
+def clear():
+    """Forget the counts written so far, running processes write their own counts again at the next flush"""
+    if settings.METRICS_DIR and os.path.isdir(settings.METRICS_DIR):
+        for filename in os.listdir(settings.METRICS_DIR):
+            os.remove(os.path.join(settings.METRICS_DIR, filename))
+    with _lock:
+        _calls.clear()
+        _totals.clear()
+
+
+def quantile(call, q):
+    """Upper bound of the latency bucket holding the q-quantile, None when it is above the last bucket"""
+    rank, seen = q * call['count'], 0
+    for bound, count in zip(LATENCY_BUCKETS, call['buckets']):
+        seen += count
+        if seen >= rank:
+            return bound
+    return None
+
+
+def render(data):
+    """Prometheus text exposition format"""
+    lines = []
+
+    def header(metric, kind, help_text):
+        lines.extend([f'# HELP {metric} {help_text}', f'# TYPE {metric} {kind}'])
+
+    calls = sorted(data['calls'].items())
+    header('artcrowd_blockchain_calls_total', 'counter', 'Calls of the blockchain functions')
+    lines.extend(f'artcrowd_blockchain_calls_total{{function="{name}"}} {call["count"]}' for name, call in calls)
+    header('artcrowd_blockchain_errors_total', 'counter', 'Calls of the blockchain functions which raised')
+    lines.extend(f'artcrowd_blockchain_errors_total{{function="{name}"}} {call["errors"]}' for name, call in calls)
+    header('artcrowd_blockchain_call_seconds', 'histogram', 'Latency of the blockchain functions')
+    for name, call in calls:
+        cumulative = 0
+        for bound, count in zip(LATENCY_BUCKETS, call['buckets']):
+            cumulative += count
+            lines.append(f'artcrowd_blockchain_call_seconds_bucket{{function="{name}",le="{bound}"}} {cumulative}')
+        lines.append(f'artcrowd_blockchain_call_seconds_bucket{{function="{name}",le="+Inf"}} {call["count"]}')
+        lines.append(f'artcrowd_blockchain_call_seconds_sum{{function="{name}"}} {call["sum"]}')
+        lines.append(f'artcrowd_blockchain_call_seconds_count{{function="{name}"}} {call["count"]}')
+    for metric, by_label in sorted(data['totals'].items()):
+        header(f'artcrowd_blockchain_{metric}_total', 'counter', TOTALS_HELP.get(metric, metric))
+        lines.extend(f'artcrowd_blockchain_{metric}_total{{entrypoint="{label}"}} {amount}'
+                     for label, amount in sorted(by_label.items()))
+    return '\n'.join(lines) + '\n'
+
+
+_reset_process()
+os.register_at_fork(after_in_child=_reset_process)
+atexit.register(flush, force=True)
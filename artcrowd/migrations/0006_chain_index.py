@@ -0,0 +1,65 @@
+# Generated by Django 5.0a1 on 2026-10-18 14:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('artcrowd', '0005_user_cover_picture_alter_project_status_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChainCursor',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('level', models.IntegerField()),
+                ('block_hash', models.CharField(max_length=51)),
+                ('updated_on', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ChainLedger',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('wallet', models.CharField(max_length=36, unique=True)),
+                ('amount', models.BigIntegerField()),
+                ('level', models.IntegerField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ChainProject',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('project_id', models.BigIntegerField(unique=True)),
+                ('status', models.CharField(max_length=50)),
+                ('share_price', models.BigIntegerField()),
+                ('total_shares', models.IntegerField()),
+                ('level', models.IntegerField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ChainToken',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('token_id', models.BigIntegerField(unique=True)),
+                ('level', models.IntegerField()),
+                ('ophash', models.CharField(max_length=51)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ChainShares',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('project_id', models.BigIntegerField()),
+                ('wallet', models.CharField(max_length=36)),
+                ('shares', models.IntegerField()),
+                ('level', models.IntegerField()),
+            ],
+            options={
+                'unique_together': {('project_id', 'wallet')},
+            },
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.0a1 on 2026-10-18 14:08
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('artcrowd', '0006_chain_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutboxOperation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('create_project', 'create_project'), ('update_project_status', 'update_project_status'), ('buy_shares', 'buy_shares'), ('refund', 'refund'), ('refund_all', 'refund_all'), ('generate_token', 'generate_token'), ('generate_tokens', 'generate_tokens')], max_length=50)),
+                ('payload', models.JSONField(default=dict)),
+                ('status', models.CharField(choices=[('pending', 'pending'), ('sending', 'sending'), ('sent', 'sent'), ('failed', 'failed')], default='pending', max_length=20)),
+                ('attempts', models.IntegerField(default=0)),
+                ('next_attempt_on', models.DateTimeField(auto_now_add=True)),
+                ('ophash', models.CharField(blank=True, max_length=51)),
+                ('error', models.TextField(blank=True)),
+                ('created_on', models.DateTimeField(auto_now_add=True)),
+                ('sent_on', models.DateTimeField(blank=True, null=True)),
+                ('project', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='outbox_operations', to='artcrowd.project')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'next_attempt_on'], name='artcrowd_ou_status_e56c85_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.0a1 on 2026-10-18 14:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('artcrowd', '0007_outbox'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PendingOperation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ophash', models.CharField(max_length=51, unique=True)),
+                ('kind', models.CharField(choices=[('outbox', 'outbox'), ('share', 'share')], max_length=20)),
+                ('status', models.CharField(choices=[('pending', 'pending'), ('applied', 'applied'), ('failed', 'failed'), ('backtracked', 'backtracked'), ('skipped', 'skipped'), ('expired', 'expired')], default='pending', max_length=20)),
+                ('level', models.IntegerField(blank=True, null=True)),
+                ('block_hash', models.CharField(blank=True, max_length=51)),
+                ('error', models.TextField(blank=True)),
+                ('created_on', models.DateTimeField(auto_now_add=True)),
+                ('updated_on', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'created_on'], name='artcrowd_pe_status_1d0b8c_idx')],
+            },
+        ),
+    ]
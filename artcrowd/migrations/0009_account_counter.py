@@ -0,0 +1,22 @@
+# Generated by Django 5.0a1 on 2026-10-18 14:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('artcrowd', '0008_pending_operation'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AccountCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(max_length=36, unique=True)),
+                ('counter', models.BigIntegerField(null=True)),
+                ('updated_on', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
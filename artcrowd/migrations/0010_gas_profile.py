@@ -0,0 +1,30 @@
+# Generated by Django 5.0a1 on 2026-10-18 14:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('artcrowd', '0009_account_counter'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GasProfile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('contract', models.CharField(max_length=36)),
+                ('entrypoint', models.CharField(max_length=100)),
+                ('gas_base', models.PositiveIntegerField()),
+                ('gas_per_item', models.PositiveIntegerField(default=0)),
+                ('storage_base', models.PositiveIntegerField()),
+                ('storage_per_item', models.PositiveIntegerField(default=0)),
+                ('stale', models.BooleanField(default=False)),
+                ('updated_on', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'unique_together': {('contract', 'entrypoint')},
+            },
+        ),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 5.0a1 on 2026-10-18 14:20
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('artcrowd', '0010_gas_profile'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='pendingoperation',
+            name='kind',
+            field=models.CharField(choices=[('outbox', 'outbox'), ('share', 'share'), ('minting', 'minting')], max_length=20),
+        ),
+        migrations.CreateModel(
+            name='MintingJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('meta_url', models.CharField(max_length=255)),
+                ('token_id', models.PositiveIntegerField(blank=True, null=True)),
+                ('status', models.CharField(choices=[('pending', 'pending'), ('running', 'running'), ('paused', 'paused'), ('done', 'done'), ('failed', 'failed')], db_index=True, default='pending', max_length=20)),
+                ('error', models.TextField(blank=True)),
+                ('created_on', models.DateTimeField(auto_now_add=True)),
+                ('updated_on', models.DateTimeField(auto_now=True)),
+                ('project', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='minting_jobs', to='artcrowd.project')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='MintingChunk',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('index', models.PositiveIntegerField()),
+                ('holdings', models.JSONField()),
+                ('status', models.CharField(choices=[('pending', 'pending'), ('sent', 'sent'), ('applied', 'applied')], default='pending', max_length=20)),
+                ('ophash', models.CharField(blank=True, max_length=51)),
+                ('level', models.IntegerField(blank=True, null=True)),
+                ('error', models.TextField(blank=True)),
+                ('updated_on', models.DateTimeField(auto_now=True)),
+                ('job', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chunks', to='artcrowd.mintingjob')),
+            ],
+            options={
+                'ordering': ['index'],
+                'unique_together': {('job', 'index')},
+            },
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.0a1 on 2026-10-18 14:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('artcrowd', '0011_minting_job'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WalletPublicKey',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('wallet', models.CharField(max_length=36, unique=True)),
+                ('public_key', models.CharField(max_length=100)),
+                ('created_on', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.0a1 on 2026-10-18 14:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('artcrowd', '0012_wallet_public_key'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='project',
+            index=models.Index(fields=['created_on', 'id'], name='artcrowd_pr_created_a95ec1_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='project',
+            index=models.Index(fields=['deadline', 'id'], name='artcrowd_pr_deadlin_b3ae39_idx'),
+        ),
+    ]
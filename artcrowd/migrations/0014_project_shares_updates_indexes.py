@@ -0,0 +1,21 @@
+# Generated by Django 5.0a1 on 2026-10-18 14:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('artcrowd', '0013_project_feed_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='projectupdate',
+            index=models.Index(fields=['project', 'created_on', 'id'], name='artcrowd_pr_project_dd226a_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='share',
+            index=models.Index(fields=['project', 'purchased_on', 'id'], name='artcrowd_sh_project_d43e5e_idx'),
+        ),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 5.0a1 on 2026-10-18 14:52
+
+from django.db import migrations, models
+from django.db.models import Count, F, Max, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def fill_share_totals(apps, schema_editor):
+    Project = apps.get_model('artcrowd', 'Project')
+    Share = apps.get_model('artcrowd', 'Share')
+    shares = Share.objects.filter(project=OuterRef('pk')).order_by().values('project')
+    shares_num = Coalesce(Subquery(shares.annotate(total=Sum('quantity')).values('total')), 0)
+    Project.objects.update(
+        shares_num=shares_num, shares_sum=shares_num * F('share_price'),
+        patrons_count=Coalesce(Subquery(shares.annotate(count=Count('patron', distinct=True)).values('count')), 0),
+        last_share_at=Subquery(shares.annotate(latest=Max('purchased_on')).values('latest')))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('artcrowd', '0015_updated_on'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='project',
+            name='last_share_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='project',
+            name='patrons_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='project',
+            name='shares_num',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='project',
+            name='shares_sum',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='project',
+            index=models.Index(fields=['shares_num', 'id'], name='artcrowd_pr_shares__2c86f2_idx'),
+        ),
+        migrations.RunPython(fill_share_totals, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.0a1 on 2026-10-18 14:53
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def fill_user_stats(apps, schema_editor):
+    User, UserStats = apps.get_model('artcrowd', 'User'), apps.get_model('artcrowd', 'UserStats')
+    Project, Share = apps.get_model('artcrowd', 'Project'), apps.get_model('artcrowd', 'Share')
+    stats = {user_id: UserStats(user_id=user_id) for user_id in User.objects.values_list('id', flat=True)}
+    for field, queryset, key, total in (
+            ('created_projects_num', Project.objects, 'artist', Count('id')),
+            ('presented_projects_num', Project.objects, 'presenter', Count('id')),
+            ('supported_projects_num', Share.objects, 'patron', Count('project', distinct=True)),
+            ('shares_num', Share.objects, 'patron', Sum('quantity'))):
+        for row in queryset.exclude(**{key: None}).order_by().values(key).annotate(total=total):
+            setattr(stats[row[key]], field, row['total'])
+    UserStats.objects.bulk_create(stats.values(), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('artcrowd', '0016_project_share_totals'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserStats',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('created_projects_num', models.IntegerField(default=0)),
+                ('presented_projects_num', models.IntegerField(default=0)),
+                ('supported_projects_num', models.IntegerField(default=0)),
+                ('shares_num', models.IntegerField(default=0)),
+                ('updated_on', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['created_projects_num'], name='artcrowd_us_created_697b59_idx'), models.Index(fields=['supported_projects_num'], name='artcrowd_us_support_ab503c_idx')],
+            },
+        ),
+        migrations.RunPython(fill_user_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,50 @@
+from django.conf import settings
+from django.db import migrations
+
+# the index as created here, later changes to artcrowd.search come with their own migration
+SQLITE_TABLE = 'artcrowd_project_search'
+
+
+def create_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('ALTER TABLE artcrowd_project ADD COLUMN IF NOT EXISTS search_vector tsvector')
+            cursor.execute('CREATE INDEX IF NOT EXISTS artcrowd_project_search_idx '
+                           'ON artcrowd_project USING gin (search_vector)')
+            cursor.execute('''
+                UPDATE artcrowd_project SET search_vector = s.vector FROM (
+                    SELECT p.id,
+                        setweight(to_tsvector(%s, p.title), 'A') ||
+                        setweight(to_tsvector(%s, coalesce(u.username, '')), 'A') ||
+                        setweight(to_tsvector(%s, p.nft_description), 'B') ||
+                        setweight(to_tsvector(%s, p.description), 'C') AS vector
+                    FROM artcrowd_project p LEFT JOIN artcrowd_user u ON u.id = p.artist_id
+                ) s WHERE artcrowd_project.id = s.id''', [settings.SEARCH_CONFIG] * 4)
+        else:
+            cursor.execute(f'CREATE VIRTUAL TABLE IF NOT EXISTS {SQLITE_TABLE} USING fts5('
+                           f'title, artist, nft_description, description, tokenize="unicode61 remove_diacritics 2")')
+            cursor.execute(f'''
+                INSERT INTO {SQLITE_TABLE} (rowid, title, artist, nft_description, description)
+                SELECT p.id, p.title, coalesce(u.username, ''), p.nft_description, p.description
+                FROM artcrowd_project p LEFT JOIN artcrowd_user u ON u.id = p.artist_id''')
+
+
+def drop_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('ALTER TABLE artcrowd_project DROP COLUMN IF EXISTS search_vector')
+        else:
+            cursor.execute(f'DROP TABLE IF EXISTS {SQLITE_TABLE}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('artcrowd', '0017_user_stats'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
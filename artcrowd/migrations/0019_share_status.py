@@ -0,0 +1,29 @@
+# Generated by Django 5.0a1 on 2026-10-18 16:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('artcrowd', '0018_project_search'),
+    ]
+
+    operations = [
+        # shares recorded so far were bought with a confirmed buy_shares call
+        migrations.AddField(
+            model_name='share',
+            name='status',
+            field=models.CharField(choices=[('pending', 'pending'), ('applied', 'applied'), ('failed', 'failed')], default='applied', max_length=20),
+        ),
+        migrations.AlterField(
+            model_name='share',
+            name='status',
+            field=models.CharField(choices=[('pending', 'pending'), ('applied', 'applied'), ('failed', 'failed')], default='pending', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='share',
+            name='error',
+            field=models.TextField(blank=True),
+        ),
+    ]
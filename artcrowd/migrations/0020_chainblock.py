@@ -0,0 +1,25 @@
+# Generated by Django 5.0a1 on 2026-10-18 15:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('artcrowd', '0019_share_status'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChainBlock',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('cursor', models.CharField(max_length=50)),
+                ('level', models.IntegerField()),
+                ('block_hash', models.CharField(max_length=51)),
+            ],
+            options={
+                'unique_together': {('cursor', 'level')},
+            },
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.0a1 on 2026-10-18 15:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('artcrowd', '0020_chainblock'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='pendingoperation',
+            name='artcrowd_pe_status_1d0b8c_idx',
+        ),
+        migrations.AddField(
+            model_name='pendingoperation',
+            name='seen_level',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='pendingoperation',
+            index=models.Index(fields=['status', 'seen_level'], name='artcrowd_pe_status_c49491_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0a1 on 2026-10-18 15:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('artcrowd', '0021_pendingoperation_seen_level'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='projectupdate',
+            name='updated_on',
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
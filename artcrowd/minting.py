@@ -0,0 +1,113 @@
+import logging
+from django.conf import settings
+from django.db import transaction
+from pytezos.rpc.node import RpcError
+from .models import MintingChunk, MintingJob, PendingOperation, Project
+from . import blockchain, tracker
+
+
+def create_job(project, meta_url):
+    """Record the minting of a completed project, call it in the transaction that completes the project"""
+    return MintingJob.objects.create(project=project, meta_url=meta_url)
+
+
+def _project(job):
+    project = job.project
+    project.status = Project.COMPLETED
+    return project
+
+
+def plan(job):
+    """Split the holdings in chunks once, so that a resumed job mints the same wallets. The first chunk creates
+    the token for a single wallet, the others mint the token id read from its receipt."""
+    token_id = blockchain.read_storage(settings.GALLERY_CONTRACT)['next_token_id']  # only sizes the calls
+    chunks = blockchain.plan_mint_chunks(_project(job), token_id, job.meta_url)
+    if chunks and len(chunks[0]) > 1:
+        chunks[:1] = [chunks[0][:1], chunks[0][1:]]
+    MintingChunk.objects.bulk_create([MintingChunk(job=job, index=index, holdings=holdings)
+                                      for index, holdings in enumerate(chunks)])
+
+
+def chunk_ops(chunk):
+    job = chunk.job
+    ops = blockchain.settle_project_ops(_project(job)) if chunk.index == 0 else []
+    return ops + [blockchain.mint_op(job.token_id, job.meta_url, chunk.holdings, chunk.index == 0)]
+
+
+def fail(job, error):
+    logging.warning(f'minting job {job.id}: {error}')
+    job.status = MintingJob.FAILED
+    job.error = str(error)
+    job.save(update_fields=['status', 'error', 'updated_on'])
+
+
+def resolve(chunk):
+    """Update a sent chunk from the confirmation tracker, return whether the job can go on"""
+    pending = PendingOperation.objects.filter(ophash=chunk.ophash).first()
+    if pending is None or pending.status == PendingOperation.PENDING:
+        return False
+    if pending.status == PendingOperation.APPLIED:
+        chunk.status, chunk.level, chunk.error = MintingChunk.APPLIED, pending.level, ''
+    else:  # not included, or included without effect: send it again
+        chunk.status, chunk.ophash, chunk.error = MintingChunk.PENDING, '', f'{pending.status} {pending.error}'.strip()
+    with transaction.atomic():
+        if chunk.status == MintingChunk.APPLIED and chunk.index == 0:
+            job = chunk.job
+            job.token_id = blockchain.get_minted_token_id(chunk.ophash, pending.block_hash)
+            job.save(update_fields=['token_id', 'updated_on'])
+        chunk.save()
+    if pending.status in (PendingOperation.FAILED, PendingOperation.BACKTRACKED, PendingOperation.SKIPPED):
+        fail(chunk.job, f'chunk {chunk.index} {chunk.error}')
+        return False
+    return True
+
+
+def send(chunk):
+    """Inject the chunk, the op hash is recorded and followed by the tracker before injection"""
+    opg = blockchain.sign(chunk_ops(chunk))
+    with transaction.atomic():
+        chunk.ophash, chunk.status, chunk.error = opg.hash(), MintingChunk.SENT, ''
+        chunk.save()
+        tracker.register(chunk.ophash, PendingOperation.MINTING)
+    try:
+        blockchain.inject(opg)
+    except RpcError as ex:  # rejected by the node, nothing was injected
+        PendingOperation.objects.filter(ophash=chunk.ophash).update(status=PendingOperation.FAILED, error=str(ex))
+        chunk.status, chunk.ophash, chunk.error = MintingChunk.PENDING, '', str(ex)
+        chunk.save()
+        raise
+
+
+def run(job):
+    """Advance the job as far as possible: chunks are sent in order, each once the previous one is applied
+    (one group per source is accepted per block). Applied chunks are never sent again."""
+    if job.status not in (MintingJob.PENDING, MintingJob.RUNNING):
+        return job.status
+    try:
+        if not job.chunks.exists():
+            plan(job)
+        MintingJob.objects.filter(id=job.id, status=MintingJob.PENDING).update(status=MintingJob.RUNNING)
+        for chunk in job.chunks.exclude(status=MintingChunk.APPLIED):
+            job.refresh_from_db(fields=['status'])
+            if job.status != MintingJob.RUNNING:  # paused meanwhile
+                return job.status
+            if chunk.status == MintingChunk.SENT and not resolve(chunk):
+                break
+            if chunk.status == MintingChunk.PENDING:
+                send(chunk)
+                break
+        else:
+            MintingJob.objects.filter(id=job.id).update(status=MintingJob.DONE, error='')
+    except Exception as ex:
+        fail(job, ex)
+    job.refresh_from_db(fields=['status'])
+    return job.status
+
+
+def pause(jobs):
+    return jobs.filter(status__in=(MintingJob.PENDING, MintingJob.RUNNING)).update(status=MintingJob.PAUSED)
+
+
+def resume(jobs):
+    """Continue paused or failed jobs from the first chunk that is not applied"""
+    return jobs.filter(status__in=(MintingJob.PAUSED, MintingJob.FAILED)).update(status=MintingJob.PENDING, error='')
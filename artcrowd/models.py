@@ -1,6 +1,12 @@
+import math
 from django.contrib.auth.models import AbstractUser, Group
 from django.utils.functional import cached_property
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Count, F, Max, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
 from sorl.thumbnail import ImageField
 from ckeditor.fields import RichTextField
 from . import settings
@@ -11,6 +17,7 @@ class User(AbstractUser):
     avatar = models.ImageField(upload_to='avatars/', null=True, blank=True)
     cover_picture = models.ImageField(upload_to='cover_pictures/', null=True, blank=True)
     description = RichTextField(blank=True)
+    updated_on = models.DateTimeField(auto_now=True)
 
     @classmethod
     def get_or_create_from_wallet(cls, tzwallet):
@@ -40,6 +47,7 @@ class Project(models.Model):
     artist = models.ForeignKey(settings.AUTH_USER_MODEL, models.SET_NULL, null=True, related_name='artist')
     presenter = models.ForeignKey(settings.AUTH_USER_MODEL, models.SET_NULL, null=True, blank=True, related_name='presenter')
     created_on = models.DateTimeField(auto_now_add=True)
+    updated_on = models.DateTimeField(auto_now=True)
     deadline = models.DateTimeField()
     status = models.CharField(max_length=50, default=NEW, choices=(
         (NEW, NEW), (APPROVED_BY_ARTIST, APPROVED_BY_ARTIST),
@@ -53,13 +61,37 @@ class Project(models.Model):
     max_shares = models.IntegerField(null=True, blank=True)
     royalty_pct = models.IntegerField(blank=True, default=0)
     nft_description = models.TextField()
+    # totals of the shares, maintained by the Share signals and rebuilt by rebuild_share_totals
+    shares_num = models.IntegerField(default=0, editable=False)
+    shares_sum = models.IntegerField(default=0, editable=False)
+    patrons_count = models.IntegerField(default=0, editable=False)
+    last_share_at = models.DateTimeField(null=True, blank=True, editable=False)
+    TOTALS = ('shares_num', 'shares_sum', 'patrons_count', 'last_share_at')
+
+    class Meta:
+        indexes = [models.Index(fields=['created_on', 'id']), models.Index(fields=['deadline', 'id']),
+                   models.Index(fields=['shares_num', 'id'])]
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.old_status = self.status
+        self.old_people = self.loaded_people()
+
+    def loaded_people(self):
+        """Artist and presenter ids as loaded, deferred ones are left out"""
+        return {name: self.__dict__[name] for name in ('artist_id', 'presenter_id') if name in self.__dict__}
+
+    def save(self, *args, **kwargs):
+        # the totals are only written by F() updates, a loaded project must not overwrite them with stale values
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [field.name for field in self._meta.concrete_fields
+                                       if not field.primary_key and field.name not in self.TOTALS]
+        super().save(*args, **kwargs)
 
     @cached_property
     def last_update(self):
+        if hasattr(self, 'latest_updates'):  # prefetched with the project list
+            return self.latest_updates[0] if self.latest_updates else None
         try:
             return self.project_updates.latest('created_on')
         except ProjectUpdate.DoesNotExist:
@@ -75,16 +107,24 @@ class Project(models.Model):
 
     @cached_property
     def shares(self):
-        return list(self.project_shares.all().order_by('-purchased_on'))
+        return list(self.project_shares.exclude(status=Share.FAILED).order_by('-purchased_on'))
+
+    @cached_property
+    def recent_updates(self):
+        return list(self.project_updates.order_by('-created_on', '-id')[:settings.PROJECT_DETAIL_EMBEDDED])
 
     @cached_property
-    def shares_num(self):
-        total_quantity = self.project_shares.aggregate(total_quantity=models.Sum('quantity'))['total_quantity']
-        return total_quantity or 0  #self.project_shares.count()
+    def recent_shares(self):
+        return list(self.project_shares.exclude(status=Share.FAILED).select_related('patron').order_by(
+            '-purchased_on', '-id')[:settings.PROJECT_DETAIL_EMBEDDED])
 
     @cached_property
-    def shares_sum(self):
-        return self.shares_num * self.share_price
+    def updates_count(self):
+        return self.project_updates.count()
+
+    @cached_property
+    def shares_count(self):
+        return self.project_shares.exclude(status=Share.FAILED).count()
 
 
 class ProjectStatus(models.Model):
@@ -100,11 +140,333 @@ class ProjectUpdate(models.Model):
     description = models.TextField(null=True, blank=True)
     image = models.ImageField(null=True, blank=True)
     created_on = models.DateTimeField(auto_now_add=True)
+    updated_on = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['project', 'created_on', 'id'])]
 
 
 class Share(models.Model):
+    PENDING = 'pending'
+    APPLIED = 'applied'
+    FAILED = 'failed'
     project = models.ForeignKey(Project, on_delete=models.CASCADE, related_name="project_shares")
     patron = models.ForeignKey(settings.AUTH_USER_MODEL, models.SET_NULL, null=True)
     quantity = models.IntegerField()
     purchased_on = models.DateTimeField(auto_now_add=True)
     ophash = models.CharField(max_length=51)
+    # of the buy_shares call sent by the outbox, failed shares are left out of every total
+    status = models.CharField(max_length=20, default=PENDING, choices=(
+        (PENDING, PENDING), (APPLIED, APPLIED), (FAILED, FAILED)
+    ))
+    error = models.TextField(blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['project', 'purchased_on', 'id'])]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        share = super().from_db(db, field_names, values)
+        # project and patron as stored, when the share moves the totals of both sides are recomputed
+        share.saved_owners = (share.__dict__.get('project_id'), share.__dict__.get('patron_id'))
+        return share
+
+
+def rebuild_share_totals(projects=None):
+    """Recompute the stored totals of the projects from their shares"""
+    shares = Share.objects.filter(project=OuterRef('pk')).exclude(status=Share.FAILED).order_by().values('project')
+    shares_num = Coalesce(Subquery(shares.annotate(total=Sum('quantity')).values('total')), 0)
+    return (Project.objects.all() if projects is None else projects).update(
+        shares_num=shares_num, shares_sum=shares_num * F('share_price'),
+        patrons_count=Coalesce(Subquery(shares.annotate(count=Count('patron', distinct=True)).values('count')), 0),
+        last_share_at=Subquery(shares.annotate(latest=Max('purchased_on')).values('latest')))
+
+
+@receiver(post_save, sender=Share)
+def share_saved(sender, instance, created, **kwargs):
+    previous_project_id, previous_patron_id = getattr(instance, 'saved_owners', (None, None))
+    instance.saved_owners = (instance.project_id, instance.patron_id)
+    projects = Project.objects.filter(pk=instance.project_id)
+    if not created:  # quantity, project or status changed, recompute from scratch, with the previous owners
+        rebuild_share_totals(Project.objects.filter(pk__in={instance.project_id, previous_project_id} - {None}))
+        rebuild_user_stats(User.objects.filter(pk__in={instance.patron_id, previous_patron_id} - {None}))
+        return
+    with transaction.atomic():
+        projects.select_for_update().first()  # purchases of one project are counted one at a time
+        first_purchase = instance.patron_id is not None and not Share.objects.filter(
+            project_id=instance.project_id, patron_id=instance.patron_id).exclude(
+            pk=instance.pk).exclude(status=Share.FAILED).exists()
+        projects.update(shares_num=F('shares_num') + instance.quantity,
+                        shares_sum=F('shares_sum') + instance.quantity * F('share_price'),
+                        patrons_count=F('patrons_count') + int(first_purchase), last_share_at=instance.purchased_on)
+        update_user_stats(instance.patron_id, supported_projects_num=int(first_purchase), shares_num=instance.quantity)
+
+
+@receiver(post_delete, sender=Share)
+def share_deleted(sender, instance, **kwargs):
+    if instance.status == Share.FAILED:  # already left out of the totals
+        return
+    projects = Project.objects.filter(pk=instance.project_id)
+    with transaction.atomic():
+        projects.select_for_update().first()
+        shares = Share.objects.exclude(status=Share.FAILED)
+        last_purchase = instance.patron_id is not None and not shares.filter(
+            project_id=instance.project_id, patron_id=instance.patron_id).exists()
+        latest = shares.filter(project_id=instance.project_id).order_by('-purchased_on', '-id').values(
+            'purchased_on')[:1]
+        projects.update(shares_num=F('shares_num') - instance.quantity,
+                        shares_sum=F('shares_sum') - instance.quantity * F('share_price'),
+                        patrons_count=F('patrons_count') - int(last_purchase), last_share_at=Subquery(latest))
+        update_user_stats(instance.patron_id, supported_projects_num=-int(last_purchase), shares_num=-instance.quantity)
+
+
+class UserStats(models.Model):
+    """Counts shown on profiles and leaderboards, maintained by the Project and Share signals"""
+    user = models.OneToOneField(User, models.CASCADE, primary_key=True, related_name='stats')
+    created_projects_num = models.IntegerField(default=0)
+    presented_projects_num = models.IntegerField(default=0)
+    supported_projects_num = models.IntegerField(default=0)
+    shares_num = models.IntegerField(default=0)
+    updated_on = models.DateTimeField(auto_now=True)
+    COUNTS = ('created_projects_num', 'presented_projects_num', 'supported_projects_num', 'shares_num')
+
+    class Meta:
+        indexes = [models.Index(fields=['created_projects_num']), models.Index(fields=['supported_projects_num'])]
+
+
+def update_user_stats(user_id, **deltas):
+    if user_id is None:
+        return
+    UserStats.objects.get_or_create(user_id=user_id)
+    UserStats.objects.filter(user_id=user_id).update(
+        updated_on=timezone.now(), **{field: F(field) + delta for field, delta in deltas.items()})
+
+
+def rebuild_user_stats(users=None):
+    """Recompute the statistics of the users from their projects and shares"""
+    users = User.objects.all() if users is None else users
+    stats = {user_id: UserStats(user_id=user_id) for user_id in users.values_list('id', flat=True)}
+    for field, queryset, key, total in (
+            ('created_projects_num', Project.objects, 'artist', Count('id')),
+            ('presented_projects_num', Project.objects, 'presenter', Count('id')),
+            ('supported_projects_num', Share.objects.exclude(status=Share.FAILED), 'patron',
+             Count('project', distinct=True)),
+            ('shares_num', Share.objects.exclude(status=Share.FAILED), 'patron', Sum('quantity'))):
+        rows = queryset.filter(**{f'{key}__in': users}).order_by().values(key).annotate(total=total)
+        for row in rows:
+            setattr(stats[row[key]], field, row['total'])
+    UserStats.objects.bulk_create(stats.values(), batch_size=1000, update_conflicts=True, unique_fields=['user'],
+                                  update_fields=[*UserStats.COUNTS, 'updated_on'])
+    return len(stats)
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, created, **kwargs):
+    if created:
+        UserStats.objects.get_or_create(user=instance)
+
+
+@receiver(post_save, sender=Project)
+def project_saved(sender, instance, created, **kwargs):
+    for field, name in (('created_projects_num', 'artist_id'), ('presented_projects_num', 'presenter_id')):
+        if created:
+            update_user_stats(getattr(instance, name), **{field: 1})
+        elif name in instance.old_people and instance.old_people[name] != getattr(instance, name):
+            update_user_stats(instance.old_people[name], **{field: -1})
+            update_user_stats(getattr(instance, name), **{field: 1})
+    instance.old_people = instance.loaded_people()
+
+
+@receiver(post_delete, sender=Project)
+def project_deleted(sender, instance, **kwargs):
+    update_user_stats(instance.artist_id, created_projects_num=-1)
+    update_user_stats(instance.presenter_id, presented_projects_num=-1)
+
+
+class ChainCursor(models.Model):
+    """Last block processed by the chain indexer"""
+    name = models.CharField(max_length=50, unique=True)
+    level = models.IntegerField()
+    block_hash = models.CharField(max_length=51)
+    updated_on = models.DateTimeField(auto_now=True)
+
+
+class ChainBlock(models.Model):
+    """Recently processed block of a cursor, to find the common ancestor after a reorganisation"""
+    cursor = models.CharField(max_length=50)
+    level = models.IntegerField()
+    block_hash = models.CharField(max_length=51)
+
+    class Meta:
+        unique_together = [('cursor', 'level')]
+
+
+class ChainLedger(models.Model):
+    """Mirror of the `ledger` big map of the projects contract"""
+    wallet = models.CharField(max_length=36, unique=True)
+    amount = models.BigIntegerField()  # in mutez
+    level = models.IntegerField()
+
+
+class ChainProject(models.Model):
+    """Mirror of the `projects` big map of the projects contract"""
+    project_id = models.BigIntegerField(unique=True)
+    status = models.CharField(max_length=50)
+    share_price = models.BigIntegerField()  # in mutez
+    total_shares = models.IntegerField()
+    level = models.IntegerField()
+
+
+class ChainShares(models.Model):
+    """Mirror of the `shares` big map of the projects contract"""
+    project_id = models.BigIntegerField()
+    wallet = models.CharField(max_length=36)
+    shares = models.IntegerField()
+    level = models.IntegerField()
+
+    class Meta:
+        unique_together = [('project_id', 'wallet')]
+
+
+class ChainToken(models.Model):
+    """Tokens minted by the gallery contract"""
+    token_id = models.BigIntegerField(unique=True)
+    level = models.IntegerField()
+    ophash = models.CharField(max_length=51)
+
+
+class OutboxOperation(models.Model):
+    """Blockchain side effect recorded in the same transaction as the model change that caused it,
+    sent later by the outbox dispatcher"""
+    CREATE_PROJECT = 'create_project'
+    UPDATE_PROJECT_STATUS = 'update_project_status'
+    BUY_SHARES = 'buy_shares'
+    REFUND = 'refund'
+    REFUND_ALL = 'refund_all'
+    GENERATE_TOKEN = 'generate_token'
+    GENERATE_TOKENS = 'generate_tokens'
+    PENDING = 'pending'
+    SENDING = 'sending'
+    SENT = 'sent'
+    FAILED = 'failed'
+    kind = models.CharField(max_length=50, choices=(
+        (CREATE_PROJECT, CREATE_PROJECT), (UPDATE_PROJECT_STATUS, UPDATE_PROJECT_STATUS), (BUY_SHARES, BUY_SHARES),
+        (REFUND, REFUND), (REFUND_ALL, REFUND_ALL), (GENERATE_TOKEN, GENERATE_TOKEN), (GENERATE_TOKENS, GENERATE_TOKENS)
+    ))
+    project = models.ForeignKey(Project, models.SET_NULL, null=True, blank=True, related_name='outbox_operations')
+    payload = models.JSONField(default=dict)
+    status = models.CharField(max_length=20, default=PENDING, choices=(
+        (PENDING, PENDING), (SENDING, SENDING), (SENT, SENT), (FAILED, FAILED)
+    ))
+    attempts = models.IntegerField(default=0)
+    next_attempt_on = models.DateTimeField(auto_now_add=True)
+    ophash = models.CharField(max_length=51, blank=True)
+    error = models.TextField(blank=True)
+    created_on = models.DateTimeField(auto_now_add=True)
+    sent_on = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'next_attempt_on'])]
+
+
+class PendingOperation(models.Model):
+    """Operation group waiting to be included in a block, followed by the confirmation tracker"""
+    OUTBOX = 'outbox'
+    SHARE = 'share'
+    MINTING = 'minting'
+    PENDING = 'pending'
+    APPLIED = 'applied'
+    FAILED = 'failed'
+    BACKTRACKED = 'backtracked'
+    SKIPPED = 'skipped'
+    EXPIRED = 'expired'
+    ophash = models.CharField(max_length=51, unique=True)
+    kind = models.CharField(max_length=20, choices=((OUTBOX, OUTBOX), (SHARE, SHARE), (MINTING, MINTING)))
+    status = models.CharField(max_length=20, default=PENDING, choices=(
+        (PENDING, PENDING), (APPLIED, APPLIED), (FAILED, FAILED), (BACKTRACKED, BACKTRACKED),
+        (SKIPPED, SKIPPED), (EXPIRED, EXPIRED)
+    ))
+    level = models.IntegerField(null=True, blank=True)
+    block_hash = models.CharField(max_length=51, blank=True)
+    # head level when the tracker first saw the operation, the branch of the group is not above it
+    seen_level = models.IntegerField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    created_on = models.DateTimeField(auto_now_add=True)
+    updated_on = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'seen_level'])]
+
+
+class AccountCounter(models.Model):
+    """Last counter handed out for a signing account, shared by all worker processes"""
+    source = models.CharField(max_length=36, unique=True)
+    counter = models.BigIntegerField(null=True)  # unknown, read from the node on next reservation
+    updated_on = models.DateTimeField(auto_now=True)
+
+
+class GasProfile(models.Model):
+    """Gas and storage used by a contract entrypoint, measured by the calibrate_gas command.
+    Batch entrypoints grow linearly with the number of items of their list parameter."""
+    contract = models.CharField(max_length=36)
+    entrypoint = models.CharField(max_length=100)
+    gas_base = models.PositiveIntegerField()
+    gas_per_item = models.PositiveIntegerField(default=0)
+    storage_base = models.PositiveIntegerField()
+    storage_per_item = models.PositiveIntegerField(default=0)
+    stale = models.BooleanField(default=False)  # an injection ran out of gas or storage, calibrate again
+    updated_on = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('contract', 'entrypoint')
+
+    def limits(self, size, margin):
+        gas = (self.gas_base + self.gas_per_item * size) * (1 + margin)
+        storage = (self.storage_base + self.storage_per_item * size) * (1 + margin)
+        return math.ceil(gas), math.ceil(storage)
+
+
+class MintingJob(models.Model):
+    """Token minting of a completed project, sent chunk by chunk by the run_minting_jobs command"""
+    PENDING = 'pending'
+    RUNNING = 'running'
+    PAUSED = 'paused'
+    DONE = 'done'
+    FAILED = 'failed'
+    project = models.ForeignKey(Project, on_delete=models.CASCADE, related_name='minting_jobs')
+    meta_url = models.CharField(max_length=255)
+    token_id = models.PositiveIntegerField(null=True, blank=True)  # known once the first chunk is applied
+    status = models.CharField(max_length=20, default=PENDING, db_index=True, choices=(
+        (PENDING, PENDING), (RUNNING, RUNNING), (PAUSED, PAUSED), (DONE, DONE), (FAILED, FAILED)
+    ))
+    error = models.TextField(blank=True)
+    created_on = models.DateTimeField(auto_now_add=True)
+    updated_on = models.DateTimeField(auto_now=True)
+
+
+class MintingChunk(models.Model):
+    """Wallets minted by one operation group of a minting job"""
+    PENDING = 'pending'
+    SENT = 'sent'
+    APPLIED = 'applied'
+    job = models.ForeignKey(MintingJob, on_delete=models.CASCADE, related_name='chunks')
+    index = models.PositiveIntegerField()
+    holdings = models.JSONField()  # [[wallet, amount], ...]
+    status = models.CharField(max_length=20, default=PENDING, choices=(
+        (PENDING, PENDING), (SENT, SENT), (APPLIED, APPLIED)
+    ))
+    ophash = models.CharField(max_length=51, blank=True)
+    level = models.IntegerField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    updated_on = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('job', 'index')
+        ordering = ['index']
+
+
+class WalletPublicKey(models.Model):
+    """Revealed public key of a wallet, used to check login signatures without asking the node"""
+    wallet = models.CharField(max_length=36, unique=True)
+    public_key = models.CharField(max_length=100)
+    created_on = models.DateTimeField(auto_now_add=True)
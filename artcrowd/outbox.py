@@ -0,0 +1,166 @@
+import logging
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from django.utils import timezone
+from .models import OutboxOperation, PendingOperation, Project, Share, User
+from . import blockchain, tracker
+
+
+def enqueue(kind, project=None, **payload):
+    """Record a blockchain side effect. Call it inside the transaction that saves the model change,
+    so that either both are stored or none is."""
+    return OutboxOperation.objects.create(kind=kind, project=project, payload=payload)
+
+
+def _project(operation):
+    # the status the project had when the operation was recorded, not the current one
+    project = Project.objects.get(id=operation.project_id)
+    project.status = operation.payload.get('status', project.status)
+    return project
+
+
+def build_ops(operation):
+    payload = operation.payload
+    if operation.kind == OutboxOperation.CREATE_PROJECT:
+        return blockchain.create_project_ops(_project(operation))
+    if operation.kind == OutboxOperation.UPDATE_PROJECT_STATUS:
+        return blockchain.update_project_status_ops(_project(operation))
+    if operation.kind == OutboxOperation.BUY_SHARES:
+        return blockchain.buy_shares_ops(_project(operation), payload['wallet'], payload['num_shares'])
+    if operation.kind == OutboxOperation.REFUND:
+        return blockchain.refund_ops(payload['wallet'])
+    if operation.kind == OutboxOperation.REFUND_ALL:
+        return blockchain.refund_all_ops(_project(operation), payload['wallets'])
+    if operation.kind == OutboxOperation.GENERATE_TOKEN:
+        patron = User.objects.get(id=payload['patron_id'])
+        return blockchain.generate_token_ops(_project(operation), payload['meta_url'], patron)
+    if operation.kind == OutboxOperation.GENERATE_TOKENS:
+        return blockchain.generate_tokens_ops(_project(operation), payload['meta_url'])
+    raise ValueError(f'unknown outbox operation {operation.kind}')
+
+
+def claim(limit):
+    """Lock due operations for this dispatcher, other dispatchers skip them"""
+    with transaction.atomic():
+        operations = list(OutboxOperation.objects.select_for_update(skip_locked=True).filter(
+            status=OutboxOperation.PENDING, next_attempt_on__lte=timezone.now()).order_by('id')[:limit])
+        OutboxOperation.objects.filter(id__in=[op.id for op in operations]).update(
+            status=OutboxOperation.SENDING, sent_on=timezone.now())
+    return operations
+
+
+def cancel_purchase(operation):
+    """Take back the shares of a buy_shares call that will never be applied. The share is kept as failed,
+    out of the totals, and a sale closed by it is opened again."""
+    share = Share.objects.filter(id=operation.payload.get('share_id')).exclude(status=Share.FAILED).first()
+    if share is None:
+        return
+    with transaction.atomic():
+        share.status, share.error = Share.FAILED, operation.error
+        share.save(update_fields=['status', 'error'])
+        project = Project.objects.select_for_update().get(id=share.project_id)
+        if project.status == Project.SALE_CLOSED and project.max_shares and project.shares_num < project.max_shares:
+            project.status = Project.OPEN
+            project.save()
+            enqueue(OutboxOperation.UPDATE_PROJECT_STATUS, project, status=project.status)
+
+
+def fail(operation_ids, error):
+    OutboxOperation.objects.filter(id__in=operation_ids).update(status=OutboxOperation.FAILED, error=error)
+    for operation in OutboxOperation.objects.filter(id__in=operation_ids, kind=OutboxOperation.BUY_SHARES):
+        cancel_purchase(operation)
+
+
+def retry_later(operation, error):
+    operation.attempts += 1
+    operation.error = str(error)
+    if operation.attempts >= settings.OUTBOX_MAX_ATTEMPTS:
+        operation.status = OutboxOperation.FAILED
+    else:
+        operation.status = OutboxOperation.PENDING
+        delay = min(settings.OUTBOX_BACKOFF * 2 ** (operation.attempts - 1), settings.OUTBOX_MAX_BACKOFF)
+        operation.next_attempt_on = timezone.now() + timedelta(seconds=delay)
+    operation.save(update_fields=['attempts', 'error', 'status', 'next_attempt_on'])
+    if operation.status == OutboxOperation.FAILED and operation.kind == OutboxOperation.BUY_SHARES:
+        cancel_purchase(operation)
+
+
+def send(operations):
+    """Send the operations in as few operation groups as the protocol limits allow, return whether they were
+    injected. Groups go one block after another and every operation keeps the hash of the last group carrying
+    its calls. When a later group fails, its operations are failed, as calls before them are already on chain,
+    and the operations of the groups after it are queued again."""
+    ids = [op.id for op in operations]
+    try:
+        calls = [(operation.id, op) for operation in operations for op in build_ops(operation)]
+        groups = blockchain.plan_groups([op for operation_id, op in calls])
+    except Exception as ex:
+        logging.warning(ex)
+        if len(operations) == 1:
+            retry_later(operations[0], ex)
+        return False
+    members, position = [], 0  # ids of the operations with calls in every group
+    for ops in groups:
+        members.append({operation_id for operation_id, op in calls[position:position + len(ops)]})
+        position += len(ops)
+    for index, ops in enumerate(groups):
+        try:
+            opg = blockchain.sign(ops)
+            # the hash is stored before injection, an interrupted dispatcher leaves a trace to check on chain
+            ophash = opg.hash()
+            OutboxOperation.objects.filter(id__in=members[index]).update(ophash=ophash)
+            blockchain.inject(opg, confirmations=0 if index == len(groups) - 1 else 1)
+        except Exception as ex:
+            logging.warning(ex)
+            if index:
+                fail(members[index], f'group {index + 1} of {len(groups)} failed, check ophash: {ex}')
+                OutboxOperation.objects.filter(id__in=ids, status=OutboxOperation.SENDING).update(
+                    status=OutboxOperation.PENDING, ophash='')
+                return True
+            if len(operations) == 1:
+                retry_later(operations[0], ex)
+            return False
+        tracker.register(ophash, PendingOperation.OUTBOX)
+        OutboxOperation.objects.filter(id__in=members[index].difference(*members[index + 1:])).update(
+            status=OutboxOperation.SENT, error='', sent_on=timezone.now())
+    OutboxOperation.objects.filter(id__in=ids, status=OutboxOperation.SENDING).update(
+        status=OutboxOperation.SENT, error='', sent_on=timezone.now())
+    return True
+
+
+def dispatch(batch_size=None):
+    """Send due operations grouped into one operation group, return the number of operations processed.
+    If the group is rejected, its operations are sent one by one so that a single bad operation
+    does not hold back the others."""
+    operations = claim(batch_size or settings.OUTBOX_BATCH_SIZE)
+    if operations and not send(operations) and len(operations) > 1:
+        for operation in operations:
+            send([operation])
+    return len(operations)
+
+
+@receiver(post_save, sender=PendingOperation)
+def operation_included(sender, instance, **kwargs):
+    """Outcome of a sent group as seen by the tracker, purchases which failed on chain are taken back"""
+    if instance.kind != PendingOperation.OUTBOX or instance.status == PendingOperation.PENDING:
+        return
+    operations = OutboxOperation.objects.filter(ophash=instance.ophash, status=OutboxOperation.SENT)
+    if instance.status == PendingOperation.APPLIED:
+        share_ids = [operation.payload.get('share_id') for operation in operations.filter(
+            kind=OutboxOperation.BUY_SHARES)]
+        Share.objects.filter(id__in=share_ids, status=Share.PENDING).update(status=Share.APPLIED)
+    else:
+        fail(list(operations.values_list('id', flat=True)), f'{instance.status} on chain: {instance.error}')
+
+
+def recover_interrupted():
+    """Operations left in `sending` by a dispatcher that died. Without an op hash nothing was injected and
+    they are retried, otherwise they may be on chain and are marked as failed for a manual check."""
+    stuck = OutboxOperation.objects.filter(
+        status=OutboxOperation.SENDING,
+        sent_on__lt=timezone.now() - timedelta(seconds=settings.OUTBOX_SENDING_TIMEOUT))
+    stuck.filter(ophash='').update(status=OutboxOperation.PENDING)
+    stuck.exclude(ophash='').update(status=OutboxOperation.FAILED, error='dispatcher interrupted, check ophash')
@@ -0,0 +1,135 @@
+import gzip
+import hashlib
+import time
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Q
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+from .models import Project, ProjectUpdate, Share, User
+
+LIST_VERSION_KEY = 'api:projects:version'
+
+
+def project_version_key(project_id):
+    return f'api:project:{project_id}:version'
+
+
+def get_version(key):
+    """Versions are timestamps, so a version lost from the cache never comes back with responses cached under it"""
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, time.time_ns(), None)
+        version = cache.get(key)
+    return version
+
+
+def bump(*keys):
+    """New versions once the transaction commits, a response read before that is not cached under them"""
+    transaction.on_commit(lambda: cache.set_many({key: time.time_ns() for key in keys}, None))
+
+
+def accepts_gzip(accept_encoding):
+    """Whether gzip is an acceptable content coding, `gzip;q=0` refuses it"""
+    qualities = {}
+    for coding in accept_encoding.split(','):
+        name, *params = [part.strip() for part in coding.split(';')]
+        quality = 1.0
+        for param in params:
+            if param.startswith('q='):
+                try:
+                    quality = float(param[2:])
+                except ValueError:
+                    quality = 0.0
+        qualities[name.lower()] = quality
+    return qualities.get('gzip', qualities.get('*', 0.0)) > 0
+
+
+@receiver([post_save, post_delete], sender=Project)
+def project_changed(sender, instance, **kwargs):
+    bump(LIST_VERSION_KEY, project_version_key(instance.pk))
+
+
+@receiver([post_save, post_delete], sender=Share)
+@receiver([post_save, post_delete], sender=ProjectUpdate)
+def project_item_changed(sender, instance, **kwargs):
+    bump(LIST_VERSION_KEY, project_version_key(instance.project_id))
+
+
+@receiver(post_save, sender=User)
+def user_changed(sender, instance, created, update_fields=None, **kwargs):
+    """Projects embed the username and the avatar of their artist, presenter and latest patrons"""
+    if created or not (update_fields is None or {'username', 'avatar'} & set(update_fields)):
+        return
+    project_ids = Project.objects.filter(
+        Q(artist=instance) | Q(presenter=instance) | Q(project_shares__patron=instance)).values_list(
+        'id', flat=True).distinct()
+    bump(LIST_VERSION_KEY, *(project_version_key(project_id) for project_id in project_ids))
+
+
+def cached_response(request, entry):
+    body, content_type, headers = entry
+    not_modified = get_conditional_response(request, etag=headers.get('ETag'))
+    if not_modified is not None:
+        for header, value in headers.items():
+            not_modified[header] = value
+        return not_modified
+    response = HttpResponse(content_type=content_type, headers=headers)
+    if accepts_gzip(request.headers.get('Accept-Encoding', '')):
+        response.content = body
+        response['Content-Encoding'] = 'gzip'
+    else:
+        response.content = gzip.decompress(body)
+    patch_vary_headers(response, ['Accept-Encoding'])
+    return response
+
+
+class CachedGetMixin:
+    """Serves GET from a cache of gzipped JSON bodies, without touching the database or the serializers.
+    The key holds the URL and the version of the data, `get_cache_version` returns None when not cacheable."""
+
+    def get_cache_version(self, request):
+        return get_version(LIST_VERSION_KEY)
+
+    def get(self, request, *args, **kwargs):
+        version = self.get_cache_version(request) if request.accepted_renderer.format == 'json' else None
+        if version is None:
+            return super().get(request, *args, **kwargs)
+        url_hash = hashlib.sha256(request.build_absolute_uri().encode()).hexdigest()
+        key = f'api:response:{url_hash}:{version}'
+        entry = cache.get(key)
+        if entry is None:
+            response = super().get(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+            response.accepted_renderer = request.accepted_renderer
+            response.accepted_media_type = request.accepted_media_type
+            response.renderer_context = self.get_renderer_context()
+            response.render()
+            entry = (gzip.compress(response.content), response['Content-Type'],
+                     {header: response[header] for header in ('ETag', 'Last-Modified') if header in response})
+            cache.set(key, entry, settings.API_CACHE_TTL)
+        return cached_response(request, entry)
+
+
+class ConditionalGetMixin:
+    """Answers 304 Not Modified before any serializer work when the validators sent by the client still match.
+    `get_validators` reads (etag parts, last modified time) with one query, None when the object does not exist."""
+
+    def get(self, request, *args, **kwargs):
+        validators = self.get_validators(request)
+        if validators is None:
+            return super().get(request, *args, **kwargs)
+        parts, last_modified = validators
+        etag = quote_etag(hashlib.sha256(repr(parts).encode()).hexdigest()[:32])
+        last_modified = int(last_modified.timestamp())
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = super().get(request, *args, **kwargs)
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+        return response
@@ -0,0 +1,168 @@
+import random
+import logging
+import re
+import threading
+import time
+import weakref
+import requests
+from requests.adapters import HTTPAdapter
+from pytezos.context.mixin import nodes as known_networks
+from pytezos.rpc.node import RpcNode, RpcError, RpcForbiddenError, RpcNotFoundError, _urljoin
+from pytezos.rpc.shell import ShellQuery
+from django.conf import settings
+from . import simulator
+
+HEAD_PATH = 'chains/main/blocks/head/header'
+PINNED_PATH = re.compile(r'chains/main/blocks/(B[1-9A-HJ-NP-Za-km-z]{50})/')
+
+
+class NodeState:
+    """Keep-alive session, measured latency, head level and circuit breaker of one RPC node"""
+
+    def __init__(self, uri, pool_size):
+        self.uri = uri
+        self.session = requests.Session()
+        self.session.mount(uri, HTTPAdapter(pool_connections=1, pool_maxsize=pool_size))
+        self.latency = None  # seconds, moving average
+        self.level = None
+        self.failures = 0
+        self.open_until = 0.0
+        self.lock = threading.Lock()
+
+    def is_open(self):
+        return time.monotonic() < self.open_until
+
+    def succeeded(self, elapsed):
+        with self.lock:
+            self.latency = elapsed if self.latency is None else 0.8 * self.latency + 0.2 * elapsed
+            self.failures = 0
+            self.open_until = 0.0
+
+    def failed(self, failure_threshold, cooldown):
+        with self.lock:
+            self.failures += 1
+            if self.failures >= failure_threshold:
+                logging.warning(f'RPC node {self.uri} is failing, not used for {cooldown}s')
+                self.open_until = time.monotonic() + cooldown
+
+
+class PooledRpcNode(RpcNode):
+    """RPC transport over several nodes with pooled keep-alive sessions. Each request goes to the faster of two
+    random healthy nodes and fails over to the others by latency. Erroring or slow nodes are left out for
+    `cooldown` seconds after `failure_threshold` failures in a row, nodes whose head lags behind the others
+    by more than `max_head_lag` blocks are only used when no other node answers, their heads are checked
+    by a background thread every `head_check_interval` seconds. A read pinned to a block that the node
+    does not know yet goes to the next node."""
+
+    def __init__(self, uris, timeout=10, pool_size=10, failure_threshold=3, cooldown=30, slow=5,
+                 max_head_lag=2, head_check_interval=10):
+        super().__init__(uris)
+        self.nodes = [NodeState(uri, pool_size) for uri in self.uri]
+        self.timeout = timeout
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.slow = slow
+        self.max_head_lag = max_head_lag
+        self.head_check_interval = head_check_interval
+        if head_check_interval and len(self.nodes) > 1:
+            threading.Thread(target=check_heads_forever, args=(weakref.ref(self), head_check_interval),
+                             daemon=True, name='rpc-head-check').start()
+
+    def check_heads(self):
+        """Measure latency and head level of every node"""
+        for node in self.nodes:
+            try:
+                node.level = self._send(node, 'GET', HEAD_PATH, timeout=self.timeout).json()['level']
+            except Exception as ex:
+                logging.warning(f'RPC node {node.uri}: {ex}')
+                node.level = None
+
+    def knows_block(self, node, block_hash):
+        try:
+            return self._send(node, 'GET', f'chains/main/blocks/{block_hash}/hash', timeout=self.timeout).ok
+        except requests.RequestException:
+            return False
+
+    def candidates(self):
+        """Nodes in the order they are tried"""
+        levels = [node.level for node in self.nodes if node.level is not None]
+        top_level = max(levels) if levels else None
+        fresh = lambda node: top_level is None or node.level is not None and top_level - node.level <= self.max_head_lag
+        latency = lambda node: node.latency if node.latency is not None else 0.0  # unmeasured nodes get a chance
+        healthy = sorted([node for node in self.nodes if not node.is_open() and fresh(node)], key=latency)
+        others = sorted([node for node in self.nodes if node not in healthy], key=lambda node: node.open_until)
+        if len(healthy) > 1:
+            first = min(random.sample(healthy, 2), key=latency)
+            healthy.remove(first)
+            healthy.insert(0, first)
+        return healthy + others
+
+    def _send(self, node, method, path, **kwargs):
+        started = time.monotonic()
+        try:
+            res = node.session.request(
+                method=method,
+                url=_urljoin(node.uri, path),
+                headers={'content-type': 'application/json', 'user-agent': 'PyTezos', **self.headers},
+                **kwargs,
+            )
+        except requests.RequestException:
+            node.failed(self.failure_threshold, self.cooldown)
+            raise
+        elapsed = time.monotonic() - started
+        if res.status_code >= 500 or elapsed > self.slow:
+            node.failed(self.failure_threshold, self.cooldown)
+        else:
+            node.succeeded(elapsed)
+        return res
+
+    def request(self, method, path, **kwargs):
+        kwargs['timeout'] = kwargs.pop('timeout', None) or self.timeout
+        error = None
+        for node in self.candidates():
+            try:
+                res = self._send(node, method, path, **kwargs)
+            except requests.RequestException as ex:
+                error = ex
+                continue
+            if res.status_code >= 500:
+                error = RpcError.from_response(res)
+                continue
+            if res.status_code in (401, 403):
+                raise RpcForbiddenError(f'{res.reason}: {path}')
+            if res.status_code == 404:
+                pinned = PINNED_PATH.search(path)
+                if pinned and not self.knows_block(node, pinned.group(1)):
+                    error = RpcNotFoundError(f'{node.uri} does not know block {pinned.group(1)}')
+                    continue
+                raise RpcNotFoundError(f'Not found: {path}')
+            if res.status_code != 200:
+                raise RpcError.from_response(res)
+            return res
+        raise RpcError(f'no RPC node answered {method} {path}: {error}')
+
+
+def check_heads_forever(node_ref, interval):
+    """Head checks of a pool until it is garbage collected, off the request path"""
+    while (node := node_ref()) is not None:
+        node.check_heads()
+        del node
+        time.sleep(interval)
+
+
+def node_uris():
+    if settings.TEZOS_RPC_NODES:
+        return settings.TEZOS_RPC_NODES
+    return known_networks.get(settings.TEZOS_NETWORK, [settings.TEZOS_NETWORK])
+
+
+def get_shell():
+    """Shell of the configured backend: pooled RPC nodes, or the in-memory simulator"""
+    if settings.TEZOS_BACKEND == 'simulator':
+        return ShellQuery(simulator.SimulatedNode(simulator.get_chain(), latency=settings.TEZOS_SIMULATOR_LATENCY,
+                                                  failure_rate=settings.TEZOS_SIMULATOR_RPC_FAILURE_RATE))
+    return ShellQuery(PooledRpcNode(
+        node_uris(), timeout=settings.TEZOS_RPC_TIMEOUT, pool_size=settings.TEZOS_RPC_POOL_SIZE,
+        failure_threshold=settings.TEZOS_RPC_FAILURES, cooldown=settings.TEZOS_RPC_COOLDOWN,
+        slow=settings.TEZOS_RPC_SLOW, max_head_lag=settings.TEZOS_RPC_MAX_HEAD_LAG,
+        head_check_interval=settings.TEZOS_RPC_HEAD_CHECK_INTERVAL))
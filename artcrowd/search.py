@@ -0,0 +1,109 @@
+import re
+from django.conf import settings
+from django.db import connection
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.filters import BaseFilterBackend
+from .models import Project, User
+
+SQLITE_TABLE = 'artcrowd_project_search'
+# weights of the title, the artist name, the NFT description and the description
+SQLITE_WEIGHTS = (10.0, 10.0, 3.0, 1.0)
+
+
+def create_index(connection):
+    """The full-text index of the projects: a tsvector column with a GIN index on Postgres,
+    an FTS5 table whose rowid is the project id on SQLite"""
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('ALTER TABLE artcrowd_project ADD COLUMN IF NOT EXISTS search_vector tsvector')
+            cursor.execute('CREATE INDEX IF NOT EXISTS artcrowd_project_search_idx '
+                           'ON artcrowd_project USING gin (search_vector)')
+        else:
+            cursor.execute(f'CREATE VIRTUAL TABLE IF NOT EXISTS {SQLITE_TABLE} USING fts5('
+                           f'title, artist, nft_description, description, tokenize="unicode61 remove_diacritics 2")')
+
+
+def drop_index(connection):
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('ALTER TABLE artcrowd_project DROP COLUMN IF EXISTS search_vector')
+        else:
+            cursor.execute(f'DROP TABLE IF EXISTS {SQLITE_TABLE}')
+
+
+def index_projects(project_ids=None):
+    """Write the text of the projects to the index, of all the projects by default"""
+    where, params = '', []
+    if project_ids is not None:
+        project_ids = list(project_ids)
+        if not project_ids:
+            return
+        where, params = f'WHERE p.id IN ({", ".join(["%s"] * len(project_ids))})', project_ids
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            config = settings.SEARCH_CONFIG
+            cursor.execute(f'''
+                UPDATE artcrowd_project SET search_vector = s.vector FROM (
+                    SELECT p.id,
+                        setweight(to_tsvector(%s, p.title), 'A') ||
+                        setweight(to_tsvector(%s, coalesce(u.username, '')), 'A') ||
+                        setweight(to_tsvector(%s, p.nft_description), 'B') ||
+                        setweight(to_tsvector(%s, p.description), 'C') AS vector
+                    FROM artcrowd_project p LEFT JOIN artcrowd_user u ON u.id = p.artist_id {where}
+                ) s WHERE artcrowd_project.id = s.id''', [config] * 4 + params)
+            return
+        cursor.execute(f'DELETE FROM {SQLITE_TABLE} {where.replace("p.id", "rowid")}', params)
+        cursor.execute(f'''
+            INSERT INTO {SQLITE_TABLE} (rowid, title, artist, nft_description, description)
+            SELECT p.id, p.title, coalesce(u.username, ''), p.nft_description, p.description
+            FROM artcrowd_project p LEFT JOIN artcrowd_user u ON u.id = p.artist_id {where}''', params)
+
+
+def search(queryset, text):
+    """Projects matching all the words of `text`, annotated with `search_rank` and the best matches first.
+    The title and the artist name weigh more than the NFT description, which weighs more than the description."""
+    if connection.vendor == 'postgresql':
+        query = 'websearch_to_tsquery(%s, %s)'
+        config = settings.SEARCH_CONFIG
+        queryset = queryset.extra(
+            where=[f'artcrowd_project.search_vector @@ {query}'], params=[config, text],
+            select={'search_rank': f'ts_rank(artcrowd_project.search_vector, {query})'},
+            select_params=[config, text])
+    else:
+        words = re.findall(r'\w+', text)
+        if not words:
+            return queryset.none()
+        # quoted words are never read as FTS5 operators, the last one matches as a prefix while typing
+        match = ' '.join(f'"{word}"' for word in words) + '*'
+        queryset = queryset.extra(
+            tables=[SQLITE_TABLE], params=[match],
+            where=[f'{SQLITE_TABLE} MATCH %s', f'{SQLITE_TABLE}.rowid = artcrowd_project.id'],
+            select={'search_rank': f'-bm25({SQLITE_TABLE}, {", ".join(map(str, SQLITE_WEIGHTS))})'})
+    return queryset.order_by('-search_rank', '-id')
+
+
+class SearchFilterBackend(BaseFilterBackend):
+    """`q` searches the title, the artist name and the descriptions of the projects"""
+
+    def filter_queryset(self, request, queryset, view):
+        text = request.query_params.get('q', '').strip()
+        return search(queryset, text) if text else queryset
+
+
+@receiver(post_save, sender=Project)
+def project_saved(sender, instance, **kwargs):
+    index_projects([instance.pk])
+
+
+@receiver(post_delete, sender=Project)
+def project_deleted(sender, instance, **kwargs):
+    if connection.vendor != 'postgresql':  # the Postgres column goes away with the row
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {SQLITE_TABLE} WHERE rowid = %s', [instance.pk])
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, created, update_fields=None, **kwargs):
+    if not created and (update_fields is None or 'username' in update_fields):
+        index_projects(Project.objects.filter(artist=instance).values_list('id', flat=True))
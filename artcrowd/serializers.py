@@ -38,18 +38,9 @@ class UserBriefSerializer(serializers.ModelSerializer):
 
 
 class UserSerializer(serializers.ModelSerializer):
-    created_projects_num = serializers.SerializerMethodField()
-    supported_projects_num = serializers.SerializerMethodField()
-    presented_projects_num = serializers.SerializerMethodField()
-
-    def get_created_projects_num(self, obj):
-        return models.Project.objects.filter(artist=obj).count()
-
-    def get_supported_projects_num(self, obj):
-        return models.Share.objects.filter(patron=obj).values('project_id').distinct().count()
-
-    def get_presented_projects_num(self, obj):
-        return models.Project.objects.filter(presenter=obj).count()
+    created_projects_num = serializers.IntegerField(source='stats.created_projects_num', read_only=True)
+    supported_projects_num = serializers.IntegerField(source='stats.supported_projects_num', read_only=True)
+    presented_projects_num = serializers.IntegerField(source='stats.presented_projects_num', read_only=True)
 
     class Meta:
         model = models.User
@@ -101,8 +92,10 @@ class ProjectBriefSerializer(serializers.ModelSerializer):
 
 class ProjectSerializer(ProjectBriefSerializer):
     image = serializers.ImageField(read_only=True)
-    shares = ShareAsNestedObj(many=True, read_only=True)
-    updates = ProjectUpdateSerializer(many=True, read_only=True)
+    shares = ShareAsNestedObj(many=True, read_only=True, source='recent_shares')
+    updates = ProjectUpdateSerializer(many=True, read_only=True, source='recent_updates')
+    shares_count = serializers.IntegerField(read_only=True)
+    updates_count = serializers.IntegerField(read_only=True)
     can_post_update = serializers.SerializerMethodField()
 
     def get_can_post_update(self, obj):
@@ -114,7 +107,8 @@ class ProjectSerializer(ProjectBriefSerializer):
     class Meta:
         model = models.Project
         fields = ProjectBriefSerializer.Meta.fields + [
-                    'updates', 'shares_sum', 'shares', 'nft_description', 'can_post_update']
+                    'updates', 'updates_count', 'shares_sum', 'shares', 'shares_count', 'nft_description',
+                    'can_post_update']
 
 
 class ProjectListSerializer(serializers.Serializer):
@@ -158,7 +152,26 @@ class BuySharesSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = models.Share
-        fields = ['patron', 'quantity', 'purchased_on', 'ophash', 'blockhash']
+        fields = ['patron', 'quantity', 'purchased_on', 'ophash', 'wallet']
+
+
+class HoldingsRequestSerializer(serializers.Serializer):
+    wallets = serializers.ListField(child=serializers.CharField(max_length=36), min_length=1,
+                                    max_length=settings.HOLDINGS_MAX_WALLETS)
+    project_ids = serializers.ListField(child=serializers.IntegerField(min_value=0), default=list)
+    token_ids = serializers.ListField(child=serializers.IntegerField(min_value=0), default=list)
+
+    def validate(self, data):
+        if len(data['wallets']) * (len(data['project_ids']) + len(data['token_ids'])) > settings.HOLDINGS_MAX_LOOKUPS:
+            raise serializers.ValidationError(f'At most {settings.HOLDINGS_MAX_LOOKUPS} wallet and project or token '
+                                              f'pairs can be read at once')
+        return data
+
+
+class PendingOperationSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = models.PendingOperation
+        fields = ['ophash', 'status', 'level', 'block_hash', 'error', 'updated_on']
 
 
 class ProjectMetadataSerializer(serializers.Serializer):
@@ -175,6 +175,15 @@ REST_FRAMEWORK = {
     'DEFAULT_SCHEMA_CLASS': 'artcrowd.AutoSchema'
 }
 
+# shared by the processes with a memcached or redis backend, local memory is only invalidated by writes of its process
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', ''),
+    }
+}
+API_CACHE_TTL = int(os.getenv('API_CACHE_TTL', 60))  # in seconds, responses are also dropped on every write
+
 CORS_ALLOWED_ORIGINS = [
     "http://localhost:8000",
     "http://localhost:3000",
@@ -203,6 +212,54 @@ CRONJOBS = [
 PROJECTS_CONTRACT = os.getenv('PROJECTS_CONTRACT', 'KT1WYtFLhxmBkLYJrBg4xaA6sStnMuTwZA57')  # KT1DohyRaZNCaqoebhSkrGArXX6iPaqutVTq
 GALLERY_CONTRACT = os.getenv('GALLERY_CONTRACT', 'KT1GLXsZwLLJ4Lsiv7RqS8K9Pa93gZEQiGW3')  # KT1V2an2yE7V2ETqynzdJuA6dF6Da9uPtt3x
 TEZOS_NETWORK = os.getenv('TEZOS_NETWORK', 'ghostnet')
-TEZOS_WALLET_KEYFILE = os.getenv('TEZOS_WALLET_KEYFILE', os.path.join(os.path.dirname(os.path.realpath(__file__)), '../wallet.json'))
+# the tests sign with a key generated for them, holding nothing on any network
+TEZOS_WALLET_KEYFILE = os.getenv('TEZOS_WALLET_KEYFILE', os.path.join(BASE_DIR, 'wallet.json'))
+TEZOS_RPC_NODES = [uri for uri in os.getenv('TEZOS_RPC_NODES', '').split(',') if uri]  # TEZOS_NETWORK nodes by default
+TEZOS_RPC_TIMEOUT = 10  # in seconds
+TEZOS_RPC_POOL_SIZE = 10  # keep-alive connections per node
+TEZOS_RPC_FAILURES = 3  # failures in a row before a node is left out
+TEZOS_RPC_COOLDOWN = 30  # in seconds a failing node is left out
+TEZOS_RPC_SLOW = 5  # in seconds, slower responses count as failures
+TEZOS_RPC_MAX_HEAD_LAG = 2  # blocks behind the most advanced node
+TEZOS_RPC_HEAD_CHECK_INTERVAL = 10  # in seconds
+TEZOS_BACKEND = os.getenv('TEZOS_BACKEND', 'node')  # node, or simulator for an in-memory chain without network
+TEZOS_SIMULATOR_BLOCK_TIME = float(os.getenv('TEZOS_SIMULATOR_BLOCK_TIME', 0))  # in seconds, 0 bakes on every injection
+TEZOS_SIMULATOR_LATENCY = float(os.getenv('TEZOS_SIMULATOR_LATENCY', 0))  # in seconds added to every RPC
+TEZOS_SIMULATOR_RPC_FAILURE_RATE = float(os.getenv('TEZOS_SIMULATOR_RPC_FAILURE_RATE', 0))  # share of failing RPCs
+TEZOS_SIMULATOR_FAILURE_RATE = float(os.getenv('TEZOS_SIMULATOR_FAILURE_RATE', 0))  # share of failing operations
+TEZOS_SIMULATOR_DROP_RATE = float(os.getenv('TEZOS_SIMULATOR_DROP_RATE', 0))  # share of operations never included
+TEZOS_SCRIPT_CACHE_DIR = os.getenv('TEZOS_SCRIPT_CACHE_DIR', os.path.join(BASE_DIR, '.tezos_cache'))
+TEZOS_READ_CACHE_SIZE = int(os.getenv('TEZOS_READ_CACHE_SIZE', 4096))  # entries
+TEZOS_READ_CACHE_BLOCKS = 4  # blocks whose reads are kept, the head and the indexed block at least
+TEZOS_HEAD_TTL = float(os.getenv('TEZOS_HEAD_TTL', 2))  # in seconds
+TEZOS_BULK_READ_THREADS = 16  # concurrent reads of one holdings lookup
+TEZOS_BALANCE_BATCH = 200  # token balances per get_balance_of view call
+HOLDINGS_MAX_WALLETS = 10000
+HOLDINGS_MAX_LOOKUPS = 20000  # wallets × (projects + tokens) of one holdings request
+TEZOS_PUBLIC_KEY_CACHE_SIZE = 10000  # wallets
+TEZOS_READ_FROM_INDEX = bool(os.getenv('TEZOS_READ_FROM_INDEX', False))  # read balances from the chain indexer tables
+INDEXER_CONFIRMATIONS = 2  # blocks, Tenderbake blocks are final after two more blocks
+INDEXER_MAX_LAG = 60  # in seconds, older index is ignored and reads go to the node
+INDEXER_POLL_INTERVAL = 5  # in seconds
+INDEXER_READ_ATTEMPTS = 3  # reads of a snapshot across the mirrors before giving up
+CHAIN_REORG_DEPTH = 10  # blocks, processed block hashes kept to find the common ancestor after a reorganisation
+TEZOS_COUNTER_TTL = 60  # in seconds, idle local counter is read again from the node
+TEZOS_GAS_MARGIN = 0.2  # added to calibrated gas and storage limits
+TEZOS_CHUNK_SIZE = 500  # wallets per refund or mint call when the entrypoint has no gas profile
+TRACKER_CONFIRMATIONS = 2  # blocks, operations reported as included are then final
+TRACKER_OPERATION_TTL = 240  # blocks, max_operations_ttl of the protocol when the block metadata has none
+TRACKER_POLL_INTERVAL = 2  # in seconds
+MINTING_POLL_INTERVAL = 5  # in seconds
+OUTBOX_BATCH_SIZE = 20  # operations per operation group
+OUTBOX_MAX_ATTEMPTS = 8
+OUTBOX_BACKOFF = 10  # in seconds, doubled after every failed attempt
+OUTBOX_MAX_BACKOFF = 3600  # in seconds
+OUTBOX_SENDING_TIMEOUT = 600  # in seconds
+OUTBOX_POLL_INTERVAL = 2  # in seconds
+METRICS_DIR = os.getenv('METRICS_DIR')  # shared by the processes of one host, e.g. /run/artcrowd/metrics, off by default
+METRICS_FLUSH_INTERVAL = 10  # in seconds
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')  # bearer token of the metrics scraper, staff users only without it
 TOKEN_METADATA = os.getenv('TOKEN_METADATA', 'metadata.json')
 UPDATE_POST_INTERVAL = 12 * 3600  # in seconds
+PROJECT_DETAIL_EMBEDDED = 10  # latest shares and updates in the project details, the rest is paginated
+SEARCH_CONFIG = os.getenv('SEARCH_CONFIG', 'simple')  # Postgres text search configuration of the project search
@@ -0,0 +1,665 @@
+import copy
+import json
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from hashlib import blake2b
+import requests
+from django.conf import settings
+from pytezos.contract.interface import ContractInterface
+from pytezos.crypto.key import Key
+from pytezos.crypto.encoding import base58_encode
+from pytezos.michelson.forge import unforge_address, unforge_array, unforge_micheline, unforge_public_key
+from pytezos.michelson.parse import michelson_to_micheline
+from pytezos.michelson.types import MichelsonType
+from pytezos.operation.forge import reserved_entrypoints
+from pytezos.rpc.kind import operation_tags
+from pytezos.rpc.node import RpcNode, RpcError, RpcNotFoundError
+
+CHAIN_ID = 'NetXnHfVqm9iesp'
+PROTOCOL = 'PsQuebecnLByd3JwTiGadoG4nGWi3HYiLXUjkibeFV8dCFeVMUg'
+GENESIS_BALANCE = 10 ** 12  # mutez of an implicit account when first seen
+MAX_CATCH_UP = 120  # blocks baked at once after the simulator was idle
+GAS_BASE = 1500  # gas of a contract call
+GAS_PER_BYTE = 10  # gas per byte of parameters
+GAS_PER_WRITE = 200  # gas per storage write
+STORAGE_PER_KEY = 70  # bytes paid for a new big map key
+MAX_OPERATIONS_TTL = 240  # blocks after its branch an operation can be included in
+CONSTANTS = {
+    'hard_gas_limit_per_operation': '1040000',
+    'hard_gas_limit_per_block': '2600000',
+    'hard_storage_limit_per_operation': '60000',
+    'max_operation_data_length': 32768,
+    'cost_per_byte': '250',
+    'origination_size': 257,
+    'minimal_block_delay': '1',
+}
+
+PROJECTS_SCRIPT = '''
+parameter (or (or (or (unit %add_money) (pair %buy_shares (pair %purchase nat address) (nat %project_id)))
+                  (or (pair %create_project (nat %project_id) (mutez %share_price))
+                      (address %refund)))
+              (or (or (pair %refund_all (nat %project_id) (list %wallets address))
+                      (pair %update_project_status (string %status) (nat %project_id)))
+                  (pair %withdraw_mutez (mutez %amount) (address %destination))));
+storage (pair (address %administrator)
+              (pair (nat %fee_pct)
+                    (pair (big_map %ledger address mutez)
+                          (pair (big_map %projects nat (pair (string %status)
+                                                             (pair (mutez %share_price) (nat %total_shares))))
+                                (big_map %shares (pair nat address) nat)))));
+code { CDR ; NIL operation ; PAIR };
+'''
+
+GALLERY_SCRIPT = '''
+parameter (or (list %mint (pair (address %to_) (pair (or %token (nat %existing) (map %new string bytes)) (nat %amount))))
+              (pair %withdraw_mutez (mutez %amount) (address %destination)));
+storage (pair (address %administrator)
+              (pair (big_map %ledger (pair address nat) nat)
+                    (pair (big_map %metadata string bytes)
+                          (pair (nat %next_token_id)
+                                (pair (big_map %supply nat nat)
+                                      (big_map %token_metadata nat (pair (nat %token_id)
+                                                                         (map %token_info string bytes))))))));
+code { CDR ; NIL operation ; PAIR };
+view "get_balance_of" (list (pair (address %owner) (nat %token_id)))
+                      (list (pair (pair %request (address %owner) (nat %token_id)) (nat %balance)))
+                      { DROP ; NIL (pair (pair address nat) nat) };
+'''
+
+
+def _hash(prefix, data):
+    return base58_encode(blake2b(data, digest_size=32).digest(), prefix).decode()
+
+
+def _error(kind, error_id, **fields):
+    return {'kind': kind, 'id': f'proto.021-PsQuebec.{error_id}', **fields}
+
+
+def _rejected(message):
+    return _error('permanent', 'michelson_v1.script_rejected', **{'with': {'string': message}})
+
+
+class ScriptRejected(Exception):
+    """FAILWITH of a simulated contract"""
+
+
+class SimulatedContract:
+    """Storage of a contract kept as Python values, with every past value so that reads can be pinned to a block.
+    Entrypoints are methods with the semantics of the SmartPy source. Writes of an operation group go to
+    a journal that is committed when the whole group is applied and dropped otherwise."""
+    script = None
+    big_maps = ()
+
+    def __init__(self, address, admin, first_big_map_id):
+        self.address = address
+        self.code = michelson_to_micheline(self.script)
+        program = ContractInterface.from_micheline(self.code).program
+        self.parameter, self.storage_type = program.parameter, program.storage
+        self.views = {expr['args'][0]['string']: expr['args'][1:3] for expr in self.code if expr['prim'] == 'view'}
+        self.big_map_ids = {name: first_big_map_id + i for i, name in enumerate(self.big_maps)}
+        self.fields = self.initial_fields(admin)
+        storage = self.storage_type.from_python_object({**self.fields, **self.big_map_ids}).item
+        self.big_map_types = {name: type(storage[name]) for name in self.big_maps}
+        self.values = {name: {} for name in self.big_maps}
+        self.values[''] = {}
+        self.history = {}  # (big map name or '' for fields, key) -> [(level, value)]
+        self.key_hashes = {name: {} for name in self.big_maps}
+        self.journal = {name: {} for name in self.values}
+        self.changes = []  # (name, key) written by the current call
+        self.level = None  # block level of the state seen by views
+        for name, value in {**self.fields, 'balance': 0}.items():
+            self.put('', name, value)
+        self.commit(0)
+
+    def initial_fields(self, admin):
+        return {'administrator': admin}
+
+    def get(self, name, key, default=None):
+        if self.level is not None:
+            value = self.value_at(name, key, self.level)
+        else:
+            value = self.journal[name].get(key, self.values[name].get(key))
+        return default if value is None else value
+
+    def put(self, name, key, value):
+        """Write a big map key or a field, None removes the key"""
+        self.journal[name][key] = value
+        self.changes.append((name, key))
+
+    def value_at(self, name, key, level):
+        for value_level, value in reversed(self.history.get((name, key), ())):
+            if value_level <= level:
+                return value
+        return None
+
+    def key_hash(self, name, key):
+        return self.big_map_types[name](items=[]).get_key_hash(key)
+
+    def encode(self, name, key=None, value=None):
+        """Micheline of a big map key or value"""
+        key_type, value_type = self.big_map_types[name].args
+        if value is None:
+            return key_type.from_python_object(key).to_micheline_value()
+        return value_type.from_python_object(value).to_micheline_value()
+
+    def storage_at(self, level=None):
+        """Storage at the block level, or with the pending writes when no level is given"""
+        fields = {name: self.value_at('', name, level) if level is not None else self.get('', name)
+                  for name in self.fields}
+        return self.storage_type.from_python_object({**fields, **self.big_map_ids}).to_micheline_value()
+
+    def big_map_value_at(self, name, key_hash, level):
+        key = self.key_hashes[name].get(key_hash)
+        value = None if key is None else self.value_at(name, key, level)
+        return None if value is None else self.encode(name, value=value)
+
+    def lazy_storage_diff(self):
+        """Big map writes of the current call in the format of operation receipts"""
+        diffs = []
+        for name in self.big_maps:
+            updates = []
+            for key in dict.fromkeys(key for changed, key in self.changes if changed == name):
+                value = self.journal[name][key]
+                update = {'key_hash': self.key_hash(name, key), 'key': self.encode(name, key)}
+                if value is not None:
+                    update['value'] = self.encode(name, value=value)
+                updates.append(update)
+            if updates:
+                diffs.append({'kind': 'big_map', 'id': str(self.big_map_ids[name]),
+                              'diff': {'action': 'update', 'updates': updates}})
+        return diffs
+
+    def new_keys(self):
+        return len({(name, key) for name, key in self.changes
+                    if name and self.journal[name][key] is not None and key not in self.values[name]})
+
+    def commit(self, level):
+        for name, journal in self.journal.items():
+            for key, value in journal.items():
+                self.history.setdefault((name, key), []).append((level, value))
+                if value is None:
+                    self.values[name].pop(key, None)
+                else:
+                    self.values[name][key] = value
+                if name:
+                    self.key_hashes[name].setdefault(self.key_hash(name, key), key)
+        self.rollback()
+
+    def rollback(self):
+        self.journal = {name: {} for name in self.values}
+
+    def call(self, sender, amount, parameters):
+        """Run an entrypoint, return the transfers [(destination, mutez)] it emits"""
+        (entrypoint, args), = self.parameter.from_parameters(parameters).to_python_object().items()
+        self.sender, self.amount, self.transfers, self.changes = sender, amount, [], []
+        self.put('', 'balance', self.get('', 'balance') + amount)
+        method = getattr(self, entrypoint)
+        method(**args) if isinstance(args, dict) else method(args)
+        return self.transfers
+
+    def view(self, name, value, level):
+        input_type, output_type = (MichelsonType.match(expr) for expr in self.views[name])
+        self.level = level
+        try:
+            result = getattr(self, name)(input_type.from_micheline_value(value).to_python_object())
+        finally:
+            self.level = None
+        return output_type.from_python_object(result).to_micheline_value()
+
+    def require(self, condition, message):
+        if not condition:
+            raise ScriptRejected(message)
+
+    def require_admin(self):
+        self.require(self.sender == self.get('', 'administrator'), 'FA2_NOT_ADMIN')
+
+    def send(self, destination, amount):
+        balance = self.get('', 'balance')
+        self.require(balance >= amount, 'balance too low')
+        self.put('', 'balance', balance - amount)
+        self.transfers.append((destination, amount))
+
+    def withdraw_mutez(self, amount, destination):
+        self.require_admin()
+        self.send(destination, amount)
+
+
+class ProjectsContract(SimulatedContract):
+    """ProjectContract of tezos/artcrowd.py"""
+    script = PROJECTS_SCRIPT
+    big_maps = ('ledger', 'projects', 'shares')
+
+    def initial_fields(self, admin):
+        return {'administrator': admin, 'fee_pct': 103}
+
+    def create_project(self, project_id, share_price):
+        self.require_admin()
+        self.require(self.get('projects', project_id) is None, 'project already exists')
+        self.put('projects', project_id, {'status': 'open', 'share_price': share_price, 'total_shares': 0})
+
+    def update_project_status(self, status, project_id):
+        self.require_admin()
+        project = self.get('projects', project_id)
+        self.require(project is not None, 'Project not found.')
+        self.put('projects', project_id, {**project, 'status': status})
+
+    def add_money(self, unit):
+        self.put('ledger', self.sender, self.amount)  # as in the contract, a deposit replaces the previous one
+
+    def buy_shares(self, purchase, project_id):
+        num_shares, wallet = purchase
+        project = self.get('projects', project_id)
+        self.require(project is not None, 'MAP_KEY_NOT_FOUND')
+        self.put('projects', project_id, {**project, 'total_shares': project['total_shares'] + num_shares})
+        self.put('shares', (project_id, wallet), self.get('shares', (project_id, wallet), 0) + num_shares)
+        money = self.get('ledger', wallet)
+        self.require(money is not None, 'MAP_KEY_NOT_FOUND')
+        self.require(money >= num_shares * project['share_price'], 'MUTEZ_UNDERFLOW')
+        self.put('ledger', wallet, money - num_shares * project['share_price'])
+
+    def refund_all(self, project_id, wallets):
+        self.require_admin()
+        project = self.get('projects', project_id)
+        self.require(project is not None, 'Project not found.')
+        total_shares = project['total_shares']
+        for wallet in wallets:
+            shares = self.get('shares', (project_id, wallet), 0)
+            if shares > 0:
+                self.put('shares', (project_id, wallet), None)
+                total_shares = abs(total_shares - shares)
+                self.send(wallet, project['share_price'] * shares)
+        self.put('projects', project_id, {**project, 'total_shares': total_shares})
+
+    def refund(self, wallet):
+        money = self.get('ledger', wallet)
+        self.require(money is not None, 'MAP_KEY_NOT_FOUND')
+        self.send(wallet, money)
+        self.put('ledger', wallet, None)
+
+
+class GalleryContract(SimulatedContract):
+    """ArtcrowdCollection of tezos/collection.py: fungible FA2 with admin minting and the get_balance_of view"""
+    script = GALLERY_SCRIPT
+    big_maps = ('ledger', 'metadata', 'supply', 'token_metadata')
+
+    def initial_fields(self, admin):
+        return {'administrator': admin, 'next_token_id': 0}
+
+    def mint(self, batch):
+        self.require_admin()
+        for action in batch:
+            if 'new' in action['token']:
+                token_id = self.get('', 'next_token_id')
+                self.put('token_metadata', token_id, {'token_id': token_id, 'token_info': action['token']['new']})
+                self.put('', 'next_token_id', token_id + 1)
+            else:
+                token_id = action['token']['existing']
+                self.require(token_id < self.get('', 'next_token_id'), 'FA2_TOKEN_UNDEFINED')
+            self.put('supply', token_id, self.get('supply', token_id, 0) + action['amount'])
+            key = (action['to_'], token_id)
+            self.put('ledger', key, self.get('ledger', key, 0) + action['amount'])
+
+    def get_balance_of(self, requests):
+        balances = []
+        for request in requests:
+            self.require(request['token_id'] < self.get('', 'next_token_id'), 'FA2_TOKEN_UNDEFINED')
+            balances.append({'request': request,
+                             'balance': self.get('ledger', (request['owner'], request['token_id']), 0)})
+        return balances
+
+
+def _unforge_nat(data, pos):
+    value = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7f) << shift
+        shift += 7
+        if not byte & 0x80:
+            return value, pos
+
+
+def unforge_operation(payload):
+    """Branch and contents of a forged and signed operation group, reveals and transactions only"""
+    entrypoints = {tag: name for name, tag in reserved_entrypoints.items()}
+    data, pos, contents = payload[:-64], 32, []
+    while pos < len(data):
+        tag = data[pos]
+        content = {'kind': {operation_tags['reveal']: 'reveal', operation_tags['transaction']: 'transaction'}[tag],
+                   'source': unforge_address(b'\x00' + data[pos + 1: pos + 22])}
+        pos += 22
+        for name in ('fee', 'counter', 'gas_limit', 'storage_limit'):
+            value, pos = _unforge_nat(data, pos)
+            content[name] = str(value)
+        if content['kind'] == 'reveal':
+            key_length = {0: 33, 1: 34, 2: 34, 3: 49}[data[pos]]
+            content['public_key'] = unforge_public_key(data[pos: pos + key_length])
+            pos += key_length + 1
+            if data[pos - 1]:  # proof
+                pos += unforge_array(data[pos:])[1]
+        else:
+            amount, pos = _unforge_nat(data, pos)
+            content['amount'] = str(amount)
+            content['destination'] = unforge_address(data[pos: pos + 22])
+            pos += 23
+            if data[pos - 1]:
+                if data[pos] == 0xff:
+                    entrypoint, length = unforge_array(data[pos + 1:], len_bytes=1)
+                    entrypoint, pos = entrypoint.decode(), pos + 1 + length
+                else:
+                    entrypoint, pos = entrypoints[data[pos: pos + 1]], pos + 1
+                value, length = unforge_array(data[pos:])
+                content['parameters'] = {'entrypoint': entrypoint, 'value': unforge_micheline(value)}
+                pos += length
+        contents.append(content)
+    return {'branch': base58_encode(payload[:32], b'B').decode(), 'contents': contents,
+            'signature': base58_encode(payload[-64:], b'sig').decode()}
+
+
+class SimulatedChain:
+    """Accounts, mempool and blocks of a chain kept in memory, running the projects and gallery contracts at
+    their configured addresses. A block is baked every `block_time` seconds, or on every injection when it is 0.
+    Like a node, it accepts one pending operation group per source and checks counters at injection.
+    `failure_rate` of the included operations fail and `drop_rate` of the injected ones are never included."""
+
+    def __init__(self, admin, block_time=0, failure_rate=0.0, drop_rate=0.0, seed=None):
+        self.lock = threading.RLock()
+        self.admin = admin
+        self.block_time = block_time
+        self.failure_rate = failure_rate
+        self.drop_rate = drop_rate
+        self.random = random.Random(seed)
+        self.accounts = {}  # implicit account -> {'balance': mutez, 'counter': int, 'public_key': str}
+        self.contracts = {}
+        for contract_class, address in ((ProjectsContract, settings.PROJECTS_CONTRACT),
+                                        (GalleryContract, settings.GALLERY_CONTRACT)):
+            first_big_map_id = sum(len(contract.big_maps) for contract in self.contracts.values())
+            self.contracts[address] = contract_class(address, admin, first_big_map_id)
+        self.big_maps = {ptr: (contract, name) for contract in self.contracts.values()
+                         for name, ptr in contract.big_map_ids.items()}
+        self.mempool = []  # operation groups
+        self.blocks = []
+        self.levels = {}  # block hash -> level
+        self.last_block_time = time.time()
+        self.bake()
+
+    def account(self, address):
+        return self.accounts.setdefault(address, {'balance': GENESIS_BALANCE, 'counter': 0, 'public_key': None})
+
+    def advance(self):
+        """Bake the blocks that are due, at least one a second so that waiting for confirmations ends"""
+        block_time = self.block_time or 1
+        due = int((time.time() - self.last_block_time) // block_time)
+        for _ in range(min(due, MAX_CATCH_UP)):
+            self.last_block_time += block_time
+            self.bake()
+        if due > MAX_CATCH_UP:
+            self.last_block_time = time.time()
+
+    def bake(self):
+        level = len(self.blocks)
+        operations = [self.apply(operation, level) for operation in self.mempool
+                      if not (self.drop_rate and self.random.random() < self.drop_rate)]
+        self.mempool = []
+        predecessor = self.blocks[-1]['hash'] if self.blocks else _hash(b'B', b'genesis')
+        block_hash = _hash(b'B', json.dumps([level, predecessor, [op['hash'] for op in operations]]).encode())
+        if not self.block_time:
+            self.last_block_time = time.time()
+        timestamp = datetime.fromtimestamp(self.last_block_time, timezone.utc)
+        header = {'level': level, 'proto': 1, 'predecessor': predecessor,
+                  'timestamp': timestamp.strftime('%Y-%m-%dT%H:%M:%SZ'), 'validation_pass': 4}
+        self.blocks.append({'protocol': PROTOCOL, 'chain_id': CHAIN_ID, 'hash': block_hash, 'header': header,
+                            'metadata': {'protocol': PROTOCOL, 'next_protocol': PROTOCOL,
+                                         'max_operations_ttl': MAX_OPERATIONS_TTL},
+                            'operations': [[], [], [], operations]})
+        self.levels[block_hash] = level
+
+    def apply(self, operation, level, dry_run=False):
+        """Apply the operation group at `level`, return it with the receipt of every content"""
+        results, failed = [], False
+        touched = set()
+        for content in operation['contents']:
+            if not dry_run:
+                self.account(content['source'])['counter'] = int(content['counter'])
+            if failed:
+                results.append({'status': 'skipped'})
+                continue
+            result = {'status': 'applied'}
+            internal_results = []
+            try:
+                if content['kind'] == 'reveal':
+                    if not dry_run:
+                        self.account(content['source'])['public_key'] = content['public_key']
+                    result['consumed_milligas'] = '1000000'
+                elif content['destination'] in self.contracts:
+                    contract = self.contracts[content['destination']]
+                    touched.add(contract)
+                    if self.failure_rate and not dry_run and self.random.random() < self.failure_rate:
+                        raise ScriptRejected('simulated failure')
+                    transfers = contract.call(content['source'], int(content['amount']), content['parameters'])
+                    param_size = len(json.dumps(content['parameters']['value']))
+                    gas = GAS_BASE + GAS_PER_BYTE * param_size + GAS_PER_WRITE * len(contract.changes)
+                    paid_storage = STORAGE_PER_KEY * contract.new_keys()
+                    if gas > int(content['gas_limit']):
+                        result = {'status': 'failed', 'errors': [_error('temporary', 'gas_exhausted.operation')]}
+                    elif paid_storage > int(content['storage_limit']):
+                        result = {'status': 'failed', 'errors': [_error('temporary', 'storage_exhausted.operation')]}
+                    else:
+                        result.update({'storage': contract.storage_at(),
+                                       'lazy_storage_diff': contract.lazy_storage_diff(),
+                                       'consumed_milligas': str(gas * 1000),
+                                       'paid_storage_size_diff': str(paid_storage)})
+                        internal_results = [{'kind': 'transaction', 'source': contract.address, 'nonce': nonce,
+                                             'amount': str(amount), 'destination': destination,
+                                             'result': {'status': 'applied', 'consumed_milligas': '100000'}}
+                                            for nonce, (destination, amount) in enumerate(transfers)]
+                else:
+                    result['consumed_milligas'] = '100000'
+            except ScriptRejected as ex:
+                result = {'status': 'failed', 'errors': [_rejected(str(ex))]}
+            failed = result['status'] != 'applied'
+            results.append(result)
+            content['metadata'] = {'balance_updates': [], 'operation_result': result,
+                                   'internal_operation_results': internal_results}
+        if failed:
+            for result in results:
+                if result['status'] == 'applied':
+                    result['status'] = 'backtracked'
+        for contract in touched:
+            if failed or dry_run:
+                contract.rollback()
+            else:
+                contract.commit(level)
+        if not failed and not dry_run:
+            for content in operation['contents']:
+                for internal in content['metadata']['internal_operation_results']:
+                    self.account(internal['destination'])['balance'] += int(internal['amount'])
+                if content['kind'] == 'transaction':
+                    self.account(content['source'])['balance'] -= int(content['amount'])
+        return operation
+
+    def inject(self, payload):
+        operation = unforge_operation(bytes.fromhex(payload))
+        operation['hash'] = _hash(b'o', bytes.fromhex(payload))
+        operation['protocol'], operation['chain_id'] = PROTOCOL, CHAIN_ID
+        sources = {content['source'] for content in operation['contents']}
+        if any(content['source'] in sources for pending in self.mempool for content in pending['contents']):
+            raise RpcError.from_errors([{'kind': 'temporary', 'id': 'prevalidation.operation_conflict'}])
+        for index, content in enumerate(operation['contents']):
+            expected = self.account(content['source'])['counter'] + 1 + index
+            if int(content['counter']) != expected:
+                state = 'past' if int(content['counter']) < expected else 'future'
+                raise RpcError.from_errors([_error('temporary' if state == 'future' else 'branch',
+                                                   f'contract.counter_in_the_{state}',
+                                                   expected=str(expected), found=content['counter'])])
+        self.mempool.append(operation)
+        if not self.block_time:
+            self.bake()
+        return operation['hash']
+
+    def deposit(self, wallet, amount):
+        """Record a patron's add_money call of `amount` mutez as if it was signed by the wallet,
+        return the operation hash"""
+        content = {'kind': 'transaction', 'source': wallet, 'fee': '0',
+                   'counter': str(self.account(wallet)['counter'] + 1), 'gas_limit': '10000',
+                   'storage_limit': '100', 'amount': str(amount), 'destination': settings.PROJECTS_CONTRACT,
+                   'parameters': {'entrypoint': 'add_money', 'value': {'prim': 'Unit'}}}
+        operation = {'protocol': PROTOCOL, 'chain_id': CHAIN_ID, 'branch': self.blocks[-1]['hash'],
+                     'contents': [content], 'signature': base58_encode(b'\x00' * 64, b'sig').decode()}
+        operation['hash'] = _hash(b'o', json.dumps(operation, sort_keys=True).encode())
+        self.mempool.append(operation)
+        if not self.block_time:
+            self.bake()
+        return operation['hash']
+
+    def block(self, block_id):
+        if block_id == 'head':
+            return self.blocks[-1]
+        if block_id == 'genesis':
+            return self.blocks[0]
+        if block_id.startswith('head~'):
+            return self.blocks[max(0, len(self.blocks) - 1 - int(block_id[5:]))]
+        if block_id.isdigit() and int(block_id) < len(self.blocks):
+            return self.blocks[int(block_id)]
+        if block_id in self.levels:
+            return self.blocks[self.levels[block_id]]
+        raise RpcNotFoundError(f'Not found: block {block_id}')
+
+    def handle(self, method, parts, body):
+        """Answer an RPC request like a node would"""
+        if parts == ['injection', 'operation']:
+            return self.inject(body)
+        if parts == ['version']:
+            return {'network_version': {'chain_name': 'TEZOS_ARTCROWD_SIMULATOR', 'distributed_db_version': 2,
+                                        'p2p_version': 1}}
+        if parts[:2] != ['chains', 'main'] or len(parts) < 3:
+            raise RpcNotFoundError(f'Not found: {"/".join(parts)}')
+        if parts[2] == 'chain_id':
+            return CHAIN_ID
+        if parts[2:] == ['mempool', 'pending_operations']:
+            operations = [{key: value for key, value in operation.items() if key not in ('protocol', 'chain_id')}
+                          for operation in self.mempool]
+            return {'validated': operations, 'refused': [], 'outdated': [], 'branch_refused': [],
+                    'branch_delayed': [], 'unprocessed': []}
+        if parts[2] == 'blocks' and len(parts) > 3:
+            return self.handle_block(self.block(parts[3]), parts[4:], body)
+        raise RpcNotFoundError(f'Not found: {"/".join(parts)}')
+
+    def handle_block(self, block, parts, body):
+        level = block['header']['level']
+        if not parts:
+            return block
+        if parts == ['hash']:
+            return block['hash']
+        if parts == ['header']:
+            return {'protocol': PROTOCOL, 'chain_id': CHAIN_ID, 'hash': block['hash'], **block['header']}
+        if parts[0] == 'operation_hashes':
+            return [[operation['hash'] for operation in operations] for operations in block['operations']]
+        if parts[0] == 'operations':
+            result = block['operations']
+            for index in parts[1:]:
+                result = result[int(index)]
+            return result
+        if parts == ['context', 'constants']:
+            return {**CONSTANTS, 'minimal_block_delay': str(int(self.block_time) or 1)}
+        if parts[:2] == ['context', 'contracts'] and len(parts) > 2:
+            return self.handle_contract(parts[2], parts[3:], level)
+        if parts[:2] == ['context', 'big_maps'] and len(parts) == 4 and int(parts[2]) in self.big_maps:
+            contract, name = self.big_maps[int(parts[2])]
+            value = contract.big_map_value_at(name, parts[3], level)
+            if value is not None:
+                return value
+        if parts == ['helpers', 'scripts', 'run_operation']:
+            return self.apply(copy.deepcopy(body['operation']), level, dry_run=True)
+        if parts == ['helpers', 'scripts', 'run_script_view'] and body['contract'] in self.contracts:
+            contract = self.contracts[body['contract']]
+            try:
+                return {'data': contract.view(body['view'], body['input'], level)}
+            except ScriptRejected as ex:
+                raise RpcError.from_errors([_rejected(str(ex))])
+        raise RpcNotFoundError(f'Not found: {"/".join(parts)}')
+
+    def handle_contract(self, address, parts, level):
+        if address in self.contracts:
+            contract = self.contracts[address]
+            if parts == ['script']:
+                return {'code': contract.code, 'storage': contract.storage_at(level)}
+            if parts == ['storage']:
+                return contract.storage_at(level)
+            if parts in ([], ['balance']):
+                balance = str(contract.value_at('', 'balance', level))
+                return balance if parts else {'balance': balance}
+        else:
+            account = self.account(address)
+            if not parts:
+                return {'balance': str(account['balance']), 'counter': str(account['counter'])}
+            if parts in (['balance'], ['counter']):
+                return str(account[parts[0]])
+            if parts == ['manager_key']:
+                return account['public_key']
+        raise RpcNotFoundError(f'Not found: contract {address} {"/".join(parts)}')
+
+
+class SimulatedNode(RpcNode):
+    """RPC transport answering from a SimulatedChain instead of the network, with `latency` seconds added to
+    every request and `failure_rate` of the requests failing like an unavailable node"""
+
+    def __init__(self, chain, latency=0.0, failure_rate=0.0):
+        super().__init__('simulator://')
+        self.chain = chain
+        self.latency = latency
+        self.failure_rate = failure_rate
+
+    def request(self, method, path, **kwargs):
+        if self.latency:
+            time.sleep(self.latency)
+        if self.failure_rate and random.random() < self.failure_rate:
+            raise RpcError(f'simulated node failure: {method} {path}')
+        with self.chain.lock:
+            self.chain.advance()
+            data = self.chain.handle(method, path.strip('/').split('/'), kwargs.get('json'))
+        res = requests.Response()
+        res.status_code = 200
+        res.headers['content-type'] = 'application/json'
+        res._content = json.dumps(data).encode()
+        return res
+
+
+_chain = None
+_chain_lock = threading.Lock()
+_admin_key = None
+
+
+def get_admin_key():
+    """{'edsk': secret key, 'pkh': address} of the chain administrator: the wallet of TEZOS_WALLET_KEYFILE,
+    or a key generated once per process when there is no wallet file"""
+    global _admin_key
+    if _admin_key is None:
+        try:
+            with open(settings.TEZOS_WALLET_KEYFILE, 'rt') as fp:
+                _admin_key = json.load(fp)
+        except FileNotFoundError:
+            key = Key.generate(export=False)
+            _admin_key = {'edsk': key.secret_key(), 'pkh': key.public_key_hash()}
+    return _admin_key
+
+
+def get_chain():
+    """Process-wide simulated chain, administered by the key of get_admin_key()"""
+    global _chain
+    if _chain is None:
+        with _chain_lock:
+            if _chain is None:
+                admin = get_admin_key()['pkh']
+                _chain = SimulatedChain(admin, block_time=settings.TEZOS_SIMULATOR_BLOCK_TIME,
+                                        failure_rate=settings.TEZOS_SIMULATOR_FAILURE_RATE,
+                                        drop_rate=settings.TEZOS_SIMULATOR_DROP_RATE)
+    return _chain
+
+
+def reset():
+    """Start again from an empty chain"""
+    global _chain
+    _chain = None
@@ -0,0 +1,10 @@
+"""
+Settings of the test suite, `python manage.py test --settings=artcrowd.test_settings`
+or DJANGO_SETTINGS_MODULE=artcrowd.test_settings for other runners
+"""
+import os
+from .settings import *  # noqa: F401,F403
+from .settings import BASE_DIR
+
+TEZOS_WALLET_KEYFILE = os.getenv('TEZOS_WALLET_KEYFILE',
+                                 os.path.join(BASE_DIR, 'artcrowd/tests/fixtures/test_wallet.json'))
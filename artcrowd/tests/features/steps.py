@@ -6,17 +6,18 @@ from rest_framework.test import APIClient
 from datetime import timedelta
 from django.utils import timezone
 import os
-from artcrowd.models import Project, Share, ProjectUpdate
+from artcrowd.blockchain import PurchaseSnapshot
+from artcrowd.models import OutboxOperation, Project, Share, ProjectUpdate
 from artcrowd.serializers import ProjectUpdateSerializer
 
 User = get_user_model()
 
 def before_scenario(context, scenario):
-    context.mock_blockchain = patch('blockchain')
-    context.mock_blockchain.start()
+    context.blockchain_patch = patch('artcrowd.api.blockchain')
+    context.mock_blockchain = context.blockchain_patch.start()
 
 def after_scenario(context, scenario):
-    context.mock_blockchain.stop()
+    context.blockchain_patch.stop()
 
 
 @given('I am an authenticated user')
@@ -108,8 +109,8 @@ def step_previous_shares(context):
 
 @when('I buy {num_shares:d} shares')
 def step_buy_shares(context, num_shares):
-        context.mock_blockchain.get_wallet_money.return_value = context.deposited_amount
-        context.mock_blockchain.get_bought_shares.return_value = num_shares
+        context.mock_blockchain.get_purchase_snapshot.return_value = PurchaseSnapshot(
+            'BLhead', context.deposited_amount)
         url = f'/api/projects/{context.project.pk}/buy/'
         data = {'quantity': num_shares, 'wallet': 'test_wallet', 'ophash': 'test_ophash'}
         context.response = context.client.post(url, data, format='json')
@@ -126,11 +127,11 @@ def step_project_shares_updated(context):
 
 @then('my funds should be refunded')
 def step_funds_refunded(context):
-    context.mock_blockchain.refund.assert_called()
+    assert OutboxOperation.objects.filter(kind=OutboxOperation.REFUND).exists()
 
 @then('a token should be generated for me')
 def step_token_generated(context):
-    context.mock_blockchain.generate_token.assert_called()
+    assert OutboxOperation.objects.filter(kind=OutboxOperation.GENERATE_TOKEN).exists()
 
 @then('the additional shares should be allocated to me')
 def step_additional_shares_allocated(context):
@@ -1,15 +1,25 @@
-from django.test import TestCase
+import gzip
+import io
+import json
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.utils import timezone
 from rest_framework import status
 from rest_framework.test import APITestCase
 from rest_framework.authtoken.models import Token
 from unittest.mock import patch
-from artcrowd.models import User, Group, Project, ProjectUpdate, Share
+from artcrowd.blockchain import PurchaseSnapshot
+from artcrowd.cron import close_expired_projects
+from artcrowd.models import User, Group, Project, ProjectUpdate, Share, OutboxOperation, PendingOperation, UserStats
 
 
 class TestProjectsListView(APITestCase):
     def setUp(self):
+        cache.clear()
         self.artist1 = User.objects.create_user(username='artist1', password='password')
         self.artist2 = User.objects.create_user(username='artist2', password='password')
         self.presenter = User.objects.create_user(username='presenter', password='password')
@@ -62,6 +72,339 @@ class TestProjectsListView(APITestCase):
         self.assertContains(response, self.project3.title)
 
 
+class TestProjectsListQueries(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.artist = User.objects.create_user(username='artist', password='password')
+        self.presenter = User.objects.create_user(username='presenter', password='password')
+
+    def create_projects(self, count):
+        for i in range(count):
+            project = Project.objects.create(artist=self.artist, presenter=self.presenter, status=Project.OPEN,
+                                             share_price=1, deadline=timezone.now(), title=f'project {i}')
+            ProjectUpdate.objects.create(project=project, author=self.artist, description='first')
+            ProjectUpdate.objects.create(project=project, author=self.artist, description=f'latest {i}')
+
+    def list_projects(self, limit):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('projects') + f'?ordering=id&limit={limit}')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return json.loads(response.content)['results'], len(queries)
+
+    def test_query_count_does_not_depend_on_the_number_of_projects(self):
+        self.create_projects(2)
+        data, few_queries = self.list_projects(2)
+        self.create_projects(10)
+        data, many_queries = self.list_projects(12)
+        self.assertEqual(few_queries, many_queries)
+        self.assertEqual(len(data), 12)
+        self.assertEqual([project['last_update']['description'] for project in data[:3]],
+                         ['latest 0', 'latest 1', 'latest 0'])
+        self.assertEqual((data[0]['artist']['username'], data[0]['presenter']['username']), ('artist', 'presenter'))
+
+
+class TestProjectsCursorPagination(APITestCase):
+    def setUp(self):
+        cache.clear()
+        artist = User.objects.create_user(username='artist', password='password')
+        now = timezone.now()
+        self.projects = [Project.objects.create(artist=artist, status=Project.OPEN, share_price=1,
+                                                deadline=now + timezone.timedelta(days=i % 5)) for i in range(25)]
+
+    def pages(self, url):
+        ids, queries = [], []
+        while url:
+            with CaptureQueriesContext(connection) as captured:
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            data = json.loads(response.content)
+            ids += [project['id'] for project in data['results']]
+            queries.append(len(captured))
+            url = data['next']
+        return ids, queries
+
+    def test_pages_by_creation(self):
+        ids, queries = self.pages(reverse('projects') + '?pagination=cursor&limit=10')
+        self.assertEqual(ids, [project.id for project in reversed(self.projects)])
+        self.assertEqual(queries, [2, 2, 2])  # page and latest updates, no count
+
+    def test_pages_by_deadline(self):
+        ids, queries = self.pages(reverse('projects') + '?pagination=cursor&limit=10&ordering=deadline')
+        self.assertEqual(ids, [project.id for project in sorted(self.projects, key=lambda p: (p.deadline, p.id))])
+
+    def test_count_is_optional(self):
+        url = reverse('projects') + '?pagination=cursor&limit=10'
+        self.assertNotIn('count', json.loads(self.client.get(url).content))
+        self.assertEqual(json.loads(self.client.get(url + '&count=true').content)['count'], 25)
+
+
+class TestProjectSubresources(APITestCase):
+    def setUp(self):
+        cache.clear()
+        artist = User.objects.create_user(username='artist', password='password')
+        patrons = [User.objects.create_user(username=f'patron{i}', password='password') for i in range(3)]
+        self.project = Project.objects.create(artist=artist, status=Project.OPEN, share_price=1,
+                                              deadline=timezone.now())
+        self.shares = [Share.objects.create(project=self.project, patron=patrons[i % 3], quantity=1)
+                       for i in range(25)]
+        self.updates = [ProjectUpdate.objects.create(project=self.project, author=artist, description=f'update {i}')
+                        for i in range(12)]
+
+    def test_detail_embeds_the_latest(self):
+        response = self.client.get(reverse('project', args=[self.project.id]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = json.loads(response.content)
+        self.assertEqual((len(data['shares']), data['shares_count']), (10, 25))
+        self.assertEqual((len(data['updates']), data['updates_count']), (10, 12))
+        self.assertEqual(data['updates'][0]['id'], self.updates[-1].id)
+
+    def test_shares_pages(self):
+        url, patrons = reverse('project_shares', args=[self.project.id]) + '?limit=10', []
+        while url:
+            with self.assertNumQueries(2):  # project and page with the patrons
+                response = self.client.get(url)
+            patrons += [share['patron']['username'] for share in response.data['results']]
+            url = response.data['next']
+        self.assertEqual(patrons, [share.patron.username for share in reversed(self.shares)])
+
+    def test_updates_pages(self):
+        response = self.client.get(reverse('project_updates', args=[self.project.id]))
+        self.assertEqual([update['id'] for update in response.data['results']],
+                         [update.id for update in reversed(self.updates)])
+        self.assertEqual(self.client.get(reverse('project_updates', args=[0])).status_code,
+                         status.HTTP_404_NOT_FOUND)
+
+    def test_update_detail(self):
+        update = self.updates[3]
+        response = self.client.get(reverse('project_update_detail', args=[self.project.id, update.id]))
+        self.assertEqual(response.data['description'], update.description)
+        self.assertEqual(self.client.get(reverse('project_update_detail', args=[0, update.id])).status_code,
+                         status.HTTP_404_NOT_FOUND)
+
+
+class TestProjectsResponseCache(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.artist = User.objects.create_user(username='artist', password='password')
+        self.project1, self.project2 = [Project.objects.create(artist=self.artist, status=Project.OPEN, share_price=1,
+                                                               deadline=timezone.now()) for i in range(2)]
+
+    def test_hits_skip_the_database(self):
+        urls = [reverse('projects'), reverse('project', args=[self.project1.id])]
+        first = [self.client.get(url).content for url in urls]
+        with self.assertNumQueries(0):
+            self.assertEqual([self.client.get(url).content for url in urls], first)
+        response = self.client.get(urls[0], HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual((response['Content-Encoding'], gzip.decompress(response.content)), ('gzip', first[0]))
+        for accept_encoding in ('gzip;q=0, deflate', 'identity', 'br, *;q=0'):
+            response = self.client.get(urls[0], HTTP_ACCEPT_ENCODING=accept_encoding)
+            self.assertEqual((response.get('Content-Encoding'), response.content), (None, first[0]))
+        response = self.client.get(urls[0], HTTP_ACCEPT_ENCODING='br, *;q=0.5')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+
+    def test_writes_invalidate_the_project_and_the_lists(self):
+        urls = [reverse('projects'), reverse('project', args=[self.project1.id]),
+                reverse('project', args=[self.project2.id])]
+        for url in urls:
+            self.client.get(url)
+        with self.captureOnCommitCallbacks() as callbacks:
+            Share.objects.create(project=self.project1, patron=self.artist, quantity=3)
+        with self.assertNumQueries(0):  # not committed yet, the cached response stands
+            self.client.get(urls[1])
+        for callback in callbacks:
+            callback()
+        self.assertEqual(json.loads(self.client.get(urls[1]).content)['shares_num'], 3)
+        self.assertEqual(json.loads(self.client.get(urls[0]).content)['results'][0]['shares_num'], 3)
+        with self.assertNumQueries(0):
+            self.client.get(urls[2])
+
+    def test_user_changes_invalidate_their_projects(self):
+        urls = [reverse('projects'), reverse('project', args=[self.project1.id])]
+        for url in urls:
+            self.client.get(url)
+        self.artist.save(update_fields=['last_login'])
+        with self.assertNumQueries(0):
+            self.client.get(urls[1])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.artist.username = 'renamed'
+            self.artist.save()
+        self.assertEqual(json.loads(self.client.get(urls[1]).content)['artist']['username'], 'renamed')
+        self.assertEqual(json.loads(self.client.get(urls[0]).content)['results'][0]['artist']['username'], 'renamed')
+
+    def test_authenticated_details_are_not_cached(self):
+        self.client.force_authenticate(self.artist)
+        url = reverse('project', args=[self.project1.id])
+        self.client.get(url)
+        self.assertIn('can_post_update', self.client.get(url).data)  # a fresh response, not a cached body
+
+
+class TestConditionalGet(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.artist = User.objects.create_user(username='artist', password='password')
+        self.patron = User.objects.create_user(username='patron', password='password')
+        self.project = Project.objects.create(artist=self.artist, status=Project.OPEN, share_price=1,
+                                              deadline=timezone.now())
+
+    def test_project_detail(self):
+        url = reverse('project', args=[self.project.id])
+        self.client.force_authenticate(self.patron)
+        etag = self.client.get(url)['ETag']
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_304_NOT_MODIFIED)
+        Share.objects.create(project=self.project, patron=self.patron, quantity=1)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_project_detail_follows_embedded_objects(self):
+        url = reverse('project', args=[self.project.id])
+        self.client.force_authenticate(self.patron)
+        older = ProjectUpdate.objects.create(project=self.project, author=self.artist, description='first')
+        ProjectUpdate.objects.create(project=self.project, author=self.artist, description='second')
+        Share.objects.create(project=self.project, patron=self.patron, quantity=1)
+        older.description = 'edited'
+        self.patron.avatar = 'avatars/patron.png'
+        for change in (older.save, older.delete, self.patron.save):  # an older update, their count, a patron
+            etag = self.client.get(url)['ETag']
+            change()
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_200_OK)
+
+    def test_cached_project_detail(self):
+        url = reverse('project', args=[self.project.id])
+        etag = self.client.get(url)['ETag']
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_profile(self):
+        url = reverse('profile', args=['patron'])
+        etag = self.client.get(url)['ETag']
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_304_NOT_MODIFIED)
+        Share.objects.create(project=self.project, patron=self.patron, quantity=1)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual((response.status_code, response.data['supported_projects_num']), (status.HTTP_200_OK, 1))
+        self.assertEqual(self.client.get(reverse('profile', args=['nobody'])).status_code,
+                         status.HTTP_404_NOT_FOUND)
+
+
+class TestShareTotals(TestCase):
+    def setUp(self):
+        self.patron1 = User.objects.create_user(username='patron1', password='password')
+        self.patron2 = User.objects.create_user(username='patron2', password='password')
+        self.project = Project.objects.create(status=Project.OPEN, share_price=2, max_shares=10,
+                                              deadline=timezone.now() + timezone.timedelta(days=1))
+
+    def totals(self):
+        return Project.objects.values_list(*Project.TOTALS).get(id=self.project.id)
+
+    def test_shares_update_the_totals(self):
+        Share.objects.create(project=self.project, patron=self.patron1, quantity=3)
+        Share.objects.create(project=self.project, patron=self.patron1, quantity=1)
+        last = Share.objects.create(project=self.project, patron=self.patron2, quantity=2)
+        self.project.save()  # stale totals of the loaded project are not written back
+        self.assertEqual(self.totals(), (6, 12, 2, last.purchased_on))
+        last.delete()
+        self.assertEqual(self.totals()[:3], (4, 8, 1))
+        Project.objects.filter(id=self.project.id).update(shares_num=0, patrons_count=0)
+        call_command('rebuild_share_totals', stdout=io.StringIO())
+        self.assertEqual(self.totals()[:3], (4, 8, 1))
+
+    def test_moved_shares_update_both_projects(self):
+        other = Project.objects.create(status=Project.OPEN, share_price=1, deadline=self.project.deadline)
+        share = Share.objects.create(project=self.project, patron=self.patron1, quantity=3)
+        share.project = other
+        share.save()
+        self.assertEqual(self.totals()[:3], (0, 0, 0))
+        self.assertEqual(Project.objects.values_list('shares_num', 'shares_sum').get(id=other.id), (3, 3))
+        share = Share.objects.get(id=share.id)
+        share.project, share.patron = self.project, self.patron2
+        share.save()
+        self.assertEqual(self.totals()[:3], (3, 6, 1))
+        self.assertEqual(UserStats.objects.get(user=self.patron1).shares_num, 0)
+
+    def test_sold_out_projects_are_closed(self):
+        Share.objects.create(project=self.project, patron=self.patron1, quantity=10)
+        close_expired_projects()
+        self.project.refresh_from_db()
+        self.assertEqual(self.project.status, Project.SALE_CLOSED)
+
+
+class TestUserStats(APITestCase):
+    def setUp(self):
+        self.artist = User.objects.create_user(username='artist', password='password')
+        self.gallery = User.objects.create_user(username='gallery', password='password')
+        self.patron = User.objects.create_user(username='patron', password='password')
+
+    def stats(self, user):
+        return UserStats.objects.values_list(*UserStats.COUNTS).get(user=user)
+
+    def test_stats_follow_projects_and_shares(self):
+        projects = [Project.objects.create(artist=self.artist, presenter=self.gallery, status=Project.OPEN,
+                                           share_price=1, deadline=timezone.now()) for i in range(3)]
+        projects[2].artist = self.gallery
+        projects[2].save()
+        Share.objects.create(project=projects[0], patron=self.patron, quantity=2)
+        Share.objects.create(project=projects[0], patron=self.patron, quantity=1)
+        share = Share.objects.create(project=projects[1], patron=self.patron, quantity=5)
+        share.delete()
+        projects[1].delete()
+        expected = [self.stats(user) for user in (self.artist, self.gallery, self.patron)]
+        self.assertEqual(expected, [(1, 0, 0, 0), (1, 2, 0, 0), (0, 0, 1, 3)])
+        UserStats.objects.update(created_projects_num=0, presented_projects_num=0, shares_num=0)
+        call_command('rebuild_user_stats', stdout=io.StringIO())
+        self.assertEqual([self.stats(user) for user in (self.artist, self.gallery, self.patron)], expected)
+
+    def test_profile_reads_one_row(self):
+        Project.objects.create(artist=self.artist, status=Project.OPEN, share_price=1, deadline=timezone.now())
+        with self.assertNumQueries(2):  # validators and the user with the stats
+            response = self.client.get(reverse('profile', args=['artist']))
+        self.assertEqual((response.data['created_projects_num'], response.data['supported_projects_num']), (1, 0))
+
+
+class TestProjectSearch(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.monet = User.objects.create_user(username='monet', password='password')
+        self.turner = User.objects.create_user(username='turner', password='password')
+        self.projects = [Project.objects.create(
+            artist=artist, status=Project.OPEN, share_price=1, deadline=timezone.now(), title=title,
+            description=description, nft_description=nft_description) for artist, title, description, nft_description in
+            ((self.monet, 'Water lilies', 'Painted in the garden at Giverny', 'A pond'),
+             (self.turner, 'The fighting Temeraire', 'A ship towed to be broken up', 'Sunset over water'),
+             (self.turner, 'Rain, steam and speed', 'The great western railway', 'A train in the rain'))]
+
+    def search(self, text, params=''):
+        response = self.client.get(reverse('projects') + f'?q={text}{params}')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [project['id'] for project in json.loads(response.content)['results']]
+
+    def test_ranked_matches(self):
+        lilies, temeraire, rain = self.projects
+        self.assertEqual(self.search('water'), [lilies.id, temeraire.id])  # the title first
+        self.assertEqual(self.search('rain train'), [rain.id])
+        self.assertEqual(self.search('giver'), [lilies.id])  # the last word is a prefix
+        self.assertCountEqual(self.search('turner'), [rain.id, temeraire.id])
+        self.assertCountEqual(self.search('turner" (*'), [rain.id, temeraire.id])  # not a query syntax
+        self.assertEqual(self.search('turner', '&ordering=id'), [temeraire.id, rain.id])
+        self.assertEqual(self.search('turner', '&artist=monet'), [])
+
+    def test_index_follows_changes(self):
+        lilies, temeraire, rain = self.projects
+        with self.captureOnCommitCallbacks(execute=True):
+            temeraire.title = 'Snow storm'
+            temeraire.save()
+        self.assertEqual(self.search('fighting'), [])
+        self.assertEqual(self.search('snow'), [temeraire.id])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.turner.username = 'william'
+            self.turner.save()
+        self.assertCountEqual(self.search('william'), [rain.id, temeraire.id])
+        with self.captureOnCommitCallbacks(execute=True):
+            rain.delete()
+        self.assertEqual(self.search('william'), [temeraire.id])
+
+
 class TestProjectCreateView(APITestCase):
     def setUp(self):
         self.artist = User.objects.create_user(username='artist', password='password')
@@ -141,10 +484,12 @@ class TestProjectUpdateView(APITestCase):
 
 class BuySharesViewTestCase(TestCase):
     def setUp(self):
+        Group.objects.get_or_create(name='Artist')
         self.project = Project.objects.create(
             title='Test Project',
             share_price=10,
             max_shares=100,
+            deadline=timezone.now() + timezone.timedelta(days=7),
         )
         self.url = reverse('buy_shares', args=[self.project.id])
         self.data = {
@@ -154,35 +499,99 @@ class BuySharesViewTestCase(TestCase):
         }
 
     ## Happy path
-    @patch('blockchain.get_wallet_money')
-    @patch('blockchain.get_bought_shares')
-    @patch('blockchain.buy_shares')
-    def test_buy_shares_success(self, mock_buy_shares, mock_get_bought_shares, mock_get_wallet_money):
-        mock_get_wallet_money.return_value = 1000
-        mock_get_bought_shares.return_value = 50
+    @patch('artcrowd.blockchain.get_purchase_snapshot')
+    def test_buy_shares_success(self, mock_get_purchase_snapshot):
+        mock_get_purchase_snapshot.return_value = PurchaseSnapshot('BLhead', 1000)
         response = self.client.post(self.url, self.data, format='json')
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
-        mock_buy_shares.assert_called_once_with(self.project, self.data['wallet'], self.data['quantity'])
+        share = Share.objects.get(ophash=self.data['ophash'])
+        operation = OutboxOperation.objects.get(kind=OutboxOperation.BUY_SHARES)
+        self.assertEqual(operation.project, self.project)
+        self.assertEqual(operation.payload, {'wallet': self.data['wallet'], 'num_shares': self.data['quantity'],
+                                             'share_id': share.id})
 
     ## BadRequest is raised
-    @patch('blockchain.get_wallet_money')
-    @patch('blockchain.get_bought_shares')
-    @patch('blockchain.refund')
-    def test_buy_shares_not_enough_money(self, mock_refund, mock_get_bought_shares, mock_get_wallet_money):
-        mock_get_wallet_money.return_value = 50
-        mock_get_bought_shares.return_value = 50
+    @patch('artcrowd.blockchain.get_purchase_snapshot')
+    def test_buy_shares_not_enough_money(self, mock_get_purchase_snapshot):
+        mock_get_purchase_snapshot.return_value = PurchaseSnapshot('BLhead', 50)
         response = self.client.post(self.url, self.data, format='json')
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
         self.assertEqual(response.data, {'detail': 'Not enough money'})
-        mock_refund.assert_called_once_with(self.project, self.data['wallet'])
-
-    @patch('blockchain.get_wallet_money')
-    @patch('blockchain.get_bought_shares')
-    @patch('blockchain.refund')
-    def test_buy_shares_max_shares_exceeded(self, mock_refund, mock_get_bought_shares, mock_get_wallet_money):
-        mock_get_wallet_money.return_value = 1000
-        mock_get_bought_shares.return_value = 90
+        operation = OutboxOperation.objects.get(kind=OutboxOperation.REFUND)
+        self.assertEqual(operation.payload, {'wallet': self.data['wallet']})
+        self.assertFalse(Share.objects.exists())
+
+    @patch('artcrowd.blockchain.get_purchase_snapshot')
+    def test_buy_shares_max_shares_exceeded(self, mock_get_purchase_snapshot):
+        mock_get_purchase_snapshot.return_value = PurchaseSnapshot('BLhead', 1000)
+        Share.objects.create(project=self.project, quantity=91, ophash='other')
+        response = self.client.post(self.url, self.data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data, {'detail': 'There are only 9 shares left to buy'})
+        operation = OutboxOperation.objects.get(kind=OutboxOperation.REFUND)
+        self.assertEqual(operation.payload, {'wallet': self.data['wallet']})
+
+    @patch('artcrowd.blockchain.get_purchase_snapshot')
+    def test_purchases_not_on_chain_yet_are_spent(self, mock_get_purchase_snapshot):
+        mock_get_purchase_snapshot.return_value = PurchaseSnapshot('BLhead', 150)  # the ledger before both
         response = self.client.post(self.url, self.data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        response = self.client.post(self.url, dict(self.data, ophash='second'), format='json')
+        self.assertEqual(response.data, {'detail': 'Not enough money'})
+        self.assertEqual(Share.objects.count(), 1)
+
+    @patch('artcrowd.blockchain.get_purchase_snapshot')
+    def test_no_refund_while_a_purchase_may_be_included(self, mock_get_purchase_snapshot):
+        mock_get_purchase_snapshot.return_value = PurchaseSnapshot('BLhead', 150)
+        self.client.post(self.url, self.data, format='json')
+        OutboxOperation.objects.update(status=OutboxOperation.SENT, ophash='ooSent')
+        response = self.client.post(self.url, dict(self.data, ophash='second'), format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(OutboxOperation.objects.filter(kind=OutboxOperation.REFUND).exists())
+
+    @patch('artcrowd.blockchain.get_purchase_snapshot')
+    def test_purchase_failed_on_chain_is_taken_back(self, mock_get_purchase_snapshot):
+        mock_get_purchase_snapshot.return_value = PurchaseSnapshot('BLhead', 1000)
+        Share.objects.create(project=self.project, quantity=90, ophash='other')
+        self.client.post(self.url, self.data, format='json')
+        self.project.refresh_from_db()
+        self.assertEqual((self.project.status, self.project.shares_num), (Project.SALE_CLOSED, 100))
+        OutboxOperation.objects.update(status=OutboxOperation.SENT, ophash='ooBuy')
+        PendingOperation.objects.create(ophash='ooBuy', kind=PendingOperation.OUTBOX)
+        pending = PendingOperation.objects.get(ophash='ooBuy')
+        pending.status, pending.error = PendingOperation.FAILED, 'MUTEZ_UNDERFLOW'
+        pending.save()
+        share = Share.objects.get(ophash=self.data['ophash'])
+        self.assertEqual(share.status, Share.FAILED)
+        self.project.refresh_from_db()
+        self.assertEqual((self.project.status, self.project.shares_num), (Project.OPEN, 90))
+        self.assertEqual(OutboxOperation.objects.filter(kind=OutboxOperation.BUY_SHARES).get().status,
+                         OutboxOperation.FAILED)
+        self.assertEqual(OutboxOperation.objects.filter(kind=OutboxOperation.UPDATE_PROJECT_STATUS).last().payload,
+                         {'status': Project.OPEN})
+
+
+class HoldingsViewTestCase(APITestCase):
+    def setUp(self):
+        self.url = reverse('holdings')
+        self.data = {'wallets': ['tz1a'], 'project_ids': [1], 'token_ids': [0]}
+
+    def test_staff_only(self):
+        self.client.force_authenticate(User.objects.create_user(username='patron', password='password'))
+        response = self.client.post(self.url, self.data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    @patch('artcrowd.blockchain.get_holdings')
+    def test_holdings(self, mock_get_holdings):
+        mock_get_holdings.return_value = ('BLindexed', {'tz1a': {'money': 5, 'shares': {1: 3}, 'tokens': {0: 3}}})
+        self.client.force_authenticate(User.objects.create_user(username='admin', password='password', is_staff=True))
+        response = self.client.post(self.url, self.data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['block_hash'], 'BLindexed')
+        mock_get_holdings.assert_called_once_with(**self.data)
+
+    @override_settings(HOLDINGS_MAX_LOOKUPS=2)
+    def test_lookups_are_capped(self):
+        self.client.force_authenticate(User.objects.create_user(username='admin', password='password', is_staff=True))
+        response = self.client.post(self.url, {**self.data, 'wallets': ['tz1a', 'tz1b']}, format='json')
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
-        self.assertEqual(response.data, {'detail': 'There are only 10 shares left to buy'})
-        mock_refund.assert_called_once_with(self.project, self.data['wallet'])
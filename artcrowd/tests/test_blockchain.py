@@ -0,0 +1,259 @@
+import os
+import json
+import tempfile
+from datetime import timedelta
+from django.conf import settings
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from unittest.mock import patch
+from pytezos.michelson.parse import michelson_to_micheline
+from artcrowd import blockchain
+from pytezos.crypto.key import Key
+from artcrowd.models import AccountCounter, GasProfile, WalletPublicKey
+from artcrowd.management.commands.calibrate_gas import fit
+
+PROJECTS_CODE = michelson_to_micheline('''
+parameter (or (pair %update_project_status string nat)
+              (or (pair %buy_shares (pair nat address) nat) (pair %refund_all nat (list address))));
+storage (pair (big_map %ledger address mutez)
+              (pair (big_map %projects nat (pair (string %status) (pair (mutez %share_price) (nat %total_shares))))
+                    (big_map %shares (pair nat address) nat)));
+code { CDR; NIL operation; PAIR }
+''')
+ADDRESS = 'KT1WYtFLhxmBkLYJrBg4xaA6sStnMuTwZA57'
+
+
+class TestContractRegistry(SimpleTestCase):
+    def setUp(self):
+        blockchain._contracts.clear()
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        blockchain._contracts.clear()
+
+    @patch('artcrowd.blockchain._fetch_code', return_value=PROJECTS_CODE)
+    def test_contract_is_loaded_once(self, mock_fetch_code):
+        with override_settings(TEZOS_SCRIPT_CACHE_DIR=None):
+            contract = blockchain.get_contract(ADDRESS)
+            self.assertIs(blockchain.get_contract(ADDRESS), contract)
+        mock_fetch_code.assert_called_once_with(ADDRESS)
+        self.assertIn('update_project_status', contract.entrypoints)
+        self.assertEqual(contract.address, ADDRESS)
+
+    @patch('artcrowd.blockchain._fetch_code', return_value=PROJECTS_CODE)
+    def test_code_is_cached_on_disk(self, mock_fetch_code):
+        with override_settings(TEZOS_SCRIPT_CACHE_DIR=self.cache_dir):
+            blockchain.get_contract(ADDRESS)
+            blockchain._contracts.clear()
+            contract = blockchain.get_contract(ADDRESS)
+        mock_fetch_code.assert_called_once_with(ADDRESS)
+        self.assertIn('buy_shares', contract.entrypoints)
+
+    @patch('artcrowd.blockchain._fetch_code', return_value=PROJECTS_CODE)
+    def test_corrupted_disk_cache_is_refetched(self, mock_fetch_code):
+        with open(os.path.join(self.cache_dir, f'{ADDRESS}.json'), 'wt') as fp:
+            json.dump({'address': ADDRESS, 'code_hash': 'bad', 'code': []}, fp)
+        with override_settings(TEZOS_SCRIPT_CACHE_DIR=self.cache_dir):
+            contract = blockchain.get_contract(ADDRESS)
+        mock_fetch_code.assert_called_once_with(ADDRESS)
+        self.assertIn('buy_shares', contract.entrypoints)
+
+
+class TestLazyClient(SimpleTestCase):
+    def setUp(self):
+        self.client_before = blockchain._client
+        blockchain._client = None
+
+    def tearDown(self):
+        blockchain._client = self.client_before
+
+    def test_wallet_file_is_read_on_first_use(self):
+        with override_settings(TEZOS_WALLET_KEYFILE='/nonexistent/wallet.json'):
+            with self.assertRaises(FileNotFoundError):
+                blockchain.get_client()
+        client = blockchain.get_client()
+        self.assertIs(blockchain.get_client(), client)
+
+    def test_fork_resets_client(self):
+        blockchain.get_client()
+        blockchain.reset()
+        self.assertIsNone(blockchain._client)
+
+
+class TestBlockCache(SimpleTestCase):
+    def test_reads_are_shared_within_block(self):
+        cache = blockchain.BlockCache(maxsize=10, max_blocks=2)
+        reads = []
+        read = lambda: reads.append(1) or len(reads)
+        self.assertEqual(cache.get_or_read('BLa', 'key', read), 1)
+        self.assertEqual(cache.get_or_read('BLa', 'key', read), 1)
+        self.assertEqual(cache.get_or_read('BLb', 'key', read), 2)
+        self.assertEqual(len(reads), 2)
+
+    def test_blocks_are_kept_side_by_side(self):
+        cache = blockchain.BlockCache(maxsize=10, max_blocks=2)
+        reads = []
+        read = lambda: reads.append(1) or len(reads)
+        for block_hash in ('BLhead', 'BLindexed', 'BLhead', 'BLindexed'):
+            cache.get_or_read(block_hash, 'key', read)
+        self.assertEqual(len(reads), 2)
+        cache.get_or_read('BLnext', 'key', read)  # the block read least recently goes
+        self.assertEqual(set(cache._values), {('BLindexed', 'key'), ('BLnext', 'key')})
+
+    def test_size_is_bounded(self):
+        cache = blockchain.BlockCache(maxsize=2, max_blocks=2)
+        for key in ('a', 'b', 'c'):
+            cache.get_or_read('BLa', key, lambda: key)
+        self.assertEqual(len(cache._values), 2)
+        self.assertNotIn(('BLa', 'a'), cache._values)
+
+    def test_failed_read_is_not_cached(self):
+        cache = blockchain.BlockCache(maxsize=10, max_blocks=2)
+        with self.assertRaises(KeyError):
+            cache.get_or_read('BLa', 'key', lambda: {}['missing'])
+        self.assertEqual(cache.get_or_read('BLa', 'key', lambda: 5), 5)
+
+    @patch('artcrowd.blockchain.get_head_hash', return_value='BLa')
+    @patch('artcrowd.blockchain._read_big_map', return_value=None)
+    def test_wallet_money_defaults_to_zero(self, mock_read_big_map, mock_get_head_hash):
+        blockchain._read_cache.clear()
+        self.assertEqual(blockchain.get_wallet_money('tz1wallet'), 0)
+        self.assertEqual(blockchain.get_wallet_money('tz1wallet'), 0)
+        mock_read_big_map.assert_called_once()
+
+
+class TestPurchaseSnapshot(SimpleTestCase):
+    @patch('artcrowd.blockchain.get_head_hash', return_value='BLpinned')
+    @patch('artcrowd.blockchain._read_big_map')
+    def test_money_is_read_at_the_head(self, mock_read_big_map, mock_get_head_hash):
+        blockchain._read_cache.clear()
+        mock_read_big_map.return_value = 5_000_000
+        with override_settings(TEZOS_READ_FROM_INDEX=True):  # the index lags behind, a deposit could be missed
+            snapshot = blockchain.get_purchase_snapshot('tz1wallet')
+        self.assertEqual(snapshot, blockchain.PurchaseSnapshot('BLpinned', 5_000_000))
+        mock_read_big_map.assert_called_once_with(settings.PROJECTS_CONTRACT, 'ledger', 'tz1wallet', 'BLpinned')
+
+
+class TestHoldings(SimpleTestCase):
+    @override_settings(TEZOS_READ_FROM_INDEX=False, TEZOS_BALANCE_BATCH=2)
+    @patch('artcrowd.blockchain._token_balances')
+    @patch('artcrowd.blockchain.read_big_map')
+    def test_bulk_lookup(self, mock_read_big_map, mock_token_balances):
+        mock_read_big_map.side_effect = lambda address, name, key, block_hash: \
+            {'ledger': {'tz1a': 5}, 'shares': {(1, 'tz1b'): 3}}[name].get(key)
+        mock_token_balances.side_effect = lambda requests, block_hash: \
+            [(request['owner'], request['token_id'], 1) for request in requests]
+        block_hash, holdings = blockchain.get_holdings(['tz1a', 'tz1b', 'tz1c'], project_ids=[1], token_ids=[0],
+                                                       block_hash='BLpinned')
+        self.assertEqual(block_hash, 'BLpinned')
+        self.assertEqual(holdings['tz1a'], {'money': 5, 'shares': {1: 0}, 'tokens': {0: 1}})
+        self.assertEqual(holdings['tz1b'], {'money': 0, 'shares': {1: 3}, 'tokens': {0: 1}})
+        self.assertEqual(mock_token_balances.call_count, 2)
+        self.assertEqual({call.args[3] for call in mock_read_big_map.call_args_list}, {'BLpinned'})
+
+    @override_settings(TEZOS_READ_FROM_INDEX=True)
+    @patch('artcrowd.blockchain.get_head_hash')
+    @patch('artcrowd.blockchain._token_balances', return_value=[('tz1a', 0, 1)])
+    @patch('artcrowd.blockchain.indexer')
+    def test_balances_are_read_at_the_indexed_block(self, mock_indexer, mock_token_balances, mock_get_head_hash):
+        mock_indexer.get_holdings.return_value = ('BLindexed', {'tz1a': {'money': 5, 'shares': {1: 3}}})
+        self.assertEqual(blockchain.get_holdings(['tz1a'], project_ids=[1], token_ids=[0]),
+                         ('BLindexed', {'tz1a': {'money': 5, 'shares': {1: 3}, 'tokens': {0: 1}}}))
+        self.assertEqual(mock_token_balances.call_args.args[1], 'BLindexed')
+        mock_get_head_hash.assert_not_called()
+
+
+class TestCounterAllocator(TestCase):
+    @patch('artcrowd.blockchain._chain_counter', return_value=41)
+    def test_counters_are_consecutive(self, mock_chain_counter):
+        self.assertEqual(blockchain.reserve_counters(2), 42)
+        self.assertEqual(blockchain.reserve_counters(1), 44)
+        mock_chain_counter.assert_called_once()
+
+    @patch('artcrowd.blockchain._chain_counter', return_value=41)
+    def test_resync_after_rejection(self, mock_chain_counter):
+        blockchain.reserve_counters(3)
+        blockchain.resync_counter()
+        self.assertEqual(blockchain.reserve_counters(1), 42)
+        self.assertEqual(mock_chain_counter.call_count, 2)
+
+    @patch('artcrowd.blockchain._chain_counter', return_value=50)
+    def test_idle_counter_is_read_again(self, mock_chain_counter):
+        AccountCounter.objects.create(source=blockchain.get_client().key.public_key_hash(), counter=60)
+        self.assertEqual(blockchain.reserve_counters(1), 61)
+        AccountCounter.objects.update(updated_on=timezone.now() - timedelta(minutes=5))
+        self.assertEqual(blockchain.reserve_counters(1), 51)
+
+
+class TestGasProfiles(TestCase):
+    def setUp(self):
+        blockchain._contracts.clear()
+        with patch('artcrowd.blockchain._fetch_code', return_value=PROJECTS_CODE), \
+                override_settings(TEZOS_SCRIPT_CACHE_DIR=None):
+            self.contract = blockchain.get_contract(ADDRESS)
+
+    def tearDown(self):
+        blockchain._contracts.clear()
+
+    def test_param_size(self):
+        self.assertEqual(blockchain.param_size({'int': '1'}), 1)
+        self.assertEqual(blockchain.param_size({'prim': 'Pair', 'args': [{'int': '1'}, [{'string': 'a'}] * 3]}), 3)
+
+    @override_settings(TEZOS_GAS_MARGIN=0.5)
+    def test_limits_come_from_profiles(self):
+        call = self.contract.update_project_status('open', 1)
+        self.assertIsNone(blockchain.profiled_limits([call]))
+        GasProfile.objects.create(contract=ADDRESS, entrypoint='update_project_status', gas_base=1000, storage_base=60)
+        self.assertEqual(blockchain.profiled_limits([call]), [(1500, 90)])
+        GasProfile.objects.update(stale=True)
+        self.assertIsNone(blockchain.profiled_limits([call]))
+
+    def test_fit(self):
+        self.assertEqual(fit({1: 1100, 10: 2000}), (1000, 100))
+        self.assertEqual(fit({1: 500}), (500, 0))
+
+    @override_settings(TEZOS_GAS_MARGIN=0)
+    @patch('artcrowd.blockchain.protocol_limits', return_value=(10000, 60000, 10 ** 6))
+    def test_chunks_fill_groups(self, mock_protocol_limits):
+        GasProfile.objects.create(contract=ADDRESS, entrypoint='update_project_status', gas_base=1000, storage_base=0)
+        GasProfile.objects.create(contract=ADDRESS, entrypoint='refund_all', gas_base=1000, gas_per_item=100,
+                                  storage_base=0)
+        status_op = self.contract.update_project_status('refunded', 1)
+        refund = lambda chunk, index: self.contract.refund_all(1, chunk)
+        chunks = blockchain.plan_chunks([ADDRESS] * 200, refund, reserved=[status_op])
+        self.assertEqual([len(chunk) for chunk in chunks], [80, 90, 30])
+        groups = blockchain.plan_groups([status_op] + [refund(chunk, i) for i, chunk in enumerate(chunks)])
+        self.assertEqual([len(group) for group in groups], [2, 1, 1])
+
+    def test_chunks_without_profile(self):
+        chunks = blockchain.plan_chunks([ADDRESS] * 1200, lambda chunk, index: self.contract.refund_all(1, chunk))
+        self.assertEqual([len(chunk) for chunk in chunks], [500, 500, 200])
+
+
+class TestPublicKeyCache(TestCase):
+    def setUp(self):
+        blockchain.get_public_key.cache_clear()
+        self.key = Key.generate(export=False)
+        self.wallet = self.key.public_key_hash()
+
+    def tearDown(self):
+        blockchain.get_public_key.cache_clear()
+
+    @patch('artcrowd.blockchain.get_client')
+    def test_key_is_read_from_node_once(self, mock_get_client):
+        mock_manager_key = mock_get_client.return_value.shell.contracts.__getitem__.return_value.manager_key
+        mock_manager_key.return_value = self.key.public_key()
+        signature = self.key.sign('login')
+        self.assertTrue(blockchain.validate_signature(self.wallet, signature, 'login'))
+        blockchain.get_public_key.cache_clear()
+        self.assertTrue(blockchain.validate_signature(self.wallet, signature, 'login'))
+        self.assertFalse(blockchain.validate_signature(self.wallet, signature, 'other'))
+        mock_manager_key.assert_called_once()
+        self.assertTrue(WalletPublicKey.objects.filter(wallet=self.wallet).exists())
+
+    @patch('artcrowd.blockchain.get_client')
+    def test_foreign_key_is_rejected(self, mock_get_client):
+        mock_get_client.return_value.shell.contracts.__getitem__.return_value.manager_key.return_value = \
+            Key.generate(export=False).public_key()
+        self.assertFalse(blockchain.validate_signature(self.wallet, self.key.sign('login'), 'login'))
+        self.assertFalse(WalletPublicKey.objects.exists())
@@ -0,0 +1,46 @@
+import os
+from unittest.mock import patch
+from django.core.management import call_command
+from django.test import TestCase
+from artcrowd import indexer
+from artcrowd.models import ChainCursor, ChainLedger, ChainProject, ChainShares, ChainToken
+
+FIXTURE = os.path.join(os.path.dirname(__file__), 'fixtures', 'chain_blocks.json')
+PATRON = 'tz1aSkwEot3L2kmUvcoxzjMomb9mvBNuzFK6'
+
+
+class TestIndexer(TestCase):
+    def test_replay_fixture(self):
+        call_command('index_chain', fixture=FIXTURE, start_level=100, stdout=open(os.devnull, 'w'))
+        cursor = ChainCursor.objects.get(name=indexer.CURSOR_NAME)
+        self.assertEqual((cursor.level, cursor.block_hash), (102, 'BLockFixture102'))
+        self.assertEqual(ChainProject.objects.get(project_id=1).total_shares, 3)  # backtracked op is ignored
+        self.assertEqual(ChainShares.objects.get(project_id=1, wallet=PATRON).shares, 3)
+        self.assertFalse(ChainLedger.objects.filter(wallet=PATRON).exists())  # removed by internal refund
+        self.assertEqual(list(ChainToken.objects.values_list('token_id', 'ophash')), [(0, 'ooMint')])
+        self.assertEqual(indexer.get_bought_shares(1), 3)
+        self.assertEqual(indexer.get_holdings([PATRON], [1, 2]),
+                         ('BLockFixture102', {PATRON: {'money': 0, 'shares': {1: 3, 2: 0}}}))
+        self.assertTrue(indexer.is_synced())
+
+    def test_sync_resumes_from_cursor(self):
+        chain_indexer = indexer.Indexer(indexer.FixtureBlockSource(FIXTURE))
+        chain_indexer.process_block(chain_indexer.source.block(100))
+        self.assertEqual(indexer.get_wallet_money(PATRON), 5_000_000)
+        self.assertEqual(chain_indexer.sync(confirmations=1), 1)
+        self.assertEqual(indexer.get_wallet_money(PATRON), 2_000_000)
+        self.assertEqual(chain_indexer.get_cursor().level, 101)
+
+    def test_gap_in_chain_is_rejected(self):
+        chain_indexer = indexer.Indexer(indexer.FixtureBlockSource(FIXTURE))
+        chain_indexer.process_block(chain_indexer.source.block(100))
+        with self.assertRaises(Exception):
+            chain_indexer.process_block(chain_indexer.source.block(102), chain_indexer.get_cursor())
+
+    def test_snapshot_gives_up_when_the_index_keeps_moving(self):
+        call_command('index_chain', fixture=FIXTURE, start_level=100, stdout=open(os.devnull, 'w'))
+        with patch('artcrowd.indexer.models.ChainCursor.objects.filter') as mock_filter:
+            mock_filter.return_value.exists.return_value = False
+            with self.assertRaises(Exception):
+                indexer.get_holdings([PATRON], [1])
+        self.assertEqual(mock_filter.call_count, 3)
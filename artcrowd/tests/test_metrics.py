@@ -0,0 +1,104 @@
+import io
+import json
+import os
+import tempfile
+from functools import lru_cache
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from pytezos.crypto.key import Key
+from artcrowd import blockchain, metrics, simulator, tracker
+
+
+class TestMetrics(TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.settings = override_settings(METRICS_DIR=self.dir.name)
+        self.settings.enable()
+        metrics.clear()
+
+    def tearDown(self):
+        metrics.clear()
+        self.settings.disable()
+        self.dir.cleanup()
+
+    def test_timed(self):
+        @lru_cache
+        def square(x):
+            if x < 0:
+                raise ValueError(x)
+            return x * x
+
+        square = metrics.timed(square)
+        self.assertEqual(square(3), 9)
+        with self.assertRaises(ValueError):
+            square(-1)
+        square.cache_clear()
+        call = metrics.snapshot()['calls']['square']
+        self.assertEqual((call['count'], call['errors'], sum(call['buckets'])), (2, 1, 2))
+
+    def test_collect_merges_processes(self):
+        metrics.observe('get_head_hash', 0.02)
+        metrics.add('operations', 'buy_shares', 2)
+        other = {'calls': {'get_head_hash': {'count': 1, 'errors': 1, 'sum': 40.0,
+                                             'buckets': [0] * len(metrics.LATENCY_BUCKETS) + [1]}},
+                 'totals': {'operations': {'buy_shares': 1, 'mint': 1}}}
+        with open(os.path.join(self.dir.name, '1-1.json'), 'wt') as fp:
+            json.dump(other, fp)
+        data = metrics.collect()
+        call = data['calls']['get_head_hash']
+        self.assertEqual((call['count'], call['errors'], call['sum']), (2, 1, 40.02))
+        self.assertEqual(data['totals']['operations'], {'buy_shares': 3, 'mint': 1})
+        self.assertEqual((metrics.quantile(call, 0.5), metrics.quantile(call, 0.95)), (0.025, None))
+        text = metrics.render(data)
+        self.assertIn('artcrowd_blockchain_call_seconds_bucket{function="get_head_hash",le="0.025"} 1', text)
+        self.assertIn('artcrowd_blockchain_call_seconds_bucket{function="get_head_hash",le="+Inf"} 2', text)
+        self.assertIn('artcrowd_blockchain_operations_total{entrypoint="mint"} 1', text)
+
+    def test_nothing_is_written_without_data(self):
+        metrics.flush(force=True)
+        self.assertEqual(os.listdir(self.dir.name), [])
+
+    def test_files_of_exited_processes_are_compacted(self):
+        metrics.add('operations', 'mint')
+        for process_id in ('999999999-1', '999999999-2'):  # above the largest pid
+            with open(os.path.join(self.dir.name, f'{process_id}.json'), 'wt') as fp:
+                json.dump({'calls': {}, 'totals': {'operations': {'buy_shares': 1}}}, fp)
+        self.assertEqual(metrics.collect()['totals']['operations'], {'buy_shares': 2, 'mint': 1})
+        self.assertEqual(metrics.collect()['totals']['operations'], {'buy_shares': 2, 'mint': 1})
+        self.assertEqual(sorted(filename for filename in os.listdir(self.dir.name) if filename.endswith('.json')),
+                         sorted([metrics.COMPACTED, f'{metrics._process_id}.json']))
+
+    @override_settings(METRICS_TOKEN='secret')
+    def test_endpoint(self):
+        metrics.observe('get_wallet_money', 0.1)
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        response = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'artcrowd_blockchain_calls_total{function="get_wallet_money"} 1', response.content)
+
+    @override_settings(TEZOS_BACKEND='simulator', TEZOS_SIMULATOR_BLOCK_TIME=0,
+                       TEZOS_HEAD_TTL=0, TEZOS_READ_FROM_INDEX=False)
+    def test_blockchain_calls(self):
+        simulator.reset()
+        blockchain.reset()
+        try:
+            project = type('Project', (), {'id': 1, 'share_price': 2, 'status': 'open'})()
+            wallet = Key.generate(export=False).public_key_hash()
+            blockchain.inject(blockchain.sign(blockchain.create_project_ops(project)), confirmations=1)
+            simulator.get_chain().deposit(wallet, 10_000_000)
+            blockchain.get_wallet_money(wallet)
+            tracker.count_gas(simulator.get_chain().blocks[-2]['operations'][3][0])
+        finally:
+            simulator.reset()
+            blockchain.reset()
+        data = metrics.snapshot()
+        self.assertEqual(data['calls']['get_wallet_money']['count'], 1)
+        self.assertEqual((data['calls']['sign']['count'], data['calls']['inject']['count']), (1, 1))
+        self.assertNotIn('param_size', data['calls'])
+        self.assertEqual(data['totals']['operations'], {'create_project': 1, 'update_project_status': 1})
+        self.assertGreater(data['totals']['operation_bytes']['create_project'], 0)
+        self.assertGreater(data['totals']['operation_gas']['create_project'], 0)
+        out = io.StringIO()
+        call_command('report_metrics', stdout=out)
+        self.assertIn('get_wallet_money', out.getvalue())
+        self.assertIn('create_project', out.getvalue())
@@ -0,0 +1,67 @@
+from django.test import TestCase
+from unittest.mock import patch, MagicMock
+from artcrowd import minting
+from artcrowd.models import MintingChunk, MintingJob, PendingOperation, Project
+from artcrowd.tests.test_outbox import make_project
+
+
+@patch('artcrowd.minting.blockchain')
+class TestMintingJob(TestCase):
+    def setUp(self):
+        self.job = minting.create_job(make_project(status=Project.COMPLETED), 'https://example.com/meta')
+
+    def prepare(self, mock_blockchain):
+        mock_blockchain.read_storage.return_value = {'next_token_id': 7}
+        mock_blockchain.plan_mint_chunks.return_value = [[('tz1a', 1), ('tz1b', 2)], [('tz1c', 3)]]
+        mock_blockchain.mint_op.side_effect = lambda token_id, meta_url, holdings, new_token: holdings[0][0]
+        mock_blockchain.sign.side_effect = lambda ops: MagicMock(**{'hash.return_value': f'oo{len(ops)}{ops[-1]}'})
+        mock_blockchain.settle_project_ops.return_value = ['status', 'withdraw']
+        mock_blockchain.get_minted_token_id.return_value = 8
+
+    def confirm(self, ophash, status=PendingOperation.APPLIED):
+        PendingOperation.objects.filter(ophash=ophash).update(status=status, level=100)
+
+    def test_chunks_are_sent_one_by_one(self, mock_blockchain):
+        self.prepare(mock_blockchain)
+        self.assertEqual(minting.run(self.job), MintingJob.RUNNING)
+        self.assertEqual(list(self.job.chunks.values_list('holdings', 'status', 'ophash')), [
+            ([['tz1a', 1]], MintingChunk.SENT, 'oo3tz1a'),  # only creates the token
+            ([['tz1b', 2]], MintingChunk.PENDING, ''),
+            ([['tz1c', 3]], MintingChunk.PENDING, ''),
+        ])
+        self.assertEqual(minting.run(self.job), MintingJob.RUNNING)  # not included yet
+        self.assertEqual(mock_blockchain.inject.call_count, 1)
+
+        self.confirm('oo3tz1a')
+        minting.run(self.job)
+        mock_blockchain.get_minted_token_id.assert_called_once_with('oo3tz1a', '')
+        self.confirm('oo1tz1b')
+        minting.run(self.job)
+        self.confirm('oo1tz1c')
+        self.assertEqual(minting.run(self.job), MintingJob.DONE)
+        self.assertEqual(mock_blockchain.inject.call_count, 3)
+        mock_blockchain.mint_op.assert_called_with(8, 'https://example.com/meta', [['tz1c', 3]], False)
+        self.assertEqual(MintingJob.objects.get().token_id, 8)
+
+    def test_resumed_job_does_not_resend_applied_chunks(self, mock_blockchain):
+        self.prepare(mock_blockchain)
+        minting.run(self.job)
+        self.confirm('oo3tz1a')
+        minting.pause(MintingJob.objects.all())
+        self.assertEqual(minting.run(MintingJob.objects.get()), MintingJob.PAUSED)
+        minting.resume(MintingJob.objects.all())
+        minting.run(MintingJob.objects.get())
+        self.assertEqual(mock_blockchain.inject.call_count, 2)
+        self.assertEqual(self.job.chunks.get(index=0).status, MintingChunk.APPLIED)
+        mock_blockchain.read_storage.assert_called_once()
+
+    def test_failed_chunk_stops_the_job(self, mock_blockchain):
+        self.prepare(mock_blockchain)
+        minting.run(self.job)
+        self.confirm('oo3tz1a', PendingOperation.BACKTRACKED)
+        self.assertEqual(minting.run(self.job), MintingJob.FAILED)
+        chunk = self.job.chunks.get(index=0)
+        self.assertEqual((chunk.status, chunk.ophash), (MintingChunk.PENDING, ''))
+        minting.resume(MintingJob.objects.all())
+        minting.run(MintingJob.objects.get())
+        self.assertEqual(mock_blockchain.inject.call_count, 2)
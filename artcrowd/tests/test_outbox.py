@@ -0,0 +1,91 @@
+from datetime import timedelta
+from django.test import TestCase
+from django.utils import timezone
+from unittest.mock import patch, MagicMock
+from artcrowd import outbox, cron
+from artcrowd.models import Project, OutboxOperation
+
+
+def make_project(**kwargs):
+    return Project.objects.create(**{
+        'title': 'Test Project', 'description': 'Test', 'nft_description': 'Test', 'share_price': 10,
+        'deadline': timezone.now() + timedelta(days=7), **kwargs})
+
+
+@patch('artcrowd.outbox.blockchain')
+class TestOutboxDispatcher(TestCase):
+    def setUp(self):
+        self.project = make_project(status=Project.SALE_CLOSED)
+        self.wallets = ['tz1a', 'tz1b', 'tz1c']
+        for wallet in self.wallets:
+            outbox.enqueue(OutboxOperation.REFUND, self.project, wallet=wallet)
+
+    def test_operations_are_sent_in_one_group(self, mock_blockchain):
+        mock_blockchain.plan_groups.side_effect = lambda ops: [ops]
+        mock_blockchain.refund_ops.side_effect = lambda wallet: [wallet]
+        mock_blockchain.sign.return_value.hash.return_value = 'ooGroup'
+        self.assertEqual(outbox.dispatch(), 3)
+        mock_blockchain.sign.assert_called_once_with(self.wallets)
+        mock_blockchain.inject.assert_called_once()
+        self.assertEqual(set(OutboxOperation.objects.values_list('status', 'ophash')),
+                         {(OutboxOperation.SENT, 'ooGroup')})
+        self.assertEqual(outbox.dispatch(), 0)
+
+    def test_rejected_group_is_split(self, mock_blockchain):
+        mock_blockchain.plan_groups.side_effect = lambda ops: [ops]
+        mock_blockchain.refund_ops.side_effect = lambda wallet: [wallet]
+
+        def sign(ops):
+            if 'tz1b' in ops:
+                raise Exception('script failed')
+            return MagicMock(**{'hash.return_value': f'oo{len(ops)}'})
+        mock_blockchain.sign.side_effect = sign
+        outbox.dispatch()
+        self.assertEqual(mock_blockchain.inject.call_count, 2)
+        failed = OutboxOperation.objects.get(payload__wallet='tz1b')
+        self.assertEqual((failed.status, failed.attempts, failed.error), (OutboxOperation.PENDING, 1, 'script failed'))
+        self.assertGreater(failed.next_attempt_on, timezone.now())
+        self.assertEqual(OutboxOperation.objects.filter(status=OutboxOperation.SENT).count(), 2)
+
+    def test_gives_up_after_max_attempts(self, mock_blockchain):
+        mock_blockchain.plan_groups.side_effect = lambda ops: [ops]
+        mock_blockchain.sign.side_effect = Exception('node is down')
+        operation = OutboxOperation.objects.first()
+        with self.settings(OUTBOX_MAX_ATTEMPTS=1):
+            outbox.send([operation])
+        operation.refresh_from_db()
+        self.assertEqual(operation.status, OutboxOperation.FAILED)
+
+    def test_groups_are_sent_one_after_another(self, mock_blockchain):
+        mock_blockchain.plan_groups.side_effect = lambda ops: [[op] for op in ops]
+        mock_blockchain.refund_ops.side_effect = lambda wallet: [wallet]
+        mock_blockchain.sign.side_effect = lambda ops: MagicMock(**{'hash.return_value': f'oo{ops[0]}'})
+        outbox.dispatch()
+        self.assertEqual([call.kwargs['confirmations'] for call in mock_blockchain.inject.call_args_list], [1, 1, 0])
+        self.assertEqual(set(OutboxOperation.objects.values_list('payload__wallet', 'status', 'ophash')),
+                         {(wallet, OutboxOperation.SENT, f'oo{wallet}') for wallet in self.wallets})
+
+    def test_partly_injected_operations_are_not_resent(self, mock_blockchain):
+        mock_blockchain.plan_groups.side_effect = lambda ops: [[op] for op in ops]
+        mock_blockchain.refund_ops.side_effect = lambda wallet: [wallet, wallet] if wallet == 'tz1b' else [wallet]
+        mock_blockchain.sign.side_effect = lambda ops: MagicMock(**{'hash.return_value': f'oo{ops[0]}'})
+        mock_blockchain.inject.side_effect = [None, None, Exception('node is down')]
+        outbox.dispatch()
+        self.assertEqual(mock_blockchain.sign.call_count, 3)
+        self.assertEqual(set(OutboxOperation.objects.values_list('payload__wallet', 'status', 'ophash')), {
+            ('tz1a', OutboxOperation.SENT, 'ootz1a'),
+            ('tz1b', OutboxOperation.FAILED, 'ootz1b'),  # first call of the refund is on chain
+            ('tz1c', OutboxOperation.PENDING, ''),
+        })
+
+
+class TestCloseExpiredProjects(TestCase):
+    def test_status_update_is_recorded_with_project(self):
+        project = make_project(status=Project.OPEN)
+        Project.objects.filter(id=project.id).update(deadline=timezone.now() - timedelta(hours=1))
+        cron.close_expired_projects()
+        project.refresh_from_db()
+        self.assertEqual(project.status, Project.SALE_CLOSED)
+        operation = OutboxOperation.objects.get(project=project)
+        self.assertEqual((operation.kind, operation.payload),
+                         (OutboxOperation.UPDATE_PROJECT_STATUS, {'status': Project.SALE_CLOSED}))
@@ -0,0 +1,103 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from django.test import SimpleTestCase
+from pytezos.rpc.node import RpcError, RpcNotFoundError
+from artcrowd import rpc
+
+
+BLOCK = 'BKiHLREqU3JkXfzEDYAkmmfX48gBDtYhMrpA98s7Aq4SzbUAB6M'
+
+
+def start_node(level=100, status=200, delay=0, blocks=(BLOCK,)):
+    """Stand-in RPC node answering every GET with a block header, `blocks` are the block hashes it knows"""
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            server.requests += 1
+            time.sleep(delay)
+            body = json.dumps({'level': level}).encode() if status == 200 else b'[]'
+            unknown = BLOCK in self.path and BLOCK not in blocks
+            self.send_response(404 if self.path.endswith('/missing') or unknown else status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.requests = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class TestPooledRpcNode(SimpleTestCase):
+    def setUp(self):
+        self.servers = []
+
+    def tearDown(self):
+        for server in self.servers:
+            server.shutdown()
+            server.server_close()
+
+    def make_node(self, *servers, **kwargs):
+        self.servers += servers
+        uris = [f'http://127.0.0.1:{server.server_address[1]}' for server in servers]
+        return rpc.PooledRpcNode(uris, **{'head_check_interval': 0, **kwargs})
+
+    def test_fails_over_to_healthy_node(self):
+        broken, healthy = start_node(status=500), start_node()
+        node = self.make_node(broken, healthy, failure_threshold=2)
+        for _ in range(5):
+            self.assertEqual(node.get('chains/main/blocks/head/header')['level'], 100)
+        self.assertTrue(node.nodes[0].is_open())
+        self.assertLessEqual(broken.requests, 2)
+        self.assertEqual(healthy.requests, 5)
+
+    def test_slow_node_trips_breaker(self):
+        slow, fast = start_node(delay=0.3), start_node()
+        node = self.make_node(slow, fast, failure_threshold=1, slow=0.2)
+        for _ in range(10):
+            node.get('chains/main/blocks/head/header')
+        self.assertLessEqual(slow.requests, 1)
+        self.assertGreater(node.nodes[1].latency, 0)
+
+    def test_lagging_node_is_avoided(self):
+        lagging, synced = start_node(level=90), start_node(level=100)
+        node = self.make_node(lagging, synced)
+        node.check_heads()
+        requests_before = lagging.requests
+        for _ in range(5):
+            node.get('chains/main/blocks/head/header')
+        self.assertEqual(lagging.requests, requests_before)
+
+    def test_client_errors_are_not_retried(self):
+        first, second = start_node(), start_node()
+        node = self.make_node(first, second)
+        with self.assertRaises(RpcNotFoundError):
+            node.get('missing')
+        self.assertEqual(first.requests + second.requests, 1)
+
+    def test_pinned_reads_go_to_nodes_knowing_the_block(self):
+        behind, synced = start_node(blocks=()), start_node()
+        node = self.make_node(behind, synced)
+        for _ in range(5):
+            self.assertEqual(node.get(f'chains/main/blocks/{BLOCK}/header')['level'], 100)
+        self.assertEqual(synced.requests, 5)
+        with self.assertRaises(RpcNotFoundError):  # known block, missing key
+            node.get(f'chains/main/blocks/{BLOCK}/context/missing')
+
+    def test_heads_are_checked_in_the_background(self):
+        node = self.make_node(start_node(level=90), start_node(level=100), head_check_interval=0.01)
+        for _ in range(100):
+            if None not in [state.level for state in node.nodes]:
+                break
+            time.sleep(0.01)
+        self.assertEqual([state.level for state in node.nodes], [90, 100])
+
+    def test_all_nodes_down(self):
+        node = self.make_node(start_node(status=500), start_node(status=503))
+        with self.assertRaises(RpcError):
+            node.get('chains/main/blocks/head/header')
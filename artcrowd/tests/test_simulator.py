@@ -0,0 +1,107 @@
+from django.conf import settings
+import io
+from unittest.mock import patch
+from django.contrib.auth.models import Group
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from pytezos.crypto.key import Key
+from pytezos.rpc.node import RpcError
+from artcrowd import blockchain, indexer, simulator, tracker
+from artcrowd.models import ChainLedger, ChainProject, MintingJob, OutboxOperation, PendingOperation
+
+
+@override_settings(TEZOS_BACKEND='simulator', TEZOS_SIMULATOR_BLOCK_TIME=0, TEZOS_HEAD_TTL=0,
+                   TEZOS_READ_FROM_INDEX=False)
+class TestSimulator(TestCase):
+    def setUp(self):
+        simulator.reset()
+        blockchain.reset()
+        self.chain = simulator.get_chain()
+        self.project = type('Project', (), {'id': 1, 'share_price': 2, 'status': 'open'})()
+        self.wallet = Key.generate(export=False).public_key_hash()
+        self.send(blockchain.create_project_ops(self.project))
+
+    def tearDown(self):
+        simulator.reset()
+        blockchain.reset()
+
+    def send(self, ops, confirmations=1):
+        return blockchain.inject(blockchain.sign(ops), confirmations=confirmations)
+
+    def test_buy_and_refund(self):
+        self.chain.deposit(self.wallet, 10_000_000)
+        self.send(blockchain.buy_shares_ops(self.project, self.wallet, 3))
+        self.assertEqual(blockchain.get_purchase_snapshot(self.wallet).wallet_money, 4_000_000)
+        self.assertEqual(blockchain.get_bought_shares(self.project), 3)
+        balance = self.chain.accounts[self.wallet]['balance']
+        self.send(blockchain.refund_all_ops(self.project, [self.wallet]))
+        self.assertIsNone(blockchain.read_big_map(settings.PROJECTS_CONTRACT, 'shares', (1, self.wallet)))
+        self.assertEqual(blockchain.get_bought_shares(self.project), 0)
+        self.assertEqual(self.chain.accounts[self.wallet]['balance'], balance + 6_000_000)
+
+    def test_refund_returns_the_deposit(self):
+        self.chain.deposit(self.wallet, 10_000_000)
+        balance = self.chain.accounts[self.wallet]['balance']
+        self.send(blockchain.refund_ops(self.wallet))
+        self.assertEqual(blockchain.get_wallet_money(self.wallet), 0)
+        self.assertEqual(self.chain.accounts[self.wallet]['balance'], balance + 10_000_000)
+
+    def test_reads_are_pinned_to_a_block(self):
+        self.chain.deposit(self.wallet, 10_000_000)
+        block_hash = blockchain.get_head_hash()
+        self.send(blockchain.buy_shares_ops(self.project, self.wallet, 1))
+        self.assertEqual(blockchain.read_big_map(settings.PROJECTS_CONTRACT, 'ledger', self.wallet, block_hash),
+                         10_000_000)
+        self.assertEqual(blockchain.get_wallet_money(self.wallet), 8_000_000)
+
+    def test_mint(self):
+        other = Key.generate(export=False).public_key_hash()
+        ophash = self.send([blockchain.mint_op(0, 'https://artcrowd.test/meta', [(self.wallet, 3), (other, 2)], True)])
+        self.assertEqual(blockchain.get_minted_token_id(ophash, self.chain.blocks[-1]['hash']), 0)
+        self.send([blockchain.mint_op(0, 'https://artcrowd.test/meta', [(other, 1)], False)])
+        self.assertEqual(blockchain.read_storage(settings.GALLERY_CONTRACT)['next_token_id'], 1)
+        block_hash, holdings = blockchain.get_holdings([self.wallet, other], token_ids=[0])
+        self.assertEqual((holdings[self.wallet]['tokens'], holdings[other]['tokens']), ({0: 3}, {0: 3}))
+
+    def test_failed_operation_is_included_without_effect(self):
+        self.chain.failure_rate = 1
+        with self.assertRaises(RpcError):
+            self.send(blockchain.update_project_status_ops(type('Project', (), {'id': 1, 'status': 'closed'})))
+        operation = self.chain.blocks[-1]['operations'][3][0]
+        self.assertEqual(tracker.operation_status(operation)[0], PendingOperation.FAILED)
+        self.assertEqual(blockchain.read_big_map(settings.PROJECTS_CONTRACT, 'projects', 1)['status'], 'open')
+
+    def test_one_pending_group_per_source(self):
+        self.chain.block_time = 60
+        self.send(blockchain.update_project_status_ops(self.project), confirmations=0)
+        with self.assertRaisesRegex(RpcError, 'operation_conflict'):
+            self.send(blockchain.update_project_status_ops(self.project), confirmations=0)
+        self.chain.bake()
+        self.send(blockchain.update_project_status_ops(self.project), confirmations=0)
+
+    def test_indexer_and_tracker_follow_blocks(self):
+        ophash = self.chain.deposit(self.wallet, 5_000_000)
+        tracker.register(ophash, PendingOperation.SHARE)
+        source = indexer.NodeBlockSource()
+        tracker.Tracker(source).sync(start_level=1, confirmations=0)
+        indexer.Indexer(source).sync(start_level=1, confirmations=0)
+        self.assertEqual(PendingOperation.objects.get(ophash=ophash).status, PendingOperation.APPLIED)
+        self.assertEqual(ChainLedger.objects.get(wallet=self.wallet).amount, 5_000_000)
+        self.assertEqual(ChainProject.objects.get(project_id=1).status, 'open')
+
+    @override_settings(TEZOS_WALLET_KEYFILE='/nonexistent/wallet.json')
+    def test_admin_key_is_generated_without_wallet_file(self):
+        with patch.object(simulator, '_admin_key', None):
+            simulator.reset()
+            blockchain.reset()
+            pkh = simulator.get_admin_key()['pkh']
+            self.assertEqual(simulator.get_chain().admin, pkh)
+            self.assertEqual(blockchain.get_client().key.public_key_hash(), pkh)
+
+    def test_api_benchmark(self):
+        Group.objects.get_or_create(name='Artist')
+        out = io.StringIO()
+        call_command('benchmark_api', patrons=6, short=0.5, keep=True, stdout=out)
+        self.assertIn('job done', out.getvalue())
+        self.assertEqual(OutboxOperation.objects.exclude(status=OutboxOperation.SENT).count(), 0)
+        self.assertEqual(MintingJob.objects.get().status, MintingJob.DONE)
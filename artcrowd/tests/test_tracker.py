@@ -0,0 +1,83 @@
+import copy
+import os
+from datetime import timedelta
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APITestCase
+from artcrowd import tracker
+from artcrowd.indexer import FixtureBlockSource
+from artcrowd.models import OutboxOperation, PendingOperation, Project, User
+
+FIXTURE = os.path.join(os.path.dirname(__file__), 'fixtures', 'chain_blocks.json')
+
+
+class TestTracker(TestCase):
+    def setUp(self):
+        self.tracker = tracker.Tracker(FixtureBlockSource(FIXTURE))
+
+    def test_status_is_recorded(self):
+        tracker.register('ooBuyShares', PendingOperation.SHARE)
+        tracker.register('ooFailedBuy', PendingOperation.OUTBOX)
+        tracker.register('ooNeverIncluded', PendingOperation.OUTBOX)
+        self.assertEqual(self.tracker.sync(start_level=100, confirmations=0), 3)
+
+        applied = PendingOperation.objects.get(ophash='ooBuyShares')
+        self.assertEqual(applied.status, PendingOperation.APPLIED)
+        self.assertEqual((applied.level, applied.block_hash), (101, 'BLockFixture101'))
+        failed = PendingOperation.objects.get(ophash='ooFailedBuy')
+        self.assertEqual(failed.status, PendingOperation.BACKTRACKED)
+        self.assertEqual(PendingOperation.objects.get(ophash='ooNeverIncluded').status, PendingOperation.PENDING)
+
+    def test_reorganisation_is_rewound(self):
+        tracker.register('ooBuyShares', PendingOperation.SHARE)
+        self.tracker.sync(start_level=100, confirmations=0)
+        blocks = self.tracker.source.blocks
+        buy = blocks[101]['operations'][-1][0]
+        for level, operations in ((101, []), (102, []), (103, [buy])):
+            block = copy.deepcopy(blocks[101])
+            block['hash'], block['header']['level'] = f'BLockFork{level}', level
+            block['header']['predecessor'] = f'BLockFork{level - 1}' if level > 101 else 'BLockFixture100'
+            block['operations'][-1] = operations
+            blocks[level] = block
+        self.assertEqual(self.tracker.sync(confirmations=0), 3)
+
+        applied = PendingOperation.objects.get(ophash='ooBuyShares')
+        self.assertEqual((applied.status, applied.level, applied.block_hash),
+                         (PendingOperation.APPLIED, 103, 'BLockFork103'))
+        self.assertEqual(self.tracker.get_cursor().block_hash, 'BLockFork103')
+
+    @override_settings(TRACKER_OPERATION_TTL=1)
+    def test_operations_expire_by_block(self):
+        tracker.register('ooNeverIncluded', PendingOperation.OUTBOX)
+        tracker.register('ooOld', PendingOperation.OUTBOX)
+        PendingOperation.objects.update(created_on=timezone.now() - timedelta(days=1))
+        PendingOperation.objects.filter(ophash='ooOld').update(seen_level=98)
+        self.tracker.sync(start_level=100, confirmations=0)
+        self.assertEqual(PendingOperation.objects.get(ophash='ooOld').status, PendingOperation.EXPIRED)
+        # seen with the head at 102, blocks up to 103 may include it whatever its age
+        unseen = PendingOperation.objects.get(ophash='ooNeverIncluded')
+        self.assertEqual((unseen.status, unseen.seen_level), (PendingOperation.PENDING, 102))
+
+    @override_settings(TRACKER_OPERATION_TTL=1)
+    def test_expired_purchases_are_taken_back(self):
+        artist = User.objects.create_user(username='artist', password='password')
+        project = Project.objects.create(artist=artist, status=Project.OPEN, share_price=1, deadline=timezone.now())
+        operation = OutboxOperation.objects.create(kind=OutboxOperation.CREATE_PROJECT, project=project,
+                                                   status=OutboxOperation.SENT, ophash='ooOld')
+        PendingOperation.objects.create(ophash='ooOld', kind=PendingOperation.OUTBOX, seen_level=98)
+        self.tracker.sync(start_level=100, confirmations=0)
+        operation.refresh_from_db()
+        self.assertEqual(operation.status, OutboxOperation.FAILED)
+        self.assertIn('expired', operation.error)
+
+
+class TestOperationStatusView(APITestCase):
+    def test_status(self):
+        PendingOperation.objects.create(ophash='ooBuyShares', kind=PendingOperation.SHARE,
+                                        status=PendingOperation.APPLIED, level=101)
+        response = self.client.get(reverse('operation_status', args=('ooBuyShares',)))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['status'], PendingOperation.APPLIED)
+        self.assertEqual(response.data['level'], 101)
+        self.assertEqual(self.client.get(reverse('operation_status', args=('ooUnknown',))).status_code, 404)
@@ -0,0 +1,65 @@
+import json
+from django.conf import settings
+from . import metrics
+from .models import PendingOperation
+from .indexer import BlockFollower
+
+
+def register(ophash, kind):
+    """Start following an injected or user-submitted operation group"""
+    PendingOperation.objects.get_or_create(ophash=ophash, defaults={'kind': kind})
+
+
+def operation_status(operation):
+    """Status of an included operation group and the errors of its first unsuccessful content"""
+    for content in operation['contents']:
+        metadata = content.get('metadata', {})
+        results = [metadata.get('operation_result', {})]
+        results += [internal.get('result', {}) for internal in metadata.get('internal_operation_results', [])]
+        for result in results:
+            if result.get('status', PendingOperation.APPLIED) != PendingOperation.APPLIED:
+                return result['status'], json.dumps(result.get('errors', []))
+    return PendingOperation.APPLIED, ''
+
+
+def count_gas(operation):
+    """Gas consumed by the contract calls of an included operation group, by entrypoint"""
+    for content in operation['contents']:
+        if 'parameters' in content:
+            result = content.get('metadata', {}).get('operation_result', {})
+            metrics.add('operation_gas', content['parameters']['entrypoint'],
+                        int(result.get('consumed_milligas', 0)) // 1000)
+
+
+class Tracker(BlockFollower):
+    """Follows new blocks and records inclusion level, status and failure reason of pending operations,
+    instead of every sender polling the node for its own operation. Only blocks TRACKER_CONFIRMATIONS deep
+    are processed, as the purchases taken back or confirmed after an inclusion are not undone by a rollback.
+    An operation expires once a processed block is max_operations_ttl blocks above the head seen with it,
+    its branch is older so it can no longer be included."""
+    cursor_name = 'operations'
+
+    def sync(self, start_level=None, confirmations=None):
+        confirmations = settings.TRACKER_CONFIRMATIONS if confirmations is None else confirmations
+        unseen = PendingOperation.objects.filter(status=PendingOperation.PENDING, seen_level=None)
+        if unseen.exists():
+            unseen.update(seen_level=self.source.head_level())
+        return super().sync(start_level, confirmations)
+
+    def handle_block(self, block):
+        operations = {operation['hash']: operation for operation in block['operations'][-1]}
+        for pending in PendingOperation.objects.filter(status=PendingOperation.PENDING, ophash__in=operations):
+            pending.status, pending.error = operation_status(operations[pending.ophash])
+            count_gas(operations[pending.ophash])
+            pending.level = block['header']['level']
+            pending.block_hash = block['hash']
+            pending.save()
+        ttl = block.get('metadata', {}).get('max_operations_ttl', settings.TRACKER_OPERATION_TTL)
+        for pending in PendingOperation.objects.filter(
+                status=PendingOperation.PENDING, seen_level__lt=block['header']['level'] - ttl):
+            pending.status = PendingOperation.EXPIRED
+            pending.save()  # the receivers take back what the operation was sent for
+
+    def rollback(self, level):
+        PendingOperation.objects.filter(level__gt=level).update(
+            status=PendingOperation.PENDING, level=None, block_hash='', error='')
@@ -16,7 +16,8 @@ urlpatterns = [
     path('create/for/<int:artist_id>', views.create_project_gallery, name='create_project_gallery'),
 
     path('api/', include(api.url_patterns)),
-    path('collection_meta.json', api.collection_meta)
+    path('collection_meta.json', api.collection_meta),
+    path('metrics', api.blockchain_metrics, name='metrics'),
 ]
 
 if settings.DEBUG:
@@ -5,6 +5,7 @@ import {
     Alert,
     Avatar,
     Box,
+    Button,
     Card,
     CardActionArea,
     CardContent,
@@ -27,6 +28,7 @@ import ProjectUpdateForm from "./update/ProjectUpdateForm";
 import BuySharesForm from "./buy/BuySharesForm";
 import {ProjectUpdate} from "../../models/ProjectUpdate";
 import {Share} from "../../models/Share";
+import {CursorPage} from "../../models/ApiResponse";
 
 // const IMAGE_STYLE_FULL_SIZE = {maxWidth: '100%', maxHeight: '900px', objectFit: 'scale-down'};
 
@@ -56,16 +58,48 @@ function CustomTabPanel(props: TabPanelProps) {
     );
 }
 
+/**
+ * A list embedded in the project details with its latest items, the following ones are loaded from
+ * its own paginated endpoint.
+ */
+function usePagedList<T>(url: string, embedded: T[] | undefined) {
+    const [items, setItems] = useState<T[]>([]);
+    // undefined until the first page is loaded, null after the last one
+    const [next, setNext] = useState<string | null>();
+
+    useEffect(() => {
+        setItems(embedded || []);
+        setNext(undefined);
+    }, [embedded])
+
+    const loadMore = () => {
+        fetch(next || url)
+            .then(response => response.json())
+            .then((page: CursorPage<T>) => {
+                // the first page starts again from the latest items
+                setItems(prevItems => next ? [...prevItems, ...page.results] : page.results);
+                setNext(page.next);
+            }).catch(error => {
+            console.log('there was an error loading the list: ', error)
+        });
+    }
+
+    return {items, setItems, hasMore: next !== null, loadMore};
+}
+
 const ProjectPage = () => {
     const {token} = useAuth();
     const fetchWithAuth = configureFetch(token);
     const {projectId} = useParams();
     const [project, setProject] = useState<Project>();
     const [tabVal, setTabVal] = React.useState(0);
+    const projectUrl = `${API_BASE_URL}${PROJECT_ENDPOINT}/${projectId}`;
+    const updates = usePagedList<ProjectUpdate>(`${projectUrl}/updates`, project?.updates);
+    const shares = usePagedList<Share>(`${projectUrl}/shares`, project?.shares);
 
     useEffect(() => {
         if (projectId) {
-            fetchWithAuth(`${API_BASE_URL}${PROJECT_ENDPOINT}/${projectId}`)
+            fetchWithAuth(projectUrl)
                 .then(response => {
                     return response.ok ? response.json() : null
                 })
@@ -79,16 +113,18 @@ const ProjectPage = () => {
         setProject((prevProject: any) => ({
             ...prevProject,
             can_post_update: false,
-            updates: [newUpdate, ...prevProject.updates],
+            updates_count: prevProject.updates_count + 1,
         }))
+        updates.setItems(prevUpdates => [newUpdate, ...prevUpdates]);
       };
 
     const handleBuyShare = (newShare: Share) => {
         setProject((prevProject: any) => ({
             ...prevProject,
             can_buy_shares: !prevProject.max_shares || (prevProject.max_shares < prevProject.num_shares + newShare.quantity),
-            shares: [newShare, ...prevProject.shares],
+            shares_count: prevProject.shares_count + 1,
         }))
+        shares.setItems(prevShares => [newShare, ...prevShares]);
       };
 
 
@@ -190,12 +226,12 @@ const ProjectPage = () => {
                 </Box> </CustomTabPanel>
 
 
-            {project.updates != null && project.updates.length > 0 && <Box sx={{paddingTop: '1rem'}}>
+            {updates.items.length > 0 && <Box sx={{paddingTop: '1rem'}}>
                 <Typography variant={'h4'}>Project updates</Typography>
                 <br/>
 
                 <Stack direction={'row'} spacing={{xs: 1, sm: 2}} flexWrap="wrap" useFlexGap>
-                    {project.updates.map((update) => (
+                    {updates.items.map((update) => (
                         <Card sx={{maxWidth: 345}}
                               key={`update from ${update.created_on}`}>
                             <CardActionArea to={`/${project.id}/${update.id}`} state={{project:project}} component={RouterLink}>
@@ -218,6 +254,8 @@ const ProjectPage = () => {
                         </Card>
                     ))}
                 </Stack>
+                {updates.hasMore && updates.items.length < project.updates_count &&
+                <Button sx={{marginTop: '1rem'}} onClick={updates.loadMore}>More updates</Button>}
             </Box>}
 
             {project.can_post_update ?
@@ -227,10 +265,10 @@ const ProjectPage = () => {
             </Box> : null}
 
 
-            {project.shares != null && project.shares.length > 0 &&
+            {shares.items.length > 0 &&
             <Box sx={{paddingTop: '1rem', borderTop: 1, borderColor: 'divider', marginTop: '1rem'}}>
                 <><Typography variant={'h4'}>Patrons</Typography>
-                    {project.shares.map((share: Record<string, any>, i: number) => {
+                    {shares.items.map((share: Record<string, any>, i: number) => {
                         return (
                             <Stack key={i.toString()}
                                    direction={'row'}
@@ -253,6 +291,8 @@ const ProjectPage = () => {
                             </Stack>
                         )
                     })}
+                    {shares.hasMore && shares.items.length < project.shares_count &&
+                    <Button sx={{marginTop: '1rem'}} onClick={shares.loadMore}>More patrons</Button>}
                 </>
             </Box>}
         </div>
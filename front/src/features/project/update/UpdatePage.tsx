@@ -35,11 +35,14 @@ function UpdatePage() {
     }, [])
 
     useEffect(() => {
-        if (project != null) {
-            const foundUpdate = project.updates.find(u => u.id === Number(updateId));
-            setUpdate(foundUpdate);
-        }
-    }, [project])
+        fetch(`${API_BASE_URL}projects/${projectId}/updates/${updateId}`)
+            .then(response => response.ok ? response.json() : undefined)
+            .then((response?: ProjectUpdate) => {
+                setUpdate(response);
+            }).catch(error => {
+            console.log('there was an error loading the update: ', error)
+        });
+    }, [projectId, updateId])
 
     return (
         <Stack direction={'column'} spacing={2}>
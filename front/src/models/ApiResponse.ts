@@ -1,4 +1,10 @@
 export type ApiResponse<Payload> = {
     results: Payload[];
     count: number
-}
\ No newline at end of file
+}
+
+export type CursorPage<Payload> = {
+    results: Payload[];
+    next: string | null;
+    previous: string | null
+}
@@ -13,6 +13,7 @@ export interface Project {
     id: number;
     image: string;
     updates: ProjectUpdate[];
+    updates_count: number;
     last_update?: ProjectUpdate;
     max_shares?: number;
     min_shares?: number
@@ -22,6 +23,7 @@ export interface Project {
     shares_num: number;
     shares_sum: number;
     shares: Share[];
+    shares_count: number;
     status: ProjectStatus;
     title: string;
     nft_description:string;